@@ -1,22 +1,27 @@
+import asyncio
+import functools
+import math
 import os
-import requests
+import threading
 import time
-from flask import Flask, request, redirect, jsonify
+from flask import Flask, Response, request, redirect, jsonify, stream_with_context
 from flask_restful import Api
 from flask_jwt_extended import JWTManager, create_access_token, create_refresh_token, get_jwt_identity, jwt_required
 from collections import Counter
 from dotenv import load_dotenv
 from urllib.parse import urlencode
-from flask_sqlalchemy import SQLAlchemy
-from flask_cors import CORS
+from cors import CORSPolicy, CORSMiddleware
 from datetime import timedelta
+from sqlalchemy import text
 import secrets
 
 # Load environment variables
 load_dotenv('.env.local')
 
-# Initialize extensions
-db = SQLAlchemy()
+# Initialize extensions (db is shared with models so create_all sees their tables)
+from models import db
+from metrics import instrument_engine
+from fanout import FANOUT_WORKERS
 api = Api()
 
 def create_app():
@@ -38,25 +43,26 @@ def create_app():
         JWT_COOKIE_CSRF_PROTECT=False,          # Disable CSRF for testing
     )
     
-    # Database configuration
-    app.config['SQLALCHEMY_DATABASE_URI'] = (
+    # Database configuration (DATABASE_URL overrides the DB_* parts, e.g. for benchmarks)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL') or (
         f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
         f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
     )
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Each fan-out thread can hold a session connection while the rate limiter opens another for its
+    # bucket visit, so the pool must fit both (SQLite keeps SQLAlchemy's default pooling)
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_size': int(os.getenv('DB_POOL_SIZE', FANOUT_WORKERS + 5)),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', FANOUT_WORKERS)),
+        }
     
     # Initialize JWT with cookie handling
     jwt = JWTManager(app)
     
-    # CORS Configuration - UPDATED
-    CORS(app, 
-        supports_credentials=True,  # Essential for cookies
-        origins=["http://localhost:3000"],
-        methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        allow_headers=["Content-Type", "Authorization"],
-        expose_headers=["Content-Type", "Authorization", "Set-Cookie"],
-        allow_credentials=True  # Allow credentials (cookies) to be sent    
-    )
+    # CORS: headers are precomputed per allowed origin and preflights are answered with 204 before
+    # routing or auth, cacheable by the browser for CORS_MAX_AGE seconds
+    app.wsgi_app = CORSMiddleware(app.wsgi_app, CORSPolicy())
     
     # Initialize database and API
     db.init_app(app)
@@ -64,7 +70,12 @@ def create_app():
     
     # Create database tables if they don't exist
     with app.app_context():
+        # Statement timings for /metrics, from SQLAlchemy's cursor events
+        instrument_engine(db.engine)
         db.create_all()
+        # create_all never touches existing tables, so add indexes newer than the table explicitly
+        db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_users_expires_at ON users (expires_at)'))
+        db.session.commit()
     
     return app
 
@@ -73,6 +84,101 @@ app = create_app()
 
 # Import models after app creation to avoid circular imports
 from models import User
+from http_client import spotify_get, spotify_get_async, spotify_post, pool_stats, API_BASE_URL, TOKEN_URL, CONNECT_TIMEOUT, READ_TIMEOUT
+from cache import create_cache, make_key, InMemoryBackend
+from fanout import fan_out, fan_out_async, run_in_background
+from token_refresher import TokenRefresher
+from ingestion import Ingester, ingest_recently_played
+from library import sync_library_if_due, library_stats
+from features import resolve_audio_features, backfill_track_features
+from artist_genres import ArtistGenreCache
+from genre_scoring import GenreScorer
+from genre_tree import GenreTaxonomy, build_genre_tree
+from exports import stream_export, EXPORTS, EXPORT_MIMETYPES
+from etags import version_etag, tag_json_response, CACHE_CONTROL
+from rate_limiter import RateLimiter, parse_retry_after, INTERACTIVE, BACKGROUND
+from singleflight import SingleFlight
+from circuit_breaker import CircuitBreakers, CIRCUIT_OPEN_ERROR, is_upstream_failure
+from deadlines import latency_budget, remaining, within_budget, BUDGET_EXHAUSTED_ERROR
+from hedging import LatencyTracker
+from flows import Step, blocking, run, run_async as run_flow_async
+from metrics import (
+    registry as metrics_registry, start_request_timer, note_response_status, record_request,
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    SPOTIFY_REQUESTS, SPOTIFY_REQUEST_DURATION, TOKEN_REFRESHES, TOKEN_REFRESH_DURATION
+)
+from feature_stats import pack_features, feature_means, summarize, history_matrix, library_matrix
+from user_stats import materialize, history_stats, update_history_stats, is_stale, COMPUTED_AT_HEADER, STALE_HEADER
+from auth import resolve_identity, get_current_user_id, verified_tokens
+
+# Per-route request counts and latencies for /metrics, recorded on teardown so requests that raise
+# count too (after_request hooks run in reverse, so the status noted is the final one, 304s included)
+app.before_request(start_request_timer)
+app.after_request(note_response_status)
+app.teardown_request(record_request)
+
+# Resolve the caller's JWT once per request, before any view runs
+app.before_request(resolve_identity)
+
+# Content-hash ETags (and 304s) for JSON API responses that were not tagged from a version already
+app.after_request(tag_json_response)
+
+# Shared cache for slow-changing Spotify responses (top items). Expired entries stand in, marked
+# stale, for views that allow it while Spotify is unavailable, and are revalidated in the background.
+response_cache = create_cache(stale_if=is_upstream_failure, revalidate=lambda call: run_in_background(app, call))
+
+# Per-endpoint breakers that stop calling Spotify while it is failing or slow
+spotify_breakers = CircuitBreakers()
+
+# App-wide Spotify call budget, shared by every worker through the rate_limit_buckets table
+rate_limiter = RateLimiter(app)
+with app.app_context():
+    rate_limiter.ensure_bucket()
+
+# Identical Spotify GETs in flight at the same time (same user, endpoint and params) share one call
+spotify_in_flight = SingleFlight()
+
+# Recent Spotify latencies per endpoint; slow interactive GETs are hedged at their p95
+spotify_latency = LatencyTracker()
+
+# Cross-user artist -> genres cache, fed by every full artist payload we fetch
+artist_genres = ArtistGenreCache()
+
+# Genre weighting shared by the genre endpoints (rank decay and range weights come from the environment)
+genre_scorer = GenreScorer()
+
+# Genre hierarchy for the sunburst view, indexed once at startup from the known genre vocabulary
+genre_taxonomy = GenreTaxonomy()
+with app.app_context():
+    genre_taxonomy.load()
+
+# Per-worker snapshots of user rows, so identity and still-valid token checks skip Postgres.
+# Every write to a user row (login, token refresh) replaces the snapshot right away.
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 60))
+user_cache = InMemoryBackend(max_entries=int(os.getenv('USER_CACHE_MAX_ENTRIES', 10000)))
+
+def cache_user(user):
+    """Stores a plain-dict snapshot of a user row (never the ORM object, which is bound to one session)."""
+    snapshot = {
+        'id': user.id,
+        'display_name': user.display_name,
+        'email': user.email,
+        'is_admin': user.is_admin,
+        'access_token': user.access_token,
+        'expires_at': user.expires_at
+    }
+    user_cache.set(user.id, snapshot, USER_CACHE_TTL)
+    return snapshot
+
+def get_cached_user(user_id):
+    """Returns the user's snapshot, loading it from the database only on a miss. `None` if the user does not exist."""
+    snapshot = user_cache.get(user_id)
+    if snapshot is None:
+        user = db.session.get(User, user_id)
+        if not user:
+            return None
+        snapshot = cache_user(user)
+    return snapshot
 
 # Spotify credentials
 CLIENT_ID = os.getenv('CLIENT_ID')
@@ -125,9 +231,8 @@ def callback():
     tokens set as cookies.
     :return: The callback function returns a response containing JSON data with a success status and a
     redirect URL to the frontend dashboard. Additionally, it sets two cookies ('access_token' and
-    'refresh_token') with JWT tokens for authentication. The response also includes specific CORS
-    headers to allow cross-origin requests from the frontend application. Finally, it logs a success
-    message indicating that the user has logged in successfully.
+    'refresh_token') with JWT tokens for authentication. Finally, it logs a success message indicating
+    that the user has logged in successfully.
     """
     # Get authorization code
     code = request.args.get('code')
@@ -135,8 +240,8 @@ def callback():
         return jsonify({'error': 'No authorization code received'}), 400
     
     # Exchange code for tokens
-    token_response = requests.post(
-        'https://accounts.spotify.com/api/token',
+    token_response = spotify_post(
+        TOKEN_URL,
         data={
             'grant_type': 'authorization_code',
             'code': code,
@@ -157,7 +262,7 @@ def callback():
     
     # Get user profile from Spotify
     headers = {'Authorization': f'Bearer {access_token}'}
-    profile_response = requests.get('https://api.spotify.com/v1/me', headers=headers)
+    profile_response = spotify_get(f'{API_BASE_URL}/me', headers=headers)
     
     if profile_response.status_code != 200:
         return jsonify({'error': 'Failed to get user profile'}), 400
@@ -188,6 +293,9 @@ def callback():
                 user.expires_at = int(time.time()) + expires_in
             
             db.session.commit()
+            # Fresh login, so drop anything cached under the previous token
+            response_cache.invalidate_user(spotify_id)
+            cache_user(user)
             
             # Create JWT tokens with user info
             jwt_access_token = create_access_token(
@@ -228,11 +336,6 @@ def callback():
             
             # Delete the state cookie that worked
             response.delete_cookie('spotify_auth_state')
-            # Add specific CORS headers to this response
-            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-            response.headers.add('Access-Control-Allow-Credentials', 'true')
-            response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-            response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
             print(f"User {spotify_id} logged in successfully, with token {jwt_access_token[:10]}...")
             return response
             
@@ -253,7 +356,7 @@ def refresh():
     max_age).
     """
     current_user_id = get_jwt_identity()
-    user = db.session.get(User, current_user_id)
+    user = get_cached_user(current_user_id)
     
     if not user:
         return jsonify({"error": "User not found"}), 404
@@ -262,9 +365,9 @@ def refresh():
     access_token = create_access_token(
         identity=current_user_id,
         additional_claims={
-            "display_name": user.display_name,
-            "email": user.email,
-            "is_admin": user.is_admin
+            "display_name": user['display_name'],
+            "email": user['email'],
+            "is_admin": user['is_admin']
         }
     )
     
@@ -300,91 +403,45 @@ def test_cookies():
 # User data endpoint
 @app.route('/api/me')
 
-@jwt_required(optional=True)
 def get_user_data():
     """
-    The function `get_user_data` retrieves user information by extracting the user ID from a JWT token
-    in various ways, including from the JWT identity, cookies, and Authorization header.
+    The function `get_user_data` retrieves user information for the user identified by the JWT in the
+    access_token cookie or the Authorization header.
     :return: The `get_user_data` function returns user data in JSON format. If the user is successfully
     authenticated and found in the database, the function returns the user's ID, display name, email,
     admin status, and a boolean indicating whether the user has a Spotify token. If the user is not
     found or if authentication fails, appropriate error messages are returned along with additional
     debug information like cookies, headers,
     """
-    # Try to get user from JWT identity first (standard flow)
-    current_user_id = get_jwt_identity()
+    # Get user ID (resolved once per request by the resolve_identity hook)
+    current_user_id = get_current_user_id()
     print(f"JWT Identity: {current_user_id}")  # Debug logging
     
-    # If standard JWT identity extraction fails, try fallback methods
+    # If we don't have a user ID, return error
     if not current_user_id:
-        print("No JWT identity found, checking fallbacks")
-        
-        # Try to extract JWT from cookie directly
-        jwt_token = request.cookies.get('access_token')
-        
-        if jwt_token:
-            print(f"Found JWT token in cookies, attempting to decode")
-            try:
-                # Manually decode the JWT token
-                from flask_jwt_extended import decode_token
-                decoded_token = decode_token(jwt_token)
-                
-                # Extract user ID from the decoded token
-                if 'sub' in decoded_token:
-                    current_user_id = decoded_token['sub']  # 'sub' is the standard claim for subject/identity
-                    print(f"Successfully extracted user ID from JWT: {current_user_id}")
-                else:
-                    print("JWT token does not contain 'sub' claim")
-            except Exception as e:
-                print(f"Error decoding JWT token: {str(e)}")
-        
-        # If we still don't have a user ID, check for Authorization header
-        if not current_user_id:
-            auth_header = request.headers.get('Authorization')
-            
-            if auth_header and auth_header.startswith('Bearer '):
-                jwt_token = auth_header[7:]  # Extract token from 'Bearer <token>'
-                print(f"Found token in Authorization header")
-                
-                try:
-                    # Manually decode the JWT token from header
-                    from flask_jwt_extended import decode_token
-                    decoded_token = decode_token(jwt_token)
-                    
-                    # Extract user ID from the decoded token
-                    if 'sub' in decoded_token:
-                        current_user_id = decoded_token['sub']
-                        print(f"Successfully extracted user ID from header JWT: {current_user_id}")
-                    else:
-                        print("JWT token in header does not contain 'sub' claim")
-                except Exception as e:
-                    print(f"Error decoding JWT token from header: {str(e)}")
-        
-        # If we still don't have a user ID after all fallbacks, return error
-        if not current_user_id:
-            return jsonify({
-                "error": "Authentication failed",
-                "debug": {
-                    "cookies": list(request.cookies.keys()),
-                    "headers": {k: v for k, v in request.headers.items() if k.lower() in ['authorization', 'content-type', 'host']},
-                    "method": request.method,
-                    "path": request.path
-                }
-            }), 401
+        return jsonify({
+            "error": "Authentication failed",
+            "debug": {
+                "cookies": list(request.cookies.keys()),
+                "headers": {k: v for k, v in request.headers.items() if k.lower() in ['authorization', 'content-type', 'host']},
+                "method": request.method,
+                "path": request.path
+            }
+        }), 401
     
-    # Now we should have a user ID one way or another, so fetch the user
-    user = db.session.get(User, current_user_id)
+    # Now we should have a user ID, so fetch the user
+    user = get_cached_user(current_user_id)
     
     if not user:
         return jsonify({"error": "User not found"}), 404
     
     # Successfully found user, return their data
     return jsonify({
-        'id': user.id,
-        'display_name': user.display_name,
-        'email': user.email,
-        'is_admin': user.is_admin,
-        'has_spotify_token': bool(user.access_token)  # Helpful for debugging
+        'id': user['id'],
+        'display_name': user['display_name'],
+        'email': user['email'],
+        'is_admin': user['is_admin'],
+        'has_spotify_token': bool(user['access_token'])  # Helpful for debugging
     })
 
 # Debug endpoint
@@ -396,8 +453,293 @@ def debug_auth():
         'headers': dict(request.headers)
     })
 
+# Connection pool stats endpoint
+@app.route('/debug/http-pool')
+def debug_http_pool():
+    """Debug endpoint reporting keep-alive connection reuse and request hedging for this worker's Spotify pool"""
+    return jsonify({**pool_stats(), 'hedging': spotify_latency.stats()})
+
+# Background token refresher stats endpoint
+@app.route('/debug/token-refresher')
+def debug_token_refresher():
+    """Debug endpoint reporting runs, refreshes and failures of the background token refresher"""
+    return jsonify(token_refresher.stats())
+
+# Background ingestion stats endpoint
+@app.route('/debug/ingestion')
+def debug_ingestion():
+    """Debug endpoint reporting runs, users polled and rows stored per job by the background ingester"""
+    return jsonify(ingester.stats())
+
+# Spotify rate limiter stats endpoint
+@app.route('/debug/rate-limit')
+def debug_rate_limit():
+    """Debug endpoint reporting the shared Spotify call budget and this worker's granted, waited and denied calls"""
+    return jsonify(rate_limiter.stats())
+
+# Circuit breaker stats endpoint
+@app.route('/debug/circuit-breakers')
+def debug_circuit_breakers():
+    """Debug endpoint reporting each Spotify endpoint's breaker state, recent error and slow-call rates, trips and rejected calls"""
+    return jsonify(spotify_breakers.stats())
+
+# Response cache stats endpoint
+@app.route('/debug/cache')
+def debug_cache():
+    """Debug endpoint reporting hit/miss counts for the Spotify response cache and the sizes of the user and verified-token caches"""
+    return jsonify({
+        **response_cache.stats(),
+        'user_cache_entries': len(user_cache),
+        'verified_token_entries': len(verified_tokens),
+        'artist_genres': artist_genres.stats(),
+        'in_flight': spotify_in_flight.stats()
+    })
+
+@metrics_registry.collector
+def collect_component_metrics():
+    """Cache, coalescing, rate-limit, breaker and hedging figures, read from the components' stats at scrape time."""
+    responses = response_cache.stats()
+    genres = artist_genres.stats()
+    genre_hits = genres['memory_hits'] + genres['table_hits']
+    caches = {
+        'response': (responses['hits'], responses['misses']),
+        'artist_genres': (genre_hits, genres['misses']),
+    }
+    in_flight = spotify_in_flight.stats()
+    breakers = spotify_breakers.stats()
+    hedging = spotify_latency.stats()
+    return [
+        ('cache_requests_total', 'counter', 'Cache lookups by cache and result.',
+         [({'cache': name, 'result': 'hit'}, hits) for name, (hits, _) in caches.items()]
+         + [({'cache': name, 'result': 'miss'}, misses) for name, (_, misses) in caches.items()]
+         + [({'cache': 'response', 'result': 'stale'}, responses['stale_hits'])]),
+        ('cache_hit_ratio', 'gauge', 'Share of cache lookups served from the cache since startup.',
+         [({'cache': name}, hits / (hits + misses) if hits + misses else 0.0) for name, (hits, misses) in caches.items()]),
+        ('cache_entries', 'gauge', 'Entries held in memory by cache.',
+         [({'cache': 'response'}, responses['entries']), ({'cache': 'users'}, len(user_cache)),
+          ({'cache': 'verified_tokens'}, len(verified_tokens)), ({'cache': 'artist_genres'}, genres['memory_entries'])]),
+        ('spotify_coalesced_requests_total', 'counter', 'Spotify calls that shared an identical call in flight.',
+         [({}, in_flight['coalesced'])]),
+        ('spotify_rate_limit_calls_total', 'counter', 'Rate limiter decisions by priority and result.',
+         [({'priority': priority, 'result': result}, count)
+          for result in ('granted', 'denied')
+          for priority, count in rate_limiter.metrics[result].items()]),
+        ('spotify_rate_limit_throttled_total', 'counter', '429 answers that blocked the shared bucket.',
+         [({}, rate_limiter.metrics['throttled'])]),
+        ('spotify_circuit_open', 'gauge', 'Whether the endpoint\'s circuit breaker refuses calls (1 open, 0.5 half-open).',
+         [({'endpoint': endpoint}, {'closed': 0, 'half_open': 0.5, 'open': 1}[stats['state']]) for endpoint, stats in breakers.items()]),
+        ('spotify_circuit_trips_total', 'counter', 'Times the endpoint\'s circuit breaker opened.',
+         [({'endpoint': endpoint}, stats['trips']) for endpoint, stats in breakers.items()]),
+        ('spotify_hedged_requests_total', 'counter', 'Hedged Spotify calls by whether the hedge answered first.',
+         [({'won': 'true'}, hedging['hedge_won']), ({'won': 'false'}, hedging['hedged'] - hedging['hedge_won'])]),
+    ]
+
+# Prometheus scrape endpoint
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of this worker's request, Spotify, token refresh, database and cache metrics"""
+    return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+# Single-flight token refresh. Users are spread over a fixed set of lock stripes so the lock table
+# stays bounded; two users sharing a stripe only means their (rare) refreshes queue behind each other.
+REFRESH_LOCK_STRIPES = 64
+_refresh_locks = [threading.Lock() for _ in range(REFRESH_LOCK_STRIPES)]
+
+def refresh_spotify_token(user_id, min_validity=0):
+    """
+    The function `refresh_spotify_token` refreshes a user's Spotify access token so that only one
+    refresh per user is ever in flight. Within a process, concurrent callers for the same user wait on
+    a lock; across processes, the user's row is locked with SELECT ... FOR UPDATE until the new token
+    is committed. Every caller that gets the lock after the first re-reads the row and returns the
+    token that was just stored instead of posting its own refresh_token grant.
+    
+    :param user_id: Spotify ID of the user whose token should be refreshed
+    :param min_validity: Refresh unless the stored token is still valid for at least this many
+    seconds; the background refresher uses it to renew tokens ahead of expiry
+    :return: A tuple containing the access token or `None` as the first element, and an error message
+    string or `None` as the second element.
+    """
+    with _refresh_locks[hash(user_id) % REFRESH_LOCK_STRIPES]:
+        try:
+            # Lock the row and bypass the identity map so a refresh committed elsewhere is visible
+            user = db.session.get(User, user_id, with_for_update=True, populate_existing=True)
+            if not user:
+                db.session.rollback()
+                return None, "User not found"
+            
+            current_time = int(time.time())
+            if current_time + min_validity < user.expires_at:
+                # Someone else refreshed while we waited; release the row lock and reuse their token
+                db.session.commit()
+                cache_user(user)
+                TOKEN_REFRESHES.inc('reused')
+                return user.access_token, None
+            
+            print(f"Token for user {user_id} expires at {user.expires_at}, refreshing...")
+            started = time.perf_counter()
+            try:
+                response = spotify_post(
+                    TOKEN_URL,
+                    data={
+                        'grant_type': 'refresh_token',
+                        'refresh_token': user.refresh_token,
+                        'client_id': CLIENT_ID,
+                        'client_secret': CLIENT_SECRET
+                    }
+                )
+            except Exception as e:
+                db.session.rollback()
+                TOKEN_REFRESHES.inc('failed')
+                print(f"Failed to refresh token: {str(e)}")
+                return None, "Failed to refresh Spotify token"
+            finally:
+                TOKEN_REFRESH_DURATION.observe(time.perf_counter() - started)
+            
+            if response.status_code != 200:
+                db.session.rollback()
+                TOKEN_REFRESHES.inc('failed')
+                print(f"Failed to refresh token: {response.status_code}")
+                return None, "Failed to refresh Spotify token"
+            
+            token_data = response.json()
+            user.access_token = token_data.get('access_token')
+            user.expires_at = current_time + token_data.get('expires_in', 3600)
+            
+            # Get new refresh token if provided
+            if 'refresh_token' in token_data:
+                user.refresh_token = token_data.get('refresh_token')
+            
+            db.session.commit()
+            cache_user(user)
+            TOKEN_REFRESHES.inc('refreshed')
+            return user.access_token, None
+        except Exception as e:
+            db.session.rollback()
+            print(f"Database error: {str(e)}")
+            return None, f"Database error: {str(e)}"
+
+def find_expiring_users(user_ids, horizon, limit):
+    """Returns IDs of the given users whose token expires by `horizon`, soonest first (uses ix_users_expires_at)."""
+    rows = (
+        db.session.query(User.id)
+        .filter(User.expires_at <= horizon, User.id.in_(user_ids))
+        .order_by(User.expires_at)
+        .limit(limit)
+        .all()
+    )
+    return [row.id for row in rows]
+
+# Background job renewing tokens of recently active users before they expire
+token_refresher = TokenRefresher(app, find_expiring_users, refresh_spotify_token)
+
+# Helper function returning a valid Spotify access token, refreshing it if needed
+def get_spotify_access_token(user_id, mark_active=True):
+    """
+    The function `get_spotify_access_token` looks up the user's stored Spotify access token and
+    refreshes it with the stored refresh token first if it has expired.
+    
+    :param user_id: Spotify ID of the user whose token is needed
+    :param mark_active: Whether this counts as the user being served; background jobs pass `False`
+    so their own calls do not keep a user active
+    :return: A tuple containing the access token or `None` as the first element, and an error message
+    string or `None` as the second element.
+    """
+    user = get_cached_user(user_id)
+    if not user:
+        return None, "User not found"
+    
+    if mark_active:
+        # Keep this user's token warm and their local history and library current from now on
+        token_refresher.mark_active(user_id)
+        ingester.ensure_started()
+    
+    # Check if token is expired and needs refresh
+    if int(time.time()) >= user['expires_at']:
+        return refresh_spotify_token(user_id)
+    
+    return user['access_token'], None
+
+# Steps of the request flows the Flask views share with the ASGI serving mode (see `flows`): `run`
+# makes their blocking calls on the request thread, `run_async` awaits their coroutine variants
+def call_in_app_context(call, *args):
+    with app.app_context():
+        return call(*args)
+
+async def offload(call, *args):
+    """Runs a blocking (database-bound) call in a thread, inside an app context, so the event loop stays free."""
+    return await asyncio.to_thread(call_in_app_context, call, *args)
+
+async def run_async(flow):
+    """Runs a flow on the event loop, offloading its blocking steps to threads."""
+    return await run_flow_async(flow, offload)
+
+def coalesced(key, make_flow):
+    """Step running `make_flow()` once for all identical calls in flight at the same time."""
+    return Step(
+        lambda: spotify_in_flight.do(key, lambda: run(make_flow())),
+        lambda: spotify_in_flight.do_async(key, lambda: run_async(make_flow()))
+    )
+
+def cached(user_id, endpoint, params, make_flow, allow_stale=False):
+    """Step serving a Spotify response from the response cache, running `make_flow()` only on a miss."""
+    return Step(
+        lambda: response_cache.get_or_fetch(
+            user_id, endpoint, params, lambda: run(make_flow()), allow_stale=allow_stale),
+        lambda: response_cache.get_or_fetch_async(
+            user_id, endpoint, params, lambda: run_async(make_flow()), allow_stale=allow_stale)
+    )
+
+def concurrently(named_flows):
+    """Step running several `(data, error)` flows at once under the fan-out deadline; see `fan_out`."""
+    return Step(
+        lambda: fan_out(app, {name: functools.partial(run, flow) for name, flow in named_flows.items()}),
+        lambda: fan_out_async({name: run_async(flow) for name, flow in named_flows.items()})
+    )
+
+def hedged_get(endpoint, params, headers, priority, timeout):
+    """
+    One Spotify GET through `spotify_latency`, which may hedge it, as a `((status, body, headers),
+    error)` tuple with the JSON body parsed (`None` if it is not JSON). Inside a latency budget the
+    wait for an answer is capped to what is left of it, and the HTTP client does not retry, since
+    every retry would get the full timeout again.
+    """
+    budget_left = remaining()
+    
+    def get():
+        response = spotify_get(
+            f'{API_BASE_URL}/{endpoint}',
+            headers=headers,
+            params=params,
+            timeout=(min(CONNECT_TIMEOUT, timeout), timeout),
+            retry=budget_left is None
+        )
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return response.status_code, body, response.headers
+    
+    return spotify_latency.call(
+        endpoint,
+        get,
+        may_hedge=lambda: priority == INTERACTIVE and rate_limiter.acquire(priority, 0)[0],
+        timeout=budget_left
+    )
+
+async def hedged_get_async(endpoint, params, headers, priority, timeout):
+    """`hedged_get` awaited on the pooled async client, which never retries."""
+    async def may_hedge():
+        return priority == INTERACTIVE and (await rate_limiter.acquire_async(priority, 0))[0]
+    
+    return await spotify_latency.call_async(
+        endpoint,
+        lambda: spotify_get_async(f'{API_BASE_URL}/{endpoint}', headers=headers, params=params, timeout=timeout),
+        may_hedge=may_hedge,
+        timeout=remaining()
+    )
+
 # Helper function for Spotify API requests with automatic token refresh
-def spotify_api_request(user_id, endpoint, params=None):
+def spotify_api_request(user_id, endpoint, params=None, access_token=None, priority=INTERACTIVE):
     """
     The function `spotify_api_request` handles making API requests to Spotify, including token
     refreshing and error handling.
@@ -414,102 +756,593 @@ def spotify_api_request(user_id, endpoint, params=None):
     additional parameters that may be required for the Spotify API request. These parameters could
     include things like query parameters for filtering or sorting data, or any other parameters specific
     to the endpoint being called
+    :param access_token: An access token already resolved with `get_spotify_access_token`. When it is
+    given, the user lookup and expiry check are skipped, so worker threads can call Spotify without
+    touching the database
+    :param priority: INTERACTIVE or BACKGROUND, the call's place in the shared rate limiter's queue.
+    Every call takes a token from the limiter first; a 429 blocks the limiter for its Retry-After
+    and the call is retried once, if the limiter frees up within the call's maximum wait. Concurrent
+    identical calls (same user, endpoint, params and priority) are coalesced into one and share its
+    result, which callers must not modify. Interactive calls never join a background call, which may
+    be queued in the rate limiter for far longer than their budget
     :return: The `spotify_api_request` function returns a tuple containing either the response JSON data
     or `None` (if there was an error) as the first element, and an error message string or `None` as the
-    second element.
+    second element. This is the blocking form of `spotify_api_flow`, which the views share with the
+    ASGI serving mode.
     """
-    user = db.session.get(User, user_id)
-    if not user:
-        return None, "User not found"
+    return run(spotify_api_flow(user_id, endpoint, params, access_token, priority))
+
+def spotify_api_flow(user_id, endpoint, params=None, access_token=None, priority=INTERACTIVE):
+    """Flow of `spotify_api_request`: resolves the token if needed and coalesces identical calls."""
+    if access_token is None:
+        access_token, error = yield blocking(get_spotify_access_token, user_id)
+        if error:
+            return None, error
     
-    # Check if token is expired and needs refresh
-    current_time = int(time.time())
-    if current_time >= user.expires_at:
-        print(f"Token expired for user {user_id}, refreshing...")
-        # Refresh the token
-        response = requests.post(
-            'https://accounts.spotify.com/api/token',
-            data={
-                'grant_type': 'refresh_token',
-                'refresh_token': user.refresh_token,
-                'client_id': CLIENT_ID,
-                'client_secret': CLIENT_SECRET
-            }
-        )
-        
-        if response.status_code != 200:
-            print(f"Failed to refresh token: {response.status_code}")
-            return None, "Failed to refresh Spotify token"
-        
-        token_data = response.json()
-        user.access_token = token_data.get('access_token')
-        user.expires_at = current_time + token_data.get('expires_in', 3600)
-        
-        # Get new refresh token if provided
-        if 'refresh_token' in token_data:
-            user.refresh_token = token_data.get('refresh_token')
-        
-        try:
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            print(f"Database error: {str(e)}")
-            return None, f"Database error: {str(e)}"
+    return (yield coalesced(
+        in_flight_key(user_id, endpoint, params, priority),
+        lambda: spotify_request_flow(endpoint, params, access_token, priority)
+    ))
+
+def in_flight_key(user_id, endpoint, params, priority):
+    """Single-flight key of a Spotify call: calls of different priorities never share a result."""
+    return f"{priority}:{make_key(user_id, endpoint, params)}"
+
+def spotify_request_flow(endpoint, params, access_token, priority=INTERACTIVE):
+    """
+    Flow of the rate-limited Spotify GET behind `spotify_api_request`, resulting in `(data, error)`.
+    The endpoint's circuit breaker refuses the call outright while it is open, and every call that
+    reaches Spotify is recorded with it (5xx and network errors as failures, plus latency).
+
+    Inside a latency budget (see `deadlines`) the rate-limit wait, the HTTP timeouts and the wait
+    for an answer are capped to what is left of it (see `hedged_get`). Interactive calls still
+    pending at the endpoint's hedge delay get a second, identical request if the rate limiter has a
+    token to spare for it.
+    """
+    if remaining() == 0:
+        return None, BUDGET_EXHAUSTED_ERROR
+    breaker = spotify_breakers.get(endpoint)
+    if not breaker.allow():
+        SPOTIFY_REQUESTS.inc(endpoint, 'circuit_open')
+        return None, CIRCUIT_OPEN_ERROR
     
     # Make the API request with the valid token
-    headers = {'Authorization': f'Bearer {user.access_token}'}
+    headers = {'Authorization': f'Bearer {access_token}'}
+    response = None
+    started = None
+    denied = None
     try:
-        response = requests.get(
-            f'https://api.spotify.com/v1/{endpoint}',
-            headers=headers,
-            params=params
-        )
-        
-        if response.status_code == 200:
-            return response.json(), None
-        else:
-            error_msg = f"Spotify API error: {response.status_code}"
-            try:
-                error_data = response.json()
-                if 'error' in error_data:
-                    error_msg += f" - {error_data['error'].get('message', '')}"
-            except:
-                pass
-            return None, error_msg
+        for attempt in range(2):
+            granted, wait = yield Step(
+                rate_limiter.acquire,
+                rate_limiter.acquire_async,
+                priority,
+                within_budget(rate_limiter.max_wait[priority])
+            )
+            if not granted:
+                denied = f"Rate limited: retry in {math.ceil(wait)}s"
+                break
+            timeout = within_budget(READ_TIMEOUT)
+            if timeout == 0:
+                denied = BUDGET_EXHAUSTED_ERROR
+                break
+            started = time.monotonic()
+            response, error = yield Step(hedged_get, hedged_get_async, endpoint, params, headers, priority, timeout)
+            if error:
+                # Sent, but neither the request nor its hedge answered within the budget
+                latency = time.monotonic() - started
+                breaker.record(True, latency)
+                SPOTIFY_REQUESTS.inc(endpoint, 'timeout')
+                SPOTIFY_REQUEST_DURATION.observe(latency, endpoint)
+                return None, error
+            if response[0] != 429:
+                break
+            yield blocking(rate_limiter.throttle, parse_retry_after(response[2].get('Retry-After')))
+            if attempt == 0:
+                # Counted now and dropped, so a retry the limiter denies reports the wait, not this 429
+                SPOTIFY_REQUESTS.inc(endpoint, '429')
+                SPOTIFY_REQUEST_DURATION.observe(time.monotonic() - started, endpoint)
+                response = None
     except Exception as e:
+        latency = time.monotonic() - started if started else 0.0
+        breaker.record(True, latency)
+        SPOTIFY_REQUESTS.inc(endpoint, 'error')
+        SPOTIFY_REQUEST_DURATION.observe(latency, endpoint)
         return None, f"Request error: {str(e)}"
+    
+    if response is None:
+        # Nothing reached Spotify, so there is nothing to tell the breaker
+        breaker.cancel()
+        return None, denied
+    status_code, body, _ = response
+    latency = time.monotonic() - started
+    breaker.record(status_code >= 500, latency)
+    SPOTIFY_REQUESTS.inc(endpoint, str(status_code))
+    SPOTIFY_REQUEST_DURATION.observe(latency, endpoint)
+    
+    if status_code == 200:
+        if body is None:
+            return None, "Request error: Spotify answered with invalid JSON"
+        return body, None
+    error_msg = f"Spotify API error: {status_code}"
+    if isinstance(body, dict) and isinstance(body.get('error'), dict):
+        error_msg += f" - {body['error'].get('message', '')}"
+    return None, error_msg
+
+def background_spotify_request(user_id, endpoint, params=None):
+    """
+    `spotify_api_request` for background jobs: resolves the token without marking the user active,
+    and queues behind interactive calls in the rate limiter.
+    """
+    access_token, error = get_spotify_access_token(user_id, mark_active=False)
+    if error:
+        return None, error
+    return spotify_api_request(user_id, endpoint, params, access_token=access_token, priority=BACKGROUND)
+
+# Background job keeping recently active users' listening history and saved-library mirror current
+ingester = Ingester(app, token_refresher.active_user_ids, background_spotify_request, jobs={
+    'plays': ingest_recently_played,
+    'library': sync_library_if_due,
+    'track_features': backfill_track_features,
+    'artist_genres': artist_genres.backfill,
+    'history_stats': lambda user_id, fetch: update_history_stats(user_id, artist_genres.get_many),
+})
+
+def audio_features_flow(user_id, track_ids, access_token=None):
+    """
+    Flow resulting in audio features for the given tracks as an `audio-features`-shaped `(data,
+    error)` tuple, served from the shared track_features store; only tracks never seen before are
+    fetched from Spotify.
+    """
+    return resolve_audio_features(
+        track_ids,
+        lambda ids: spotify_api_flow(user_id, 'audio-features', {'ids': ','.join(ids)}, access_token=access_token)
+    )
+
+# Spotify's maximum page size for me/top/*; smaller views are sliced from this one fetch
+TOP_ITEMS_FETCH_LIMIT = 50
+
+def top_items_flow(user_id, item_type, time_range, limit=TOP_ITEMS_FETCH_LIMIT, access_token=None, allow_stale=False):
+    """
+    The flow `top_items_flow` results in a user's top tracks or artists for a time range, served from
+    the response cache. Only one `limit=50` fetch is stored per (user, item type, time range) and every
+    smaller view (9 artists, 10 tracks, 20 tracks, 30 artists) is sliced from it, so a dashboard load
+    costs at most one upstream call per time range and item type.
+    
+    :param user_id: Spotify ID of the user
+    :param item_type: Either 'tracks' or 'artists'
+    :param time_range: One of 'short_term', 'medium_term' or 'long_term'
+    :param limit: Number of items to return, at most 50
+    :param access_token: Optional pre-resolved access token passed through to `spotify_api_flow`
+    :param allow_stale: If Spotify is unavailable, serve the last known good response marked
+    `"stale": true` instead of an error. Left off for results that get stored (materialized stats)
+    :return: A `(data, error)` tuple shaped like the `spotify_api_request` result
+    """
+    endpoint, params = top_items_request(item_type, time_range)
+    data, error = yield cached(
+        user_id,
+        endpoint,
+        params,
+        lambda: fetch_top_items_flow(user_id, item_type, endpoint, params, access_token),
+        allow_stale=allow_stale
+    )
+    if error:
+        return None, error
+    
+    return slice_top_items(data, limit), None
+
+def fetch_top_items_flow(user_id, item_type, endpoint, params, access_token):
+    """The upstream fetch behind a top-items cache miss, feeding top artists' genres to the shared cache."""
+    result = yield from spotify_api_flow(user_id, endpoint, params, access_token=access_token)
+    if item_type == 'artists' and not result[1]:
+        yield blocking(remember_artist_genres, result[0])
+    return result
+
+def stale_top_items(user_id, plan, results):
+    """
+    Replaces failed top-items results of a fan-out with the last cached copy, marked stale, while
+    Spotify is unavailable. A call cut off at the fan-out deadline never reaches the cache's own
+    fallback in `top_items_flow`, so this covers it.
+    """
+    for name, spec in plan.items():
+        if spec[0] == 'top' and results[name][1]:
+            endpoint, params = top_items_request(spec[1], spec[2])
+            data, error = response_cache.stale_fallback(user_id, endpoint, params, results[name][1])
+            if not error:
+                results[name] = (slice_top_items(data, TOP_ITEMS_FETCH_LIMIT), None)
+    return results
+
+def top_items_request(item_type, time_range):
+    """The `(endpoint, params)` of the one cached top-items fetch every view of a time range is sliced from."""
+    return f'me/top/{item_type}', {
+        'limit': TOP_ITEMS_FETCH_LIMIT,
+        'time_range': time_range
+    }
+
+def top_items_etag(user_id, item_type, time_range, limit):
+    """ETag of a top-items view, from the version of the cached response it is sliced from (`None` if not cached)."""
+    version = response_cache.version(user_id, *top_items_request(item_type, time_range))
+    return version_etag(version, limit) if version else None
+
+def remember_artist_genres(artists_data):
+    """Feeds the genres of a fresh `me/top/artists` response to the shared artist genre cache."""
+    try:
+        artist_genres.remember(artists_data.get('items', []))
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error caching artist genres: {str(e)}")
+
+def slice_top_items(data, limit):
+    """Returns a copy of a top-items response cut to `limit` items, leaving the cached payload untouched."""
+    sliced = dict(data)
+    sliced['items'] = data.get('items', [])[:limit]
+    sliced['limit'] = limit
+    return sliced
+
+# Shared section builders, used by the individual endpoints and by /api/dashboard
+TIME_RANGES = ['short_term', 'medium_term', 'long_term']
+
+EMPTY_AUDIO_FEATURES = {
+    "energy": 0,
+    "danceability": 0,
+    "valence": 0,
+    "acousticness": 0,
+    "instrumentalness": 0,
+    "liveness": 0,
+    "speechiness": 0,
+    "tempo": 0,
+    "track_count": 0
+}
+
+def build_user_genres(artists_by_range):
+    """
+    Weights genres by artist rank and time range (recent listening counts more) and returns the
+    top 15 as a genre -> weight dict.
+    
+    :param artists_by_range: A dict mapping a time range to its `me/top/artists` response
+    """
+    return genre_scorer.user_genres(artists_by_range, k=15)
+
+def build_user_genre_tree(artists_by_range):
+    """
+    The same weighted genre profile over every scored genre (not just the top 15), rolled up the
+    genre taxonomy into a `{"name", "value", "children"}` tree for the sunburst.
+    """
+    return build_genre_tree(genre_scorer.score_ranges(artists_by_range), genre_taxonomy)
+
+def build_top_genres(artists_data):
+    """Counts genre occurrences across the top artists and returns the top 10 plus the top genre."""
+    return genre_scorer.top_genres(artists_data.get('items', []), k=10)
+
+def build_audio_features(audio_features_data, detail=False):
+    """
+    Averages an `audio-features` response, ignoring tracks Spotify has no features for. With
+    `detail`, per-feature distributions (median, stddev, percentiles, histogram) are added.
+    """
+    return build_feature_stats(pack_features(audio_features_data.get('audio_features', [])), detail)
+
+def build_feature_stats(matrix, detail=False):
+    """Means (and with `detail`, distributions) of a packed feature matrix, in one vectorized pass each."""
+    if not matrix.shape[0]:
+        return dict(EMPTY_AUDIO_FEATURES)
+    
+    stats = feature_means(matrix)
+    if detail:
+        stats["distributions"] = summarize(matrix)
+    return stats
+
+# Sources /api/stats/audio-features can summarize besides the top tracks, read from local tables
+LOCAL_FEATURE_SOURCES = {
+    'history': history_matrix,
+    'library': library_matrix,
+}
+
+def build_local_audio_features(user_id, source, detail=False):
+    """Feature stats of the user's stored play history or mirrored library, without any Spotify call."""
+    stats = build_feature_stats(LOCAL_FEATURE_SOURCES[source](user_id), detail)
+    stats["source"] = source
+    return stats
+
+def build_library_stats(saved_tracks_data, recent_tracks_data):
+    """Summarizes the saved-tracks total and the recently played count."""
+    return {
+        "saved_tracks": saved_tracks_data.get('total', 0),
+        "recently_played": len(recent_tracks_data.get('items', [])) if recent_tracks_data else 0
+    }
+def json_response(payload, etag=None):
+    """
+    JSON response tagged with `etag`. If the client's If-None-Match already holds that tag, a 304 is
+    returned and the payload is never serialized.
+    """
+    if etag and request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(payload)
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
+
+def stat_etag(user_id, key, computed_at):
+    """ETag of a materialized stat: a stored payload only changes together with its `computed_at`."""
+    return version_etag(user_id, key, computed_at)
+
+def stat_headers(computed_at, etag=None, stale=False):
+    """
+    Headers of a materialized stat, stamped with the time it was computed at. `stale` flags an old
+    payload `materialize` fell back to while Spotify is unavailable.
+    """
+    headers = {COMPUTED_AT_HEADER: str(computed_at)}
+    if etag:
+        headers['ETag'] = etag
+    if stale:
+        headers[STALE_HEADER] = 'true'
+    return headers
+
+def stats_response(payload, computed_at, etag=None, stale=False):
+    """JSON response for a materialized stat; see `stat_headers`."""
+    return view_response((200, payload, stat_headers(computed_at, etag, stale)))
+
+def view_response(result):
+    """
+    Flask response for the `(status, payload, headers)` result of a view shared with the ASGI serving
+    mode. An `ETag` header tags a 200 through `json_response`.
+    """
+    status, payload, headers = result
+    headers = dict(headers)
+    etag = headers.pop('ETag', None)
+    if status == 200:
+        response = json_response(payload, etag)
+    else:
+        response = jsonify(payload)
+        response.status_code = status
+    response.headers.update(headers)
+    return response
+
+def error_status(error):
+    """Status of a view that failed with `error`: 503 while Spotify is unavailable and nothing stored could stand in."""
+    return 503 if is_upstream_failure(error) else 400
+
+def get_time_range(args):
+    """The `time_range` query value, defaulting to medium_term."""
+    time_range = args.get('time_range', 'medium_term')
+    return time_range if time_range in TIME_RANGES else 'medium_term'
+
+def compute_user_genres(user_id, build=build_user_genres):
+    """
+    Live genre profile over all time ranges, as a `(data, error)` flow for `materialize`.
+
+    :param build: Builds the payload from the per-range `me/top/artists` responses
+    """
+    # Get all time ranges to calculate a comprehensive genre profile
+    # Fetch top artists for all time ranges concurrently; a slow or failed range is skipped
+    results = yield concurrently({
+        time_range: top_items_flow(
+            user_id,
+            'artists',
+            time_range,
+            50  # Maximum allowed
+        )
+        for time_range in TIME_RANGES
+    })
+    
+    artists_by_range = {}
+    errors = []
+    for time_range in TIME_RANGES:
+        data, error = results[time_range]
+        
+        if error:
+            print(f"Error fetching top artists for {time_range}: {error}")
+            errors.append(error)
+            continue
+        artists_by_range[time_range] = data
+    
+    # Only a profile built from at least one range is worth storing
+    if not artists_by_range:
+        return None, errors[0]
+    return build(artists_by_range), None
+
+# `view` query value -> (materialized stat, payload builder) for /api/user/genres
+GENRE_VIEWS = {
+    None: ('user_genres', build_user_genres),
+    'tree': ('user_genre_tree', build_user_genre_tree)
+}
+
+def compute_top_genres(user_id, time_range):
+    """Live top genres of the user's top 30 artists, as a `(data, error)` flow for `materialize`."""
+    artists_data, error = yield from top_items_flow(
+        user_id,
+        'artists',
+        time_range,
+        30  # Increased to get more genre diversity
+    )
+    if error:
+        return None, error
+    return build_top_genres(artists_data), None
+
+def compute_audio_features(user_id, time_range, detail=False):
+    """Live audio-feature averages of the user's top 20 tracks, as a `(data, error)` flow for `materialize`."""
+    tracks_data, error = yield from top_items_flow(
+        user_id,
+        'tracks',
+        time_range,
+        20  # Increased to get more accurate averages
+    )
+    if error:
+        return None, error
+    
+    # Extract track IDs
+    track_ids = [track['id'] for track in tracks_data.get('items', [])]
+    if not track_ids:
+        return dict(EMPTY_AUDIO_FEATURES), None
+    
+    # Get audio features for these tracks (Limited to 20 tracks), from the local store when known
+    audio_features_data, error = yield from audio_features_flow(user_id, track_ids[:20])
+    if error:
+        return None, error
+    
+    # Calculate averages
+    return build_audio_features(audio_features_data, detail), None
+
+def compute_library_stats(user_id, saved_tracks_total=None):
+    """
+    Live saved-tracks total and recently played count, as a `(data, error)` flow for `materialize`.
+    The total is only fetched from Spotify if the mirrored library does not give it.
+    """
+    # Resolve the user and their Spotify token once for both upstream calls below
+    access_token, error = yield blocking(get_spotify_access_token, user_id)
+    if error:
+        return None, error
+    
+    # Get recently played tracks count too, concurrently with the saved tracks total if it is needed
+    calls = {
+        'recently_played': spotify_api_flow(
+            user_id,
+            'me/player/recently-played',
+            {
+                'limit': 50  # Maximum allowed
+            },
+            access_token=access_token
+        )
+    }
+    if saved_tracks_total is None:
+        # Get saved tracks with limit=1 to minimize data transfer (we just need the total)
+        calls['saved_tracks'] = spotify_api_flow(
+            user_id,
+            'me/tracks',
+            {
+                'limit': 1
+            },
+            access_token=access_token
+        )
+    results = yield concurrently(calls)
+    
+    if saved_tracks_total is None:
+        saved_tracks_data, error = results['saved_tracks']
+        if error:
+            return None, error
+    else:
+        saved_tracks_data = {'total': saved_tracks_total}
+    
+    recent_tracks_data, error = results['recently_played']
+    if is_upstream_failure(error):
+        # A zero count is not worth storing; the last stored stats stand in instead
+        return None, error
+    return build_library_stats(saved_tracks_data, None if error else recent_tracks_data), None
+
+# Views shared by the Flask routes below and the ASGI serving mode. Each is a flow taking the user
+# ID and the query args and resulting in `(status, payload, headers)`; an `ETag` header tags a 200.
+@latency_budget(4.0)
+def user_genres_view(user_id, args):
+    """The `/api/user/genres` payload; see `get_user_genres`."""
+    # Serve the precomputed genre profile while it is fresh, recomputing it otherwise
+    stat, build = GENRE_VIEWS.get(args.get('view'), GENRE_VIEWS[None])
+    sorted_genres, computed_at, error = yield from materialize(
+        user_id,
+        stat,
+        'all',
+        lambda: compute_user_genres(user_id, build)
+    )
+    
+    # If we have no genres, return empty result
+    if error or not sorted_genres:
+        return 200, {}, {}
+    
+    return 200, sorted_genres, stat_headers(computed_at, stat_etag(user_id, stat, computed_at), is_stale(computed_at))
+
+@latency_budget(2.0)
+def top_items_view(user_id, args, item_type, limit):
+    """The `/api/user/tracks` or `/api/user/artists` payload: the top `limit` items of the requested time range."""
+    time_range = get_time_range(args)
+    
+    print(f"Fetching top {item_type} for user {user_id} with time_range={time_range}")
+    
+    data, error = yield from top_items_flow(
+        user_id,
+        item_type,
+        time_range,
+        limit,
+        allow_stale=True
+    )
+    
+    if error:
+        print(f"Error fetching top {item_type}: {error}")
+        return error_status(error), {"error": error}, {}
+    
+    print(f"Successfully fetched {len(data.get('items', []))} {item_type}")
+    return 200, data, {'ETag': top_items_etag(user_id, item_type, time_range, limit)}
+
+@latency_budget(4.0)
+def audio_features_view(user_id, args):
+    """The `/api/stats/audio-features` payload; see `get_audio_features_avg`."""
+    detail = args.get('detail') == 'full'
+    source = args.get('source', 'top')
+    if source == 'history' and not detail:
+        # Running averages maintained incrementally as plays are ingested
+        history, computed_at = yield blocking(history_stats, user_id, artist_genres.get_many)
+        if history:
+            return 200, {**history['audio_features'], "source": source}, stat_headers(
+                computed_at,
+                stat_etag(user_id, 'history:audio_features', computed_at)
+            )
+    if source in LOCAL_FEATURE_SOURCES:
+        return 200, (yield blocking(build_local_audio_features, user_id, source, detail)), {}
+    
+    time_range = get_time_range(args)
+    
+    # Distributions are materialized apart from the averages, from the same top tracks
+    stat = 'audio_features_detail' if detail else 'audio_features'
+    data, computed_at, error = yield from materialize(
+        user_id,
+        stat,
+        time_range,
+        lambda: compute_audio_features(user_id, time_range, detail)
+    )
+    
+    if error:
+        return error_status(error), {"error": error}, {}
+    
+    return 200, data, stat_headers(computed_at, stat_etag(user_id, f'{stat}:{time_range}', computed_at), is_stale(computed_at))
+
+@latency_budget(3.0)
+def top_genres_view(user_id, args):
+    """The `/api/stats/genres` payload; see `get_top_genres`."""
+    if args.get('source') == 'history':
+        history, computed_at = yield blocking(history_stats, user_id, artist_genres.get_many)
+        if not history:
+            return 200, {"genres": [], "top_genre": "Unknown"}, {}
+        return 200, history['top_genres'], stat_headers(computed_at, stat_etag(user_id, 'history:top_genres', computed_at))
+    
+    time_range = get_time_range(args)
+    
+    # Serve the precomputed genre counts while fresh, recounting from the top artists otherwise
+    data, computed_at, error = yield from materialize(
+        user_id,
+        'top_genres',
+        time_range,
+        lambda: compute_top_genres(user_id, time_range)
+    )
+    
+    if error:
+        return error_status(error), {"error": error}, {}
+    
+    return 200, data, stat_headers(computed_at, stat_etag(user_id, f'top_genres:{time_range}', computed_at), is_stale(computed_at))
 
 # Genre endpoint
 @app.route('/api/user/genres')
-@jwt_required(optional=True)
 def get_user_genres():
     """
     The function `get_user_genres` retrieves the user's top genres based on their top artists from the
-    Spotify API. It handles authentication, token refresh, and CORS headers for frontend access.
+    Spotify API. It handles authentication and token refresh.
     :return: The `get_user_genres` function returns a JSON response containing the user's top genres
     and their corresponding weights. If the user is not authenticated or if there are any errors in
-    fetching the data, it returns an error message with appropriate status codes. The response also
-    includes CORS headers to allow cross-origin requests from the frontend application.
+    fetching the data, it returns an error message with appropriate status codes. The profile is
+    served from the per-user materialized stats while fresh (see the X-Stats-Computed-At header).
+    With `view=tree` the weights come pre-aggregated as a genre hierarchy (family -> genre) instead.
     """
-    # Get user ID (use the same fallback logic as /api/me)
-    current_user_id = get_jwt_identity()
+    # Get user ID (resolved once per request by the resolve_identity hook)
+    current_user_id = get_current_user_id()
     
-    # If standard JWT identity extraction fails, try fallback methods
-    if not current_user_id:
-        print("No JWT identity found in genres endpoint, checking fallbacks")
-        
-        # Try to extract JWT from cookie directly
-        jwt_token = request.cookies.get('access_token')
-        
-        if jwt_token:
-            try:
-                print(f"Found JWT token in cookies, attempting to decode")
-                from flask_jwt_extended import decode_token
-                decoded_token = decode_token(jwt_token)
-                if 'sub' in decoded_token:
-                    current_user_id = decoded_token['sub']
-            except Exception as e:
-                print(f"Error decoding JWT token: {str(e)}")
     # If still no user ID, return error
     if not current_user_id:
         print("No user ID found after all fallbacks")
@@ -522,105 +1355,17 @@ def get_user_genres():
             }
         }), 401
     
-    # Get all time ranges to calculate a comprehensive genre profile
-    time_ranges = ['short_term', 'medium_term', 'long_term']
-    all_genres = []
-    
-    for time_range in time_ranges:
-        # Get top artists for this time range
-        data, error = spotify_api_request(
-            current_user_id,
-            'me/top/artists',
-            {
-                'limit': 50,  # Maximum allowed
-                'time_range': time_range
-            }
-        )
-        
-        if error:
-            print(f"Error fetching top artists for {time_range}: {error}")
-            continue
-        
-        if data and 'items' in data:
-            # Extract genres from artists and add them to our list
-            # Weight genres by artist position (higher ranked artists' genres count more)
-            for i, artist in enumerate(data['items']):
-                weight = 1.0 - (i / len(data['items']))  # Weight from 1.0 to ~0.0
-                for genre in artist.get('genres', []):
-                    # Each genre gets points based on artist rank and time range
-                    # Short term (recent) counts more than long term
-                    time_range_multiplier = 1.5 if time_range == 'short_term' else (1.0 if time_range == 'medium_term' else 0.5)
-                    all_genres.append((genre, weight * time_range_multiplier))
-    
-    # Count genres with their weights
-    genre_counts = {}
-    for genre, weight in all_genres:
-        if genre in genre_counts:
-            genre_counts[genre] += weight
-        else:
-            genre_counts[genre] = weight
-    
-    # Sort and normalize for better visualization
-    sorted_genres = dict(sorted(genre_counts.items(), key=lambda x: x[1], reverse=True)[:15])
-    
-    # If we have no genres, return empty result
-    if not sorted_genres:
-        return jsonify({})
-    
-    # Add CORS headers for direct frontend access
-    response = jsonify(sorted_genres)
-    response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-    response.headers.add('Access-Control-Allow-Credentials', 'true')
-    response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-    
-    return response
-@app.route('/api/user/tracks', methods=['GET', 'OPTIONS'])
-@jwt_required(optional=True)
+    return view_response(run(user_genres_view(current_user_id, request.args)))
+@app.route('/api/user/tracks', methods=['GET'])
 def get_user_tracks():
     """
-    The function `get_user_tracks` retrieves the top tracks for a user with optional JWT authentication
-    and handles CORS preflight requests.
-    :return: The code snippet defines a Flask route `/api/user/tracks` that handles GET and OPTIONS
-    requests. It first checks if the request method is OPTIONS to handle CORS preflight requests. If the
-    method is OPTIONS, it returns a response with CORS headers.
-    """
-    # Handle CORS preflight requests
-    if request.method == 'OPTIONS':
-        response = jsonify({'status': 'ok'})
-        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-        response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
-        return response
-    
-    # Get user ID using the same fallback logic
-    current_user_id = get_jwt_identity()
-    
-    # If standard JWT identity extraction fails, try fallbacks
-    if not current_user_id:
-        jwt_token = request.cookies.get('access_token')
-        if jwt_token:
-            try:
-                from flask_jwt_extended import decode_token
-                decoded_token = decode_token(jwt_token)
-                if 'sub' in decoded_token:
-                    current_user_id = decoded_token['sub']
-            except Exception as e:
-                print(f"Error decoding JWT token: {str(e)}")
-                
-        # Check Authorization header
-        if not current_user_id:
-            auth_header = request.headers.get('Authorization')
-            if auth_header and auth_header.startswith('Bearer '):
-                jwt_token = auth_header[7:]
-                try:
-                    from flask_jwt_extended import decode_token
-                    decoded_token = decode_token(jwt_token)
-                    if 'sub' in decoded_token:
-                        current_user_id = decoded_token['sub']
-                except Exception as e:
-                    print(f"Error decoding JWT token from header: {str(e)}")
+    The function `get_user_tracks` retrieves the top tracks for a user with JWT authentication.
+    :return: A JSON response with the user's top 10 tracks for the requested time range, or an error
+    message with a 401 or 400 status code. CORS headers and preflights are handled by the
+    `CORSMiddleware` wrapped around the app.
+    """
+    # Get user ID (resolved once per request by the resolve_identity hook)
+    current_user_id = get_current_user_id()
     
     # If still no user ID, return error
     if not current_user_id:
@@ -633,95 +1378,20 @@ def get_user_tracks():
             }
         })
         response.status_code = 401
-        # Add CORS headers to the error response too
-        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
-        return response
-        
-    # Get time range from query params, default to medium_term
-    time_range = request.args.get('time_range', 'medium_term')
-    # Validate time range
-    if time_range not in ['short_term', 'medium_term', 'long_term']:
-        time_range = 'medium_term'
-    
-    print(f"Fetching top tracks for user {current_user_id} with time_range={time_range}")
-        
-    # Use the helper function to make the request
-    data, error = spotify_api_request(
-        current_user_id,
-        'me/top/tracks',
-        {
-            'limit': 10,
-            'time_range': time_range
-        }
-    )
-    
-    if error:
-        print(f"Error fetching top tracks: {error}")
-        response = jsonify({"error": error})
-        response.status_code = 400
-        # Add CORS headers to the error response too
-        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
         return response
-        
-    # Add CORS headers
-    response = jsonify(data)
-    print(f"Successfully fetched {len(data.get('items', []))} tracks")
-    response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-    response.headers.add('Access-Control-Allow-Credentials', 'true')
-    response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
     
-    return response
+    return view_response(run(top_items_view(current_user_id, request.args, 'tracks', 10)))
 
-@app.route('/api/user/artists', methods=['GET', 'OPTIONS'])
-@jwt_required(optional=True)
+@app.route('/api/user/artists', methods=['GET'])
 def get_user_artists():
     """
-    This Flask route function retrieves a user's top artists from Spotify API with authentication and
-    CORS handling.
+    This Flask route function retrieves a user's top artists from Spotify API with authentication.
     :return: The Flask route `/api/user/artists` is returning a response based on the logic within the
     function `get_user_artists()`. The response includes data about the user's top artists fetched from
-    the Spotify API. The response is a JSON object containing information about the top artists, and it
-    includes CORS headers to allow requests from a specific origin (`http://localhost:3000`).
-    """
-    # Handle CORS preflight requests
-    if request.method == 'OPTIONS':
-        response = jsonify({'status': 'ok'})
-        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-        response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
-        return response
-    
-    # Get user ID using the same fallback logic
-    current_user_id = get_jwt_identity()
-    
-    # If standard JWT identity extraction fails, try fallbacks
-    if not current_user_id:
-        jwt_token = request.cookies.get('access_token')
-        if jwt_token:
-            try:
-                from flask_jwt_extended import decode_token
-                decoded_token = decode_token(jwt_token)
-                if 'sub' in decoded_token:
-                    current_user_id = decoded_token['sub']
-            except Exception as e:
-                print(f"Error decoding JWT token: {str(e)}")
-                
-        # Check Authorization header
-        if not current_user_id:
-            auth_header = request.headers.get('Authorization')
-            if auth_header and auth_header.startswith('Bearer '):
-                jwt_token = auth_header[7:]
-                try:
-                    from flask_jwt_extended import decode_token
-                    decoded_token = decode_token(jwt_token)
-                    if 'sub' in decoded_token:
-                        current_user_id = decoded_token['sub']
-                except Exception as e:
-                    print(f"Error decoding JWT token from header: {str(e)}")
+    the Spotify API. The response is a JSON object containing information about the top artists.
+    """
+    # Get user ID (resolved once per request by the resolve_identity hook)
+    current_user_id = get_current_user_id()
     
     # If still no user ID, return error
     if not current_user_id:
@@ -734,376 +1404,315 @@ def get_user_artists():
             }
         })
         response.status_code = 401
-        # Add CORS headers to the error response too
-        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
         return response
-        
-    # Get time range from query params, default to medium_term
-    time_range = request.args.get('time_range', 'medium_term')
-    # Validate time range
-    if time_range not in ['short_term', 'medium_term', 'long_term']:
-        time_range = 'medium_term'
     
-    print(f"Fetching top artists for user {current_user_id} with time_range={time_range}")
-        
-    # Use the helper function to make the request
-    data, error = spotify_api_request(
+    return view_response(run(top_items_view(
         current_user_id,
-        'me/top/artists',
-        {
-            'limit': 9,  # 3x3 grid in the frontend
-            'time_range': time_range
-        }
-    )
-    
-    if error:
-        print(f"Error fetching top artists: {error}")
-        response = jsonify({"error": error})
-        response.status_code = 400
-        # Add CORS headers to the error response too
-        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
-        return response
-        
-    # Add CORS headers
-    response = jsonify(data)
-    print(f"Successfully fetched {len(data.get('items', []))} artists")
-    response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-    response.headers.add('Access-Control-Allow-Credentials', 'true')
-    response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-    
-    return response
-@app.route('/api/stats/audio-features', methods=['GET', 'OPTIONS'])
-@jwt_required(optional=True)
+        request.args,
+        'artists',
+        9  # 3x3 grid in the frontend
+    )))
+@app.route('/api/stats/audio-features', methods=['GET'])
 def get_audio_features_avg():
     """
     This function retrieves the average audio features for a user's top tracks from the Spotify API.
     :return: The endpoint `/api/stats/audio-features` is returning the average audio features for the
     user's top tracks. The response includes the average values for energy, danceability, valence,
     acousticness, instrumentalness, liveness, speechiness, tempo, and the total track count. The
-    response is in JSON format and includes CORS headers to allow requests from `http://localhost:3000`.
-    """
-    # Handle CORS preflight requests
-    if request.method == 'OPTIONS':
-        response = jsonify({'status': 'ok'})
-        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-        response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
-        return response
-    
-    # Get user ID using the fallback logic
-    current_user_id = get_jwt_identity()
-    if not current_user_id:
-        jwt_token = request.cookies.get('access_token')
-        if jwt_token:
-            try:
-                from flask_jwt_extended import decode_token
-                decoded_token = decode_token(jwt_token)
-                if 'sub' in decoded_token:
-                    current_user_id = decoded_token['sub']
-            except Exception as e:
-                print(f"Error decoding JWT token: {str(e)}")
-                
-        # Check Authorization header
-        if not current_user_id:
-            auth_header = request.headers.get('Authorization')
-            if auth_header and auth_header.startswith('Bearer '):
-                jwt_token = auth_header[7:]
-                try:
-                    from flask_jwt_extended import decode_token
-                    decoded_token = decode_token(jwt_token)
-                    if 'sub' in decoded_token:
-                        current_user_id = decoded_token['sub']
-                except Exception as e:
-                    print(f"Error decoding JWT token from header: {str(e)}")
+    response is in JSON format. `source=history` or `source=library` summarizes the user's stored
+    play history or mirrored library instead, and `detail=full` adds per-feature distributions
+    (median, stddev, percentiles and histogram). Averages and distributions are served from the
+    per-user materialized stats while fresh (see the X-Stats-Computed-At header). While Spotify is
+    unavailable the last stored stats stand in, flagged with X-Stats-Stale, or a 503 if there are none.
+    """
+    # Get user ID (resolved once per request by the resolve_identity hook)
+    current_user_id = get_current_user_id()
     
     # If still no user ID, return error
     if not current_user_id:
         response = jsonify({"error": "Authentication required"})
         response.status_code = 401
-        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
         return response
     
-    # Get time range from query params
-    time_range = request.args.get('time_range', 'medium_term')
-    if time_range not in ['short_term', 'medium_term', 'long_term']:
-        time_range = 'medium_term'
+    return view_response(run(audio_features_view(current_user_id, request.args)))
+@app.route('/api/stats/genres', methods=['GET'])
+def get_top_genres():
+    """
+    The function `get_top_genres` retrieves a user's top genres based on their top artists using Spotify
+    API.
+    :return: The endpoint `/api/stats/genres` returns a JSON response containing the top 10 genres based
+    on the user's top artists, along with the top genre among those. The response includes the genres
+    sorted by occurrence count. `source=history` counts genres over the user's stored play history
+    instead (one count per play of an artist). Results are served from the per-user materialized
+    stats while fresh, with the time they were computed at in the X-Stats-Computed-At header.
+    """
     
-    # First get top tracks
-    tracks_data, error = spotify_api_request(
-        current_user_id,
-        'me/top/tracks',
-        {
-            'limit': 20,  # Increased to get more accurate averages
-            'time_range': time_range
-        }
-    )
+    # Get user ID (resolved once per request by the resolve_identity hook)
+    current_user_id = get_current_user_id()
     
-    if error:
-        response = jsonify({"error": error})
-        response.status_code = 400
-        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
+    # If no user ID, return error
+    if not current_user_id:
+        response = jsonify({"error": "Authentication required"})
+        response.status_code = 401
         return response
     
-    # Extract track IDs
-    track_ids = [track['id'] for track in tracks_data.get('items', [])]
+    return view_response(run(top_genres_view(current_user_id, request.args)))
+
+@app.route('/api/stats/history', methods=['GET'])
+def get_history_stats():
+    """
+    Returns stats over the user's stored listening history: play count, top tracks and artists by
+    plays, top genres and average audio features. They are maintained incrementally as new plays are
+    ingested (running sums and counts) and brought up to date here if older than USER_STATS_MAX_AGE;
+    the X-Stats-Computed-At header carries the time they were computed at.
+    """
+    # Get user ID (resolved once per request by the resolve_identity hook)
+    current_user_id = get_current_user_id()
     
-    if not track_ids:
-        response = jsonify({
-            "energy": 0,
-            "danceability": 0,
-            "valence": 0,
-            "acousticness": 0,
-            "instrumentalness": 0,
-            "liveness": 0,
-            "speechiness": 0,
-            "tempo": 0,
-            "track_count": 0
-        })
-        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
+    # If no user ID, return error
+    if not current_user_id:
+        response = jsonify({"error": "Authentication required"})
+        response.status_code = 401
         return response
     
-    # Get audio features for these tracks
-    audio_features_data, error = spotify_api_request(
-        current_user_id,
-        'audio-features',
-        {
-            'ids': ','.join(track_ids[:20])  # Limited to 20 tracks
-        }
-    )
-    
-    if error:
-        response = jsonify({"error": error})
-        response.status_code = 400
-        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
+    history, computed_at = history_stats(current_user_id, artist_genres.get_many)
+    if not history:
+        response = jsonify({"error": "No listening history stored yet"})
+        response.status_code = 404
         return response
     
-    # Calculate averages
-    features = audio_features_data.get('audio_features', [])
-    features = [f for f in features if f]  # Filter out None values
-    
-    if not features:
-        response = jsonify({
-            "energy": 0,
-            "danceability": 0,
-            "valence": 0,
-            "acousticness": 0,
-            "instrumentalness": 0,
-            "liveness": 0,
-            "speechiness": 0,
-            "tempo": 0,
-            "track_count": 0
-        })
-    else:
-        avg_features = {
-            "energy": sum(f.get('energy', 0) for f in features) / len(features),
-            "danceability": sum(f.get('danceability', 0) for f in features) / len(features),
-            "valence": sum(f.get('valence', 0) for f in features) / len(features),
-            "acousticness": sum(f.get('acousticness', 0) for f in features) / len(features),
-            "instrumentalness": sum(f.get('instrumentalness', 0) for f in features) / len(features),
-            "liveness": sum(f.get('liveness', 0) for f in features) / len(features),
-            "speechiness": sum(f.get('speechiness', 0) for f in features) / len(features),
-            "tempo": sum(f.get('tempo', 0) for f in features) / len(features),
-            "track_count": len(features)
-        }
-        response = jsonify(avg_features)
-    
-    # Add CORS headers
-    response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-    response.headers.add('Access-Control-Allow-Credentials', 'true')
-    response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-    
-    return response
-@app.route('/api/stats/genres', methods=['GET', 'OPTIONS'])
-@jwt_required(optional=True)
-def get_top_genres():
+    return stats_response(history, computed_at, stat_etag(current_user_id, 'history', computed_at))
+@app.route('/api/export/<export>', methods=['GET'])
+def export_user_data(export):
     """
-    The function `get_top_genres` retrieves a user's top genres based on their top artists using Spotify
-    API and handles CORS preflight requests.
-    :return: The endpoint `/api/stats/genres` returns a JSON response containing the top 10 genres based
-    on the user's top artists, along with the top genre among those. The response includes the genres
-    sorted by occurrence count and additional CORS headers for allowing requests from a specific origin
-    (`http://localhost:3000`).
-    """
-    # Handle CORS preflight requests
-    if request.method == 'OPTIONS':
-        response = jsonify({'status': 'ok'})
-        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-        response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
-        return response
-    
-    
-    # Get user ID using the same fallback logic
-    current_user_id = get_jwt_identity()
+    Streams a full export of the user's stored data: `plays` (listening history) or `library`
+    (mirrored saved tracks). Rows are read from a server-side cursor and written out batch by batch,
+    so memory stays flat and the response starts right away. `format=ndjson` (default) gives one
+    JSON object per line, `format=json` a single array.
+    """
+    # Get user ID (resolved once per request by the resolve_identity hook)
+    current_user_id = get_current_user_id()
     
-    # If standard JWT identity extraction fails, try fallbacks
+    # If no user ID, return error
     if not current_user_id:
-        jwt_token = request.cookies.get('access_token')
-        if jwt_token:
-            try:
-                from flask_jwt_extended import decode_token
-                decoded_token = decode_token(jwt_token)
-                if 'sub' in decoded_token:
-                    current_user_id = decoded_token['sub']
-            except Exception as e:
-                print(f"Error decoding JWT token: {str(e)}")
-                
-        # Check Authorization header
-        if not current_user_id:
-            auth_header = request.headers.get('Authorization')
-            if auth_header and auth_header.startswith('Bearer '):
-                jwt_token = auth_header[7:]
-                try:
-                    from flask_jwt_extended import decode_token
-                    decoded_token = decode_token(jwt_token)
-                    if 'sub' in decoded_token:
-                        current_user_id = decoded_token['sub']
-                except Exception as e:
-                    print(f"Error decoding JWT token from header: {str(e)}")
-    
-    # Get time range from query params
-    time_range = request.args.get('time_range', 'medium_term')
-    if time_range not in ['short_term', 'medium_term', 'long_term']:
-        time_range = 'medium_term'
-    
-    # Get top artists
-    artists_data, error = spotify_api_request(
-        current_user_id,
-        'me/top/artists',
-        {
-            'limit': 30,  # Increased to get more genre diversity
-            'time_range': time_range
-        }
-    )
+        response = jsonify({"error": "Authentication required"})
+        response.status_code = 401
+        return response
     
-    if error:
-        response = jsonify({"error": error})
+    fmt = request.args.get('format', 'ndjson')
+    if export not in EXPORTS or fmt not in EXPORT_MIMETYPES:
+        response = jsonify({"error": f"Unknown export or format, expected one of {list(EXPORTS)} as {list(EXPORT_MIMETYPES)}"})
         response.status_code = 400
-        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
         return response
     
-    # Extract genres and count occurrences
-    genre_count = {}
-    
-    for artist in artists_data.get('items', []):
-        for genre in artist.get('genres', []):
-            genre_count[genre] = genre_count.get(genre, 0) + 1
-    
-    # Sort genres by occurrence count
-    sorted_genres = [{"name": k, "count": v} for k, v in 
-                     sorted(genre_count.items(), key=lambda x: x[1], reverse=True)]
+    response = Response(stream_with_context(stream_export(current_user_id, export, fmt)), mimetype=EXPORT_MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{export}.{fmt}"'
+    # Ask proxies not to buffer the stream, so the first rows reach the client straight away
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+@latency_budget(3.0)
+def library_view(user_id, args):
+    """The `/api/stats/library` payload; see `get_saved_tracks_count`."""
+    # Library-wide stats from the local mirror, if the sync job has mirrored this user's library yet
+    mirror = yield blocking(library_stats, user_id, 10, artist_genres.get_many)
+    saved_tracks_total = mirror['saved_tracks'] if mirror else None
+    
+    # Serve the Spotify counts while fresh, fetching them (concurrently) otherwise
+    stats, computed_at, error = yield from materialize(
+        user_id,
+        'library',
+        'all',
+        lambda: compute_library_stats(user_id, saved_tracks_total)
+    )
     
-    response = jsonify({
-        "genres": sorted_genres[:10],  # Top 10 genres
-        "top_genre": sorted_genres[0]["name"] if sorted_genres else "Unknown"
-    })
+    if error:
+        return error_status(error), {"error": error}, {}
     
-    # Add CORS headers
-    response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-    response.headers.add('Access-Control-Allow-Credentials', 'true')
-    response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-    return response
-@app.route('/api/stats/library', methods=['GET', 'OPTIONS'])
-@jwt_required(optional=True)
+    if mirror:
+        # The mirror is read fresh on every request, so it also has the last word on the total
+        stats = {**stats, 'saved_tracks': saved_tracks_total, 'library': mirror}
+    # Tagged by content, since the mirror changes independently of `computed_at`
+    return 200, stats, stat_headers(computed_at, stale=is_stale(computed_at))
+
+@app.route('/api/stats/library', methods=['GET'])
 def get_saved_tracks_count():
     """
     This Flask route function retrieves the count of a user's saved tracks and recently played tracks
-    from the Spotify API while handling CORS preflight requests and JWT token extraction.
+    from the Spotify API.
     :return: The endpoint `/api/stats/library` is returning the count of a user's saved tracks and the
     count of recently played tracks. The response includes JSON data with keys "saved_tracks" for the
-    total saved tracks count and "recently_played" for the count of recently played tracks. CORS headers
-    are also included in the response to allow requests from a specific origin
-    (`http://localhost:3000`).
-    """
-    # Handle CORS preflight requests
-    if request.method == 'OPTIONS':
-        response = jsonify({'status': 'ok'})
-        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-        response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
-        return response
-    
-    current_user_id = get_jwt_identity()
+    total saved tracks count and "recently_played" for the count of recently played tracks. Once the
+    user's library has been mirrored locally, "saved_tracks" comes from the mirror and a "library" key
+    adds library-wide stats (artists, albums, duration, top artists) computed from it. The Spotify
+    counts are served from the per-user materialized stats while fresh (see the X-Stats-Computed-At
+    header); while Spotify is unavailable the last stored counts stand in, flagged with
+    X-Stats-Stale, or a 503 if there are none.
+    """
+    # Get user ID (resolved once per request by the resolve_identity hook)
+    current_user_id = get_current_user_id()
     
-    # If standard JWT identity extraction fails, try fallbacks
+    # If no user ID, return error
     if not current_user_id:
-        jwt_token = request.cookies.get('access_token')
-        if jwt_token:
-            try:
-                from flask_jwt_extended import decode_token
-                decoded_token = decode_token(jwt_token)
-                if 'sub' in decoded_token:
-                    current_user_id = decoded_token['sub']
-            except Exception as e:
-                print(f"Error decoding JWT token: {str(e)}")
-                
-        # Check Authorization header
-        if not current_user_id:
-            auth_header = request.headers.get('Authorization')
-            if auth_header and auth_header.startswith('Bearer '):
-                jwt_token = auth_header[7:]
-                try:
-                    from flask_jwt_extended import decode_token
-                    decoded_token = decode_token(jwt_token)
-                    if 'sub' in decoded_token:
-                        current_user_id = decoded_token['sub']
-                except Exception as e:
-                    print(f"Error decoding JWT token from header: {str(e)}")
-    
-    # Get saved tracks with limit=1 to minimize data transfer (we just need the total)
-    saved_tracks_data, error = spotify_api_request(
-        current_user_id,
-        'me/tracks',
-        {
-            'limit': 1
-        }
-    )
-    
-    if error:
-        response = jsonify({"error": error})
-        response.status_code = 400
-        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        response = jsonify({"error": "Authentication required"})
+        response.status_code = 401
         return response
     
-    # Extract total count
-    total_saved = saved_tracks_data.get('total', 0)
+    return view_response(run(library_view(current_user_id, request.args)))
+# Sections /api/dashboard can return, each shaped like its standalone endpoint's response
+DASHBOARD_SECTIONS = ['tracks', 'artists', 'genres', 'audio_features', 'top_genres', 'library']
+
+def plan_dashboard_calls(sections, time_range):
+    """
+    Lists the upstream calls the requested dashboard sections need, each exactly once, as a dict of
+    name -> ('top', item_type, time_range) for cached top-items fetches or ('get', endpoint, params).
+    """
+    plan = {}
+    if 'tracks' in sections or 'audio_features' in sections:
+        plan['top_tracks'] = ('top', 'tracks', time_range)
+    if 'genres' in sections:
+        for tr in TIME_RANGES:
+            plan[f'top_artists:{tr}'] = ('top', 'artists', tr)
+    elif 'artists' in sections or 'top_genres' in sections:
+        plan[f'top_artists:{time_range}'] = ('top', 'artists', time_range)
+    if 'library' in sections:
+        plan['saved_tracks'] = ('get', 'me/tracks', {'limit': 1})
+        plan['recently_played'] = ('get', 'me/player/recently-played', {'limit': 50})
+    return plan
+
+def dashboard_call_flow(user_id, spec, access_token):
+    """Flow of one call from `plan_dashboard_calls`, resulting in its `(data, error)`."""
+    if spec[0] == 'top':
+        return (yield from top_items_flow(user_id, spec[1], spec[2], access_token=access_token, allow_stale=True))
+    return (yield from spotify_api_flow(user_id, spec[1], spec[2], access_token=access_token))
+
+def dashboard_audio_feature_ids(sections, results):
+    """Returns the track IDs the audio_features section still needs features for (possibly none)."""
+    if 'audio_features' not in sections:
+        return []
+    tracks_data, error = results.get('top_tracks', (None, None))
+    if error or not tracks_data:
+        return []
+    return [track['id'] for track in tracks_data.get('items', [])[:20]]
+
+def assemble_dashboard(sections, time_range, results):
+    """
+    Derives every requested dashboard section from the fetched upstream results.
+    :return: A tuple of the section payloads and the per-section error messages.
+    """
+    payload = {}
+    errors = {}
+    
+    tracks_data, tracks_error = results.get('top_tracks', (None, None))
+    if 'tracks' in sections:
+        if tracks_error:
+            errors['tracks'] = tracks_error
+        else:
+            payload['tracks'] = slice_top_items(tracks_data, 10)
+    if 'audio_features' in sections:
+        if tracks_error:
+            errors['audio_features'] = tracks_error
+        elif 'audio_features' not in results:
+            payload['audio_features'] = dict(EMPTY_AUDIO_FEATURES)
+        else:
+            audio_features_data, features_error = results['audio_features']
+            if features_error:
+                errors['audio_features'] = features_error
+            else:
+                payload['audio_features'] = build_audio_features(audio_features_data)
     
-    # Get recently played tracks count too
-    recent_tracks_data, error = spotify_api_request(
-        current_user_id,
-        'me/player/recently-played',
-        {
-            'limit': 50  # Maximum allowed
-        }
-    )
+    artists_data, artists_error = results.get(f'top_artists:{time_range}', (None, None))
+    if 'artists' in sections:
+        if artists_error:
+            errors['artists'] = artists_error
+        else:
+            payload['artists'] = slice_top_items(artists_data, 9)
+    if 'top_genres' in sections:
+        if artists_error:
+            errors['top_genres'] = artists_error
+        else:
+            payload['top_genres'] = build_top_genres(slice_top_items(artists_data, 30))
+    if 'genres' in sections:
+        artists_by_range = {}
+        for tr in TIME_RANGES:
+            data, range_error = results[f'top_artists:{tr}']
+            if range_error:
+                print(f"Error fetching top artists for {tr}: {range_error}")
+                continue
+            artists_by_range[tr] = data
+        if artists_by_range:
+            payload['genres'] = build_user_genres(artists_by_range)
+        else:
+            errors['genres'] = "Failed to fetch top artists"
     
-    recent_count = len(recent_tracks_data.get('items', [])) if not error else 0
+    if 'library' in sections:
+        saved_tracks_data, saved_error = results['saved_tracks']
+        recent_tracks_data, recent_error = results['recently_played']
+        if saved_error:
+            errors['library'] = saved_error
+        else:
+            payload['library'] = build_library_stats(saved_tracks_data, None if recent_error else recent_tracks_data)
     
-    response = jsonify({
-        "saved_tracks": total_saved,
-        "recently_played": recent_count
-    })
+    return payload, errors
+
+@latency_budget(5.0)
+def dashboard_view(user_id, args):
+    """The `/api/dashboard` payload; see `get_dashboard`."""
+    time_range = get_time_range(args)
+    
+    # Get requested sections, defaulting to everything
+    sections_param = args.get('sections')
+    sections = [s.strip() for s in sections_param.split(',') if s.strip()] if sections_param else list(DASHBOARD_SECTIONS)
+    unknown = [s for s in sections if s not in DASHBOARD_SECTIONS]
+    if unknown:
+        return 400, {"error": f"Unknown sections: {', '.join(unknown)}", "available": DASHBOARD_SECTIONS}, {}
+    
+    # Resolve the user and their Spotify token once for every upstream call below
+    access_token, error = yield blocking(get_spotify_access_token, user_id)
+    if error:
+        return 404 if error == "User not found" else 400, {"error": error}, {}
+    
+    # Fetch everything the requested sections need, each upstream call only once
+    plan = plan_dashboard_calls(sections, time_range)
+    results = stale_top_items(user_id, plan, (yield concurrently({
+        name: dashboard_call_flow(user_id, spec, access_token)
+        for name, spec in plan.items()
+    })))
+    
+    # Audio features depend on the track IDs, so this is the one sequential call
+    track_ids = dashboard_audio_feature_ids(sections, results)
+    if track_ids:
+        results['audio_features'] = yield from audio_features_flow(user_id, track_ids, access_token)
+    
+    payload, errors = assemble_dashboard(sections, time_range, results)
+    
+    return 200, {
+        "time_range": time_range,
+        "sections": payload,
+        "errors": errors
+    }, {}
+
+@app.route('/api/dashboard', methods=['GET'])
+def get_dashboard():
+    """
+    Returns several dashboard sections in one response. The user and their Spotify token are resolved
+    once, every upstream call the requested sections need is made once and concurrently, and each
+    section is derived from that shared data.
+    Query params: `time_range` (short_term, medium_term or long_term) and `sections`, a comma-separated
+    subset of tracks, artists, genres, audio_features, top_genres and library (default: all).
+    :return: A JSON object with `time_range`, `sections` (section name -> same payload as the matching
+    /api/user/* or /api/stats/* endpoint) and `errors` (section name -> error message) for any section
+    that could not be built.
+    """
+    # Get user ID (resolved once per request by the resolve_identity hook)
+    current_user_id = get_current_user_id()
     
-    # Add CORS headers
-    response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-    response.headers.add('Access-Control-Allow-Credentials', 'true')
-    response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-    return response
+    # If still no user ID, return error
+    if not current_user_id:
+        response = jsonify({"error": "Authentication required"})
+        response.status_code = 401
+        return response
+    
+    return view_response(run(dashboard_view(current_user_id, request.args)))
 @app.route('/api/docs')
 def api_documentation():
     """
@@ -1137,15 +1746,12 @@ def api_documentation():
     # Sort by route for easier reading
     docs = sorted(docs, key=lambda x: x['route'])
     
-    # Add CORS headers
     response = jsonify({
         "api_name": "MusicTracker API",
         "version": "1.0",
         "documentation": docs
     })
     
-    response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-    response.headers.add('Access-Control-Allow-Credentials', 'true')
     
     return response
 @app.teardown_appcontext
@@ -0,0 +1,125 @@
+# artist_genres.py
+import os
+import threading
+import time
+
+from sqlalchemy import select
+
+from cache import InMemoryBackend
+from database import upsert
+from models import db, ArtistGenres, Play, SavedTrack, track_artists
+
+ARTIST_GENRES_TTL = int(os.getenv('ARTIST_GENRES_TTL', 7 * 24 * 3600))
+ARTIST_GENRES_CACHE_SIZE = int(os.getenv('ARTIST_GENRES_CACHE_SIZE', 50000))
+ARTIST_GENRES_BACKFILL_LIMIT = int(os.getenv('ARTIST_GENRES_BACKFILL_LIMIT', 500))
+
+# Spotify's maximum number of IDs per artists call
+ARTISTS_BATCH_SIZE = 50
+
+
+class ArtistGenreCache:
+    """
+    Cross-user artist -> genres lookup: an in-memory LRU in front of the `artist_genres` table, both
+    with a long TTL since an artist's genres rarely change. Many users share the same artists, so
+    genres learned from one user's payloads serve everybody's aggregation.
+    """
+
+    def __init__(self, ttl=ARTIST_GENRES_TTL, max_entries=ARTIST_GENRES_CACHE_SIZE):
+        self.ttl = ttl
+        self.memory = InMemoryBackend(max_entries=max_entries)
+        # Updated from request, fan-out and ingestion threads alike, so only under the lock
+        self.metrics = {'memory_hits': 0, 'table_hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, counter, amount):
+        with self._lock:
+            self.metrics[counter] += amount
+
+    def remember(self, artists):
+        """
+        Stores the genres of full artist objects (top items, `artists?ids=` results). Simplified
+        artist objects, such as those embedded in tracks, carry no `genres` and are skipped.
+        Commits, so call it outside of other pending work.
+        """
+        now = int(time.time())
+        rows = {}
+        for artist in artists:
+            if artist and artist.get('id') and 'genres' in artist:
+                rows[artist['id']] = {'artist_id': artist['id'], 'genres': list(artist['genres']), 'fetched_at': now}
+        if not rows:
+            return
+        for artist_id, row in rows.items():
+            self.memory.set(artist_id, row['genres'], self.ttl)
+        upsert(ArtistGenres, list(rows.values()), ['artist_id'], ['genres', 'fetched_at'])
+        db.session.commit()
+
+    def get_many(self, artist_ids):
+        """
+        Returns a dict of artist ID -> genres for `artist_ids`, from memory, then the table. Artists
+        that are not cached are left out; the `backfill` job looks them up for the next time. This is
+        the genre source of aggregations that only have artist IDs (play history, saved library);
+        `me/top/artists` payloads carry their own genres. Needs an app context.
+        """
+        found = {}
+        missing = []
+        for artist_id in dict.fromkeys(artist_ids):
+            genres = self.memory.get(artist_id)
+            if genres is None:
+                missing.append(artist_id)
+            else:
+                found[artist_id] = genres
+        self._count('memory_hits', len(found))
+
+        if missing:
+            table_hits = 0
+            now = int(time.time())
+            for start in range(0, len(missing), 500):
+                rows = db.session.query(ArtistGenres).filter(
+                    ArtistGenres.artist_id.in_(missing[start:start + 500]),
+                    ArtistGenres.fetched_at > now - self.ttl
+                )
+                for row in rows:
+                    self.memory.set(row.artist_id, row.genres, row.fetched_at + self.ttl - now)
+                    found[row.artist_id] = row.genres
+                    table_hits += 1
+            self._count('table_hits', table_hits)
+            missing = [artist_id for artist_id in missing if artist_id not in found]
+
+        self._count('misses', len(missing))
+        return found
+
+    def backfill(self, user_id, fetch, limit=ARTIST_GENRES_BACKFILL_LIMIT):
+        """
+        Ingestion job looking up genres for artists in the user's play history and saved library
+        that are not cached yet (or have expired), up to `limit` artists per run.
+
+        :param fetch: Callable `(user_id, endpoint, params)` returning `(data, error)`
+        :return: A tuple of the number of artists stored and an error message or `None`
+        """
+        track_ids = select(Play.track_id).where(Play.user_id == user_id).union(
+            select(SavedTrack.track_id).where(SavedTrack.user_id == user_id)
+        ).subquery()
+        fresh = select(ArtistGenres.artist_id).where(ArtistGenres.fetched_at > int(time.time()) - self.ttl)
+        missing = db.session.execute(
+            select(track_artists.c.artist_id)
+            .where(track_artists.c.track_id.in_(select(track_ids.c.track_id)))
+            .where(track_artists.c.artist_id.not_in(fresh))
+            .distinct()
+            .limit(limit)
+        ).scalars().all()
+
+        stored = 0
+        for start in range(0, len(missing), ARTISTS_BATCH_SIZE):
+            batch = missing[start:start + ARTISTS_BATCH_SIZE]
+            data, error = fetch(user_id, 'artists', {'ids': ','.join(batch)})
+            if error:
+                return stored, error
+            artists = [a for a in data.get('artists', []) if a]
+            self.remember(artists)
+            stored += len(artists)
+        return stored, None
+
+    def stats(self):
+        with self._lock:
+            metrics = dict(self.metrics)
+        return {**metrics, 'memory_entries': len(self.memory), 'ttl': self.ttl}
@@ -0,0 +1,168 @@
+# asgi.py
+#
+# Async serving mode. Run with:
+#     uvicorn asgi:application --host 0.0.0.0 --port 5000
+#
+# The Spotify-bound endpoints below are served natively on the event loop: they run the same views
+# as the Flask routes (see `flows`), with Spotify calls awaited on a pooled non-blocking HTTP client
+# and database work offloaded to threads, so a worker is not tied up while Spotify answers. Every
+# other route (login, callback, refresh, docs, debug) is passed through to the regular Flask app.
+import functools
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import (
+    app,
+    run_async,
+    user_genres_view,
+    top_items_view,
+    audio_features_view,
+    top_genres_view,
+    library_view,
+    dashboard_view,
+)
+from auth import identity_from_tokens
+from cors import CORSPolicy, is_preflight
+from etags import CACHE_CONTROL, content_etag, etag_matches
+from metrics import record_async_request
+from http_client import close_async_client
+
+wsgi_application = WsgiToAsgi(app)
+
+cors_policy = CORSPolicy()
+
+
+def etag_headers(etag):
+    return [(b'etag', f'"{etag}"'.encode('latin-1'))]
+
+
+def encode_headers(headers):
+    return [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+
+# The CORS policy's header sets, encoded once per origin for the ASGI response start message
+_encoded_cors_headers = {}
+
+
+def cors_headers(origin, preflight=False):
+    key = (origin, preflight)
+    headers = _encoded_cors_headers.get(key)
+    if headers is None:
+        if preflight:
+            headers = encode_headers(cors_policy.preflight_headers(origin))
+        elif origin is None:
+            headers = []
+        else:
+            headers = encode_headers(cors_policy.response_headers(origin))
+        if len(_encoded_cors_headers) < 256:
+            _encoded_cors_headers[key] = headers
+    return headers
+
+
+class Request:
+    """The parts of an ASGI HTTP scope the async endpoints need."""
+
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        self.args = {k: v[0] for k, v in parse_qs(scope.get('query_string', b'').decode()).items()}
+        cookie = SimpleCookie()
+        cookie.load(self.headers.get('cookie', ''))
+        self.cookies = {k: morsel.value for k, morsel in cookie.items()}
+
+
+def resolve_user_id(request):
+    """Resolves the JWT from the access_token cookie, falling back to the Authorization header."""
+    candidates = [request.cookies.get('access_token')]
+    auth_header = request.headers.get('authorization', '')
+    if auth_header.startswith('Bearer '):
+        candidates.append(auth_header[7:])
+
+    with app.app_context():
+        user_id, _ = identity_from_tokens(candidates)
+    return user_id
+
+
+# Shared views served natively, by path
+ASYNC_ROUTES = {
+    '/api/user/tracks': functools.partial(top_items_view, item_type='tracks', limit=10),
+    '/api/user/artists': functools.partial(top_items_view, item_type='artists', limit=9),
+    '/api/user/genres': user_genres_view,
+    '/api/stats/audio-features': audio_features_view,
+    '/api/stats/genres': top_genres_view,
+    '/api/stats/library': library_view,
+    '/api/dashboard': dashboard_view,
+}
+
+
+async def send_json(send, status, body, origin=None, headers=None, if_none_match=None):
+    """
+    Sends a JSON response, serialized like Flask's `jsonify` so content ETags match the WSGI mode. A
+    200 is tagged (from the view's `ETag` header, else by content hash) and becomes a bodiless 304
+    when If-None-Match already holds the tag; with a view ETag the body is not even serialized then.
+    """
+    headers = dict(headers or {})
+    etag = headers.pop('ETag', None) if status == 200 else None
+    encoded = cors_headers(origin) + encode_headers(headers.items())
+    if status == 200:
+        encoded.append((b'cache-control', CACHE_CONTROL.encode('latin-1')))
+    if etag is None or not etag_matches(if_none_match, etag):
+        payload = app.json.response(body).get_data()
+        if status == 200 and etag is None:
+            etag = content_etag(payload)
+        if etag:
+            encoded += etag_headers(etag)
+        if not etag_matches(if_none_match, etag):
+            await send({
+                'type': 'http.response.start',
+                'status': status,
+                'headers': [
+                    (b'content-type', b'application/json'),
+                    (b'content-length', str(len(payload)).encode()),
+                ] + encoded,
+            })
+            return await send({'type': 'http.response.body', 'body': payload})
+    else:
+        encoded += etag_headers(etag)
+    await send({'type': 'http.response.start', 'status': 304, 'headers': encoded})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def handle_async_route(scope, receive, send):
+    request = Request(scope)
+    origin = request.headers.get('origin')
+    if is_preflight(request.method, request.headers.get('access-control-request-method')):
+        await send({'type': 'http.response.start', 'status': 204, 'headers': cors_headers(origin, preflight=True)})
+        return await send({'type': 'http.response.body', 'body': b''})
+    if request.method == 'OPTIONS':
+        return await send_json(send, 200, {'status': 'ok'}, origin)
+
+    user_id = resolve_user_id(request)
+    if not user_id:
+        return await send_json(send, 401, {"error": "Authentication required"}, origin)
+
+    status, body, headers = await run_async(ASYNC_ROUTES[request.path](user_id, request.args))
+    await send_json(send, status, body, origin, headers, request.headers.get('if-none-match'))
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_client()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI entry point: async handlers for Spotify-bound routes, Flask for everything else."""
+    if scope['type'] == 'lifespan':
+        return await lifespan(scope, receive, send)
+    if scope['type'] == 'http' and scope['path'] in ASYNC_ROUTES and scope['method'] in ('GET', 'OPTIONS'):
+        return await record_async_request(handle_async_route, scope, receive, send)
+    return await wsgi_application(scope, receive, send)
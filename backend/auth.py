@@ -0,0 +1,71 @@
+# auth.py
+import os
+import time
+
+from flask import g, request
+from flask_jwt_extended import decode_token
+
+from cache import InMemoryBackend
+
+VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv('VERIFIED_TOKEN_CACHE_SIZE', 4096))
+VERIFIED_TOKEN_MAX_TTL = int(os.getenv('VERIFIED_TOKEN_MAX_TTL', 3600))
+
+
+# Already-verified JWTs -> decoded claims. Keyed on the whole encoded token, never on the signature
+# segment alone, so a token with a tampered header or payload can never match; each entry expires
+# together with the token's own `exp` claim.
+verified_tokens = InMemoryBackend(max_entries=VERIFIED_TOKEN_CACHE_SIZE)
+
+
+def decode_jwt(token):
+    """
+    Decodes a JWT, verifying its signature and expiry only the first time this exact token is seen.
+    Raises like `flask_jwt_extended.decode_token` for invalid tokens. Needs an app context.
+    """
+    claims = verified_tokens.get(token)
+    if claims is None:
+        claims = decode_token(token)
+        ttl = claims.get('exp', time.time() + VERIFIED_TOKEN_MAX_TTL) - time.time()
+        if ttl > 0:
+            verified_tokens.set(token, claims, min(ttl, VERIFIED_TOKEN_MAX_TTL))
+    return claims
+
+
+def identity_from_tokens(tokens):
+    """Returns `(sub, claims)` for the first token in `tokens` that decodes, or `(None, None)`."""
+    for jwt_token in tokens:
+        if not jwt_token:
+            continue
+        try:
+            claims = decode_jwt(jwt_token)
+        except Exception as e:
+            print(f"Error decoding JWT token: {str(e)}")
+            continue
+        if 'sub' in claims:
+            return claims['sub'], claims
+        print("JWT token does not contain 'sub' claim")
+    return None, None
+
+
+def resolve_identity():
+    """
+    before_request hook that resolves the caller's identity once per request: the JWT in the
+    access_token cookie first, then a Bearer token in the Authorization header. The decoded claims
+    are kept on `g.jwt_claims` and the Spotify ID on `g.current_user_id` (`None` if unauthenticated).
+    """
+    g.current_user_id = None
+    g.jwt_claims = None
+    if request.method == 'OPTIONS':
+        return
+
+    candidates = [request.cookies.get('access_token')]
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer ') and auth_header[7:] != candidates[0]:
+        candidates.append(auth_header[7:])
+
+    g.current_user_id, g.jwt_claims = identity_from_tokens(candidates)
+
+
+def get_current_user_id():
+    """The Spotify ID resolved for this request by `resolve_identity`, or `None`."""
+    return g.get('current_user_id')
@@ -0,0 +1,166 @@
+# bench_async.py
+#
+# Compares how many concurrent Spotify-bound requests one process can serve in the sync (Flask,
+# fixed worker threads) and async (ASGI, one event loop) serving modes.
+#
+# Spotify is replaced by a local stub that answers every call after a fixed latency, the database
+# by a throwaway SQLite file holding one user with a valid token, and the response cache is
+# disabled so every request really goes upstream. Run from the backend directory:
+#     python benchmarks/bench_async.py --latency 0.1 --threads 8 --concurrency 64 --requests 512
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('--path', default='/api/stats/audio-features', help='endpoint to load')
+parser.add_argument('--latency', type=float, default=0.1, help='stub Spotify latency in seconds')
+parser.add_argument('--threads', type=int, default=8, help='worker threads in sync mode')
+parser.add_argument('--concurrency', type=int, default=64, help='concurrent clients')
+parser.add_argument('--requests', type=int, default=512, help='total requests per mode')
+parser.add_argument('--port', type=int, default=8765, help='stub Spotify port')
+args = parser.parse_args()
+
+# Configure the app before it is imported
+db_file = tempfile.NamedTemporaryFile(suffix='.sqlite', delete=False)
+os.environ['DATABASE_URL'] = f'sqlite:///{db_file.name}'
+os.environ['SPOTIFY_API_BASE_URL'] = f'http://127.0.0.1:{args.port}/v1'
+os.environ['CACHE_TTL'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def stub_payload(path, query):
+    params = {k: v[0] for k, v in parse_qs(query).items()}
+    limit = int(params.get('limit', 20))
+    if path.endswith('me/top/tracks'):
+        return {'items': [{'id': f't{i}', 'name': f'Track {i}'} for i in range(limit)], 'total': 50}
+    if path.endswith('me/top/artists'):
+        return {'items': [{'id': f'a{i}', 'name': f'Artist {i}', 'genres': ['indie', f'genre {i % 7}']} for i in range(limit)], 'total': 50}
+    if path.endswith('audio-features'):
+        ids = params.get('ids', '').split(',')
+        return {'audio_features': [{'id': i, 'energy': 0.5, 'danceability': 0.5, 'valence': 0.5, 'tempo': 120} for i in ids]}
+    if path.endswith('me/tracks'):
+        return {'items': [], 'total': 1000}
+    return {'items': []}
+
+
+async def stub_connection(reader, writer):
+    # Minimal keep-alive HTTP/1.1 server: read headers, wait, answer with JSON
+    try:
+        while True:
+            head = await reader.readuntil(b'\r\n\r\n')
+            target = head.split(b' ', 2)[1].decode()
+            parsed = urlparse(target)
+            await asyncio.sleep(args.latency)
+            body = json.dumps(stub_payload(parsed.path, parsed.query)).encode()
+            writer.write(
+                b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: keep-alive\r\n'
+                + f'Content-Length: {len(body)}\r\n\r\n'.encode() + body
+            )
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+    finally:
+        writer.close()
+
+
+def run_stub(ready):
+    async def main():
+        server = await asyncio.start_server(stub_connection, '127.0.0.1', args.port, backlog=1024)
+        ready.set()
+        async with server:
+            await server.serve_forever()
+    asyncio.run(main())
+
+
+ready = threading.Event()
+threading.Thread(target=run_stub, args=(ready,), daemon=True).start()
+ready.wait()
+
+import app as app_module  # noqa: E402
+from asgi import application  # noqa: E402
+from flask_jwt_extended import create_access_token  # noqa: E402
+from models import User  # noqa: E402
+
+flask_app = app_module.app
+with flask_app.app_context():
+    User.metadata.create_all(app_module.db.engine)
+    app_module.db.session.merge(User(
+        id='bench-user',
+        display_name='Bench',
+        email='bench@example.com',
+        access_token='stub-token',
+        refresh_token='stub-refresh',
+        expires_at=int(time.time()) + 24 * 3600
+    ))
+    app_module.db.session.commit()
+    jwt_token = create_access_token(identity='bench-user')
+
+path, _, query = args.path.partition('?')
+
+
+def summarize(mode, latencies, elapsed, statuses):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    ok = sum(1 for s in statuses if s == 200)
+    print(f"{mode:<6} {len(latencies) / elapsed:>9.1f} req/s   p50 {statistics.median(latencies) * 1000:>7.1f} ms   "
+          f"p99 {p99 * 1000:>7.1f} ms   ok {ok}/{len(statuses)}")
+
+
+def bench_sync():
+    # Each request holds one of `threads` worker threads for its whole duration, as in a threaded WSGI worker
+    def one_request():
+        client = flask_app.test_client()
+        client.set_cookie('access_token', jwt_token)
+        started = time.perf_counter()
+        response = client.get(path, query_string=query)
+        return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(lambda _: one_request(), range(args.requests)))
+    summarize('sync', [r[0] for r in results], time.perf_counter() - started, [r[1] for r in results])
+
+
+async def bench_async():
+    semaphore = asyncio.Semaphore(args.concurrency)
+    scope_template = {
+        'type': 'http',
+        'method': 'GET',
+        'path': path,
+        'query_string': query.encode(),
+        'headers': [(b'cookie', f'access_token={jwt_token}'.encode())],
+    }
+
+    async def one_request():
+        async with semaphore:
+            status = {}
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status['code'] = message['status']
+
+            started = time.perf_counter()
+            await application(dict(scope_template), receive, send)
+            return time.perf_counter() - started, status.get('code')
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one_request() for _ in range(args.requests)))
+    summarize('async', [r[0] for r in results], time.perf_counter() - started, [r[1] for r in results])
+
+
+print(f"{args.path}: {args.requests} requests, stub latency {args.latency * 1000:.0f} ms, "
+      f"sync threads {args.threads}, async concurrency {args.concurrency}")
+bench_sync()
+asyncio.run(bench_async())
+os.unlink(db_file.name)
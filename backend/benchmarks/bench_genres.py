@@ -0,0 +1,94 @@
+# bench_genres.py
+#
+# Measures genre scoring at artist-set sizes well beyond the 50 artists x 3 time ranges Spotify's
+# top items return, as a play history or saved library can reach. "before" is the scoring that used
+# to live in app.py: an intermediate (genre, weight) list, a second pass to sum it and a full sort
+# for the top K. "after" is GenreScorer's single accumulation pass with heap top-K selection. Both
+# outputs are checked to be identical before timing. Run from the backend directory:
+#     python benchmarks/bench_genres.py --sizes 150 1500 15000 150000
+import argparse
+import os
+import random
+import sys
+import time
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('--sizes', type=int, nargs='+', default=[150, 1500, 15000, 150000], help='total artists per scenario')
+parser.add_argument('--genres', type=int, default=2000, help='distinct genres to draw from')
+parser.add_argument('--repeat', type=int, default=5, help='runs per scenario (best is reported)')
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from genre_scoring import GenreScorer  # noqa: E402
+
+TIME_RANGES = ['short_term', 'medium_term', 'long_term']
+scorer = GenreScorer()
+
+
+def legacy_user_genres(artists_by_range):
+    all_genres = []
+    for time_range in TIME_RANGES:
+        data = artists_by_range.get(time_range)
+        if data and 'items' in data:
+            for i, artist in enumerate(data['items']):
+                weight = 1.0 - (i / len(data['items']))
+                for genre in artist.get('genres', []):
+                    time_range_multiplier = 1.5 if time_range == 'short_term' else (1.0 if time_range == 'medium_term' else 0.5)
+                    all_genres.append((genre, weight * time_range_multiplier))
+    genre_counts = {}
+    for genre, weight in all_genres:
+        if genre in genre_counts:
+            genre_counts[genre] += weight
+        else:
+            genre_counts[genre] = weight
+    return dict(sorted(genre_counts.items(), key=lambda x: x[1], reverse=True)[:15])
+
+
+def legacy_top_genres(artists_data):
+    genre_count = {}
+    for artist in artists_data.get('items', []):
+        for genre in artist.get('genres', []):
+            genre_count[genre] = genre_count.get(genre, 0) + 1
+    sorted_genres = [{"name": k, "count": v} for k, v in
+                     sorted(genre_count.items(), key=lambda x: x[1], reverse=True)]
+    return {
+        "genres": sorted_genres[:10],
+        "top_genre": sorted_genres[0]["name"] if sorted_genres else "Unknown"
+    }
+
+
+def make_artists(count, rng):
+    # Genre popularity is skewed, like real listening: a few genres are common, most are rare
+    genres = [f'genre-{n}' for n in range(args.genres)]
+    weights = [1 / (n + 1) for n in range(args.genres)]
+    return [{'id': f'artist-{n}', 'genres': rng.choices(genres, weights, k=rng.randint(0, 5))} for n in range(count)]
+
+
+def best_of(func, *func_args):
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        func(*func_args)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+rng = random.Random(42)
+print(f"{'artists':>9}  {'user genres before':>19}  {'after':>9}  {'top genres before':>18}  {'after':>9}")
+for size in args.sizes:
+    per_range = size // len(TIME_RANGES)
+    by_range = {time_range: {'items': make_artists(per_range, rng)} for time_range in TIME_RANGES}
+    flat = {'items': [artist for data in by_range.values() for artist in data['items']]}
+
+    assert legacy_user_genres(by_range) == scorer.user_genres(by_range)
+    assert legacy_top_genres(flat) == scorer.top_genres(flat['items'])
+
+    timings = [
+        best_of(legacy_user_genres, by_range),
+        best_of(scorer.user_genres, by_range),
+        best_of(legacy_top_genres, flat),
+        best_of(scorer.top_genres, flat['items']),
+    ]
+    print(f"{size:>9}  {timings[0] * 1000:>16.2f} ms  {timings[1] * 1000:>6.2f} ms  "
+          f"{timings[2] * 1000:>15.2f} ms  {timings[3] * 1000:>6.2f} ms")
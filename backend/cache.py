@@ -0,0 +1,276 @@
+# cache.py
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL')
+CACHE_TTL = int(os.getenv('CACHE_TTL', 600))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 2048))
+# How long an expired response is kept as the last known good copy for outages
+CACHE_STALE_TTL = int(os.getenv('CACHE_STALE_TTL', 24 * 3600))
+
+
+def make_key(user_id, endpoint, params=None):
+    """Builds a stable cache key from (user_id, endpoint, params), independent of param order."""
+    normalized = '&'.join(f"{k}={v}" for k, v in sorted((params or {}).items()))
+    return f"spotify:{user_id}:{endpoint}?{normalized}"
+
+
+def version_key(key):
+    """Key of the sidecar entry holding the version (content hash) of the cached response at `key`."""
+    return f"version:{key}"
+
+
+class InMemoryBackend:
+    """Per-process TTL cache with LRU eviction once `max_entries` is reached."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """
+    Shared cache backend so every worker sees the same entries. Redis handles TTL expiry itself and
+    should be configured with an LRU `maxmemory-policy` (e.g. allkeys-lru) for eviction.
+    """
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package") from e
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self._client.set(key, json.dumps(value), ex=int(ttl))
+
+    def delete_prefix(self, prefix):
+        keys = list(self._client.scan_iter(match=f"{prefix}*"))
+        if keys:
+            self._client.delete(*keys)
+
+    def __len__(self):
+        return self._client.dbsize()
+
+
+class ResponseCache:
+    """
+    Caches successful Spotify responses keyed on (user_id, endpoint, params). Errors are never
+    cached so a failed call is retried on the next request.
+
+    Entries are kept `stale_ttl` seconds past their TTL as the last known good copy. Callers that
+    pass `allow_stale` get that copy, marked `"stale": true`, when a refetch fails with an error
+    `stale_if` accepts (Spotify being unavailable), and a revalidation is handed to `revalidate`
+    to run in the background.
+
+    :param stale_if: Callable taking an error message, `True` if stale data may stand in
+    :param revalidate: Callable taking a zero-argument call to run in the background
+    """
+
+    def __init__(self, backend, ttl=CACHE_TTL, stale_ttl=CACHE_STALE_TTL, stale_if=None, revalidate=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.stale_if = stale_if
+        self.revalidate = revalidate
+        # Updated from request and fan-out threads alike, so only under the lock
+        self.metrics = {'hits': 0, 'misses': 0, 'stale_hits': 0}
+        self._lock = threading.Lock()
+        self._revalidating = set()
+        self._revalidating_lock = threading.Lock()
+
+    def _lookup(self, key):
+        """Returns `(data, fresh)`: the cached data (or `None`) and whether it is still within its TTL."""
+        try:
+            entry = self.backend.get(key)
+        except Exception as e:
+            print(f"Cache read error: {str(e)}")
+            entry = None
+        # Entries written before stale copies were kept have no envelope; treat them as misses
+        if not isinstance(entry, dict) or 'stored_at' not in entry:
+            self._count('misses')
+            return None, False
+        if time.time() - entry['stored_at'] < self.ttl:
+            self._count('hits')
+            return entry['data'], True
+        self._count('misses')
+        return entry['data'], False
+
+    def _count(self, counter):
+        with self._lock:
+            self.metrics[counter] += 1
+
+    def _store(self, key, data, error):
+        if error is None and data is not None:
+            try:
+                self.backend.set(key, {'data': data, 'stored_at': time.time()}, self.ttl + self.stale_ttl)
+                # Identical content refetched after expiry keeps its version, and with it the ETag
+                version = hashlib.blake2b(json.dumps(data, sort_keys=True).encode(), digest_size=16).hexdigest()
+                self.backend.set(version_key(key), version, self.ttl)
+            except Exception as e:
+                print(f"Cache write error: {str(e)}")
+
+    def _can_serve_stale(self, stale, error, allow_stale):
+        return allow_stale and stale is not None and error is not None and bool(self.stale_if and self.stale_if(error))
+
+    def _serve_stale(self, stale):
+        self._count('stale_hits')
+        return {**stale, 'stale': True}, None
+
+    def _claim_revalidation(self, key):
+        with self._revalidating_lock:
+            if key in self._revalidating:
+                return False
+            self._revalidating.add(key)
+            return True
+
+    def _revalidate_in_background(self, key, fetch):
+        # At most one revalidation per key at a time; while Spotify is still down it fails fast
+        if self.revalidate is None or not self._claim_revalidation(key):
+            return
+
+        def refresh():
+            try:
+                data, error = fetch()
+                self._store(key, data, error)
+            finally:
+                self._revalidating.discard(key)
+        self.revalidate(refresh)
+
+    def get_or_fetch(self, user_id, endpoint, params, fetch, allow_stale=False):
+        """
+        Returns `(data, error)` like `spotify_api_request`, calling `fetch()` only on a miss. With
+        `allow_stale`, a failed refetch falls back to the last known good copy, if there is one.
+        """
+        key = make_key(user_id, endpoint, params)
+        cached, fresh = self._lookup(key)
+        if fresh:
+            return cached, None
+
+        data, error = fetch()
+        if self._can_serve_stale(cached, error, allow_stale):
+            self._revalidate_in_background(key, fetch)
+            return self._serve_stale(cached)
+        self._store(key, data, error)
+        return data, error
+
+    async def get_or_fetch_async(self, user_id, endpoint, params, fetch, allow_stale=False):
+        """
+        Async variant of `get_or_fetch` for the ASGI serving mode, where `fetch` is a coroutine
+        function. Backend reads and writes stay synchronous; the in-process backend never blocks.
+        Revalidations run as tasks on the event loop.
+        """
+        key = make_key(user_id, endpoint, params)
+        cached, fresh = self._lookup(key)
+        if fresh:
+            return cached, None
+
+        data, error = await fetch()
+        if self._can_serve_stale(cached, error, allow_stale):
+            if self._claim_revalidation(key):
+                asyncio.ensure_future(self._refresh_async(key, fetch))
+            return self._serve_stale(cached)
+        self._store(key, data, error)
+        return data, error
+
+    async def _refresh_async(self, key, fetch):
+        try:
+            data, error = await fetch()
+            self._store(key, data, error)
+        finally:
+            self._revalidating.discard(key)
+
+    def stale_fallback(self, user_id, endpoint, params, error):
+        """
+        For a fetch given up on outside `get_or_fetch` (a fan-out call past its deadline), returns the
+        cached copy marked stale if `error` allows one, else `(None, error)`. Revalidation is left to
+        the abandoned fetch, which still stores its result when it completes.
+        """
+        if not (self.stale_if and self.stale_if(error)):
+            return None, error
+        try:
+            entry = self.backend.get(make_key(user_id, endpoint, params))
+        except Exception as e:
+            print(f"Cache read error: {str(e)}")
+            entry = None
+        if not isinstance(entry, dict) or 'stored_at' not in entry:
+            return None, error
+        return self._serve_stale(entry['data'])
+
+    def version(self, user_id, endpoint, params):
+        """
+        Version of the cached response for (user_id, endpoint, params), or `None` if there is none.
+        Responses derived from a cached payload can be tagged with it without re-serializing.
+        """
+        try:
+            return self.backend.get(version_key(make_key(user_id, endpoint, params)))
+        except Exception as e:
+            print(f"Cache read error: {str(e)}")
+            return None
+
+    def invalidate_user(self, user_id):
+        """Drops every cached response for a user, e.g. after they log in again."""
+        try:
+            self.backend.delete_prefix(f"spotify:{user_id}:")
+            self.backend.delete_prefix(version_key(f"spotify:{user_id}:"))
+        except Exception as e:
+            print(f"Cache invalidation error: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            metrics = dict(self.metrics)
+        total = metrics['hits'] + metrics['misses']
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            **metrics,
+            'revalidating': len(self._revalidating),
+            'hit_ratio': metrics['hits'] / total if total else 0.0,
+        }
+
+
+def create_cache(**options):
+    """Creates the response cache for the backend selected by CACHE_BACKEND, passing `options` to ResponseCache."""
+    if CACHE_BACKEND == 'redis':
+        if not CACHE_REDIS_URL:
+            raise RuntimeError("CACHE_BACKEND=redis requires CACHE_REDIS_URL")
+        return ResponseCache(RedisBackend(CACHE_REDIS_URL), **options)
+    return ResponseCache(InMemoryBackend(), **options)
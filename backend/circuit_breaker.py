@@ -0,0 +1,152 @@
+# circuit_breaker.py
+import os
+import threading
+import time
+from collections import deque
+
+from deadlines import BUDGET_EXHAUSTED_ERROR
+
+CIRCUIT_WINDOW = float(os.getenv('CIRCUIT_WINDOW', 30))
+CIRCUIT_MIN_CALLS = int(os.getenv('CIRCUIT_MIN_CALLS', 10))
+CIRCUIT_ERROR_RATE = float(os.getenv('CIRCUIT_ERROR_RATE', 0.5))
+CIRCUIT_SLOW_CALL = float(os.getenv('CIRCUIT_SLOW_CALL', 2.0))
+CIRCUIT_SLOW_RATE = float(os.getenv('CIRCUIT_SLOW_RATE', 0.5))
+CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', 30))
+
+CIRCUIT_OPEN_ERROR = "Spotify unavailable (circuit open)"
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Error prefixes meaning Spotify could not be reached or did not answer (in time), as opposed to an
+# answer about the request itself (bad token, unknown user, 4xx)
+UPSTREAM_FAILURES = (CIRCUIT_OPEN_ERROR, 'Request error', 'Spotify API error: 5', 'Rate limited', BUDGET_EXHAUSTED_ERROR)
+
+
+def is_upstream_failure(error):
+    """Whether an error from `spotify_api_request` means Spotify is unavailable, so stale data may stand in."""
+    return bool(error) and error.startswith(UPSTREAM_FAILURES)
+
+
+class CircuitBreaker:
+    """
+    Breaker for one upstream endpoint, over the calls of the last `window` seconds. It opens once at
+    least `min_calls` were made and either `error_rate` of them failed or `slow_rate` took longer than
+    `slow_call` seconds. While open, calls are refused without touching the network; after
+    `open_seconds` a single probe call is let through (half-open), closing the breaker if it succeeds
+    and reopening it otherwise.
+    """
+
+    def __init__(self, window=CIRCUIT_WINDOW, min_calls=CIRCUIT_MIN_CALLS,
+                 error_rate=CIRCUIT_ERROR_RATE, slow_call=CIRCUIT_SLOW_CALL,
+                 slow_rate=CIRCUIT_SLOW_RATE, open_seconds=CIRCUIT_OPEN_SECONDS):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        # (finished_at, failed, slow) per call in the window, plus running totals
+        self._calls = deque()
+        self._failures = 0
+        self._slow = 0
+        self._lock = threading.Lock()
+        self.metrics = {'trips': 0, 'rejected': 0}
+
+    def allow(self):
+        """Whether a call may go out now. A `True` must be followed by `record` or `cancel`."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.metrics['rejected'] += 1
+            return False
+
+    def record(self, failed, latency):
+        """Records the outcome of an allowed call: whether it failed and how long it took."""
+        slow = latency > self.slow_call
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if failed or slow:
+                    self._trip(now)
+                else:
+                    self._reset()
+                return
+            if self.state == OPEN:
+                return
+
+            self._calls.append((now, failed, slow))
+            self._failures += failed
+            self._slow += slow
+            while self._calls and self._calls[0][0] < now - self.window:
+                _, old_failed, old_slow = self._calls.popleft()
+                self._failures -= old_failed
+                self._slow -= old_slow
+
+            count = len(self._calls)
+            if count >= self.min_calls and (
+                    self._failures / count >= self.error_rate or self._slow / count >= self.slow_rate):
+                self._trip(now)
+
+    def cancel(self):
+        """Releases an allowed call that never reached the network (e.g. it was rate limited)."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+
+    def _trip(self, now):
+        self.state = OPEN
+        self._opened_at = now
+        self.metrics['trips'] += 1
+        self._reset_window()
+
+    def _reset(self):
+        self.state = CLOSED
+        self._reset_window()
+
+    def _reset_window(self):
+        self._calls.clear()
+        self._failures = 0
+        self._slow = 0
+
+    def stats(self):
+        with self._lock:
+            count = len(self._calls)
+            return {
+                'state': self.state,
+                'calls': count,
+                'error_rate': self._failures / count if count else 0.0,
+                'slow_rate': self._slow / count if count else 0.0,
+                **self.metrics
+            }
+
+
+class CircuitBreakers:
+    """One CircuitBreaker per upstream endpoint, created on first use."""
+
+    def __init__(self, **settings):
+        self.settings = settings
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint):
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(endpoint, CircuitBreaker(**self.settings))
+        return breaker
+
+    def stats(self):
+        return {endpoint: breaker.stats() for endpoint, breaker in list(self._breakers.items())}
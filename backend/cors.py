@@ -0,0 +1,78 @@
+# cors.py
+import os
+
+CORS_ORIGINS = [o.strip() for o in os.getenv('CORS_ORIGINS', 'http://localhost:3000').split(',') if o.strip()]
+CORS_MAX_AGE = int(os.getenv('CORS_MAX_AGE', 600))
+
+
+class CORSPolicy:
+    """
+    CORS rules with every header set computed once at startup, per allowed origin: one list for
+    preflight answers and one for actual responses. Per request the only work left is a dict lookup
+    on the Origin header.
+    """
+
+    def __init__(self, origins=CORS_ORIGINS,
+                 methods=("GET", "POST", "PUT", "DELETE", "OPTIONS"),
+                 allow_headers=("Content-Type", "Authorization"),
+                 expose_headers=("Content-Type", "Authorization", "Set-Cookie"),
+                 supports_credentials=True,
+                 max_age=CORS_MAX_AGE):
+        self._preflight = {}
+        self._response = {}
+        for origin in origins:
+            common = [('Access-Control-Allow-Origin', origin), ('Vary', 'Origin')]
+            if supports_credentials:
+                common.append(('Access-Control-Allow-Credentials', 'true'))
+            self._preflight[origin] = common + [
+                ('Access-Control-Allow-Methods', ', '.join(methods)),
+                ('Access-Control-Allow-Headers', ', '.join(allow_headers)),
+                ('Access-Control-Max-Age', str(max_age)),
+                ('Content-Length', '0'),
+            ]
+            self._response[origin] = common + [
+                ('Access-Control-Expose-Headers', ', '.join(expose_headers)),
+            ]
+        self._rejected_preflight = [('Vary', 'Origin'), ('Content-Length', '0')]
+        self._rejected_response = [('Vary', 'Origin')]
+
+    def preflight_headers(self, origin):
+        """Headers answering a preflight; without Allow-Origin if the origin is not allowed."""
+        return self._preflight.get(origin, self._rejected_preflight)
+
+    def response_headers(self, origin):
+        """Headers to add to an actual response for this origin."""
+        return self._response.get(origin, self._rejected_response)
+
+
+def is_preflight(method, access_control_request_method):
+    return method == 'OPTIONS' and bool(access_control_request_method)
+
+
+class CORSMiddleware:
+    """
+    WSGI middleware applying a `CORSPolicy`. Preflights are answered here with 204 before Flask
+    routes the request or runs any auth hook, and browsers cache them for `max_age` seconds.
+    """
+
+    def __init__(self, wsgi_app, policy):
+        self.wsgi_app = wsgi_app
+        self.policy = policy
+
+    def __call__(self, environ, start_response):
+        origin = environ.get('HTTP_ORIGIN')
+
+        if is_preflight(environ['REQUEST_METHOD'], environ.get('HTTP_ACCESS_CONTROL_REQUEST_METHOD')):
+            start_response('204 No Content', list(self.policy.preflight_headers(origin)))
+            return [b'']
+
+        if origin is None:
+            return self.wsgi_app(environ, start_response)
+
+        extra_headers = self.policy.response_headers(origin)
+
+        def start_response_with_cors(status, headers, exc_info=None):
+            headers.extend(extra_headers)
+            return start_response(status, headers, exc_info)
+
+        return self.wsgi_app(environ, start_response_with_cors)
@@ -1,8 +1,8 @@
 # database.py
-from models import User
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import User, db
 
-db = SQLAlchemy()
 def get_user(user_id: str) -> User:
     return db.session.get(User, user_id)
 
@@ -11,4 +11,42 @@ def update_user_token(user_id: str, access_token: str, refresh_token: str) -> No
     if user:
         user.access_token = access_token
         user.refresh_token = refresh_token
-        db.session.commit()
\ No newline at end of file
+        db.session.commit()
+
+INSERT_BATCH_SIZE = 500
+
+_INSERT_BY_DIALECT = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+def insert_ignore(table, rows: list) -> int:
+    """
+    Bulk-inserts `rows` (dicts) into `table` in multi-row batches, skipping rows that collide with an
+    existing primary or unique key (INSERT ... ON CONFLICT DO NOTHING). Does not commit.
+    Returns the number of rows actually inserted.
+    """
+    table = getattr(table, '__table__', table)
+    insert = _INSERT_BY_DIALECT[db.engine.dialect.name]
+    inserted = 0
+    # Multi-row VALUES batches: one round trip each, exact rowcounts, well under bind-parameter limits
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        statement = insert(table).values(rows[start:start + INSERT_BATCH_SIZE]).on_conflict_do_nothing()
+        inserted += db.session.execute(statement).rowcount
+    return inserted
+
+def upsert(table, rows: list, key_columns: list, update_columns: list) -> None:
+    """
+    Bulk-inserts `rows` (dicts) into `table` in multi-row batches, overwriting `update_columns` of
+    rows whose `key_columns` already exist (INSERT ... ON CONFLICT DO UPDATE). Keys must be unique
+    within `rows`. Does not commit.
+    """
+    table = getattr(table, '__table__', table)
+    insert = _INSERT_BY_DIALECT[db.engine.dialect.name]
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        statement = insert(table).values(rows[start:start + INSERT_BATCH_SIZE])
+        statement = statement.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={column: statement.excluded[column] for column in update_columns}
+        )
+        db.session.execute(statement)
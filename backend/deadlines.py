@@ -0,0 +1,59 @@
+# deadlines.py
+import contextvars
+import functools
+import inspect
+import os
+import time
+from contextlib import contextmanager
+
+# Budget of routes that do not declare their own
+LATENCY_BUDGET = float(os.getenv('LATENCY_BUDGET', 4.0))
+
+BUDGET_EXHAUSTED_ERROR = "Latency budget exhausted"
+
+# monotonic() time the current request must answer by. Context variables follow the request into
+# asyncio tasks and `asyncio.to_thread`; `fan_out` copies the context into its worker threads.
+_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+
+@contextmanager
+def budget(seconds):
+    """Runs the block under a latency budget of `seconds`, or the enclosing budget if that ends sooner."""
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def latency_budget(seconds=LATENCY_BUDGET):
+    """Decorator giving a view (plain function or flow, see `flows`) a latency budget for everything it calls."""
+    def decorate(view):
+        if inspect.isgeneratorfunction(view):
+            # The budget holds from the flow's first step to its result, whichever mode runs it
+            @functools.wraps(view)
+            def budgeted_flow(*args, **kwargs):
+                with budget(seconds):
+                    return (yield from view(*args, **kwargs))
+            return budgeted_flow
+
+        @functools.wraps(view)
+        def budgeted(*args, **kwargs):
+            with budget(seconds):
+                return view(*args, **kwargs)
+        return budgeted
+    return decorate
+
+
+def remaining():
+    """Seconds left in the current budget (0 once it is spent), or `None` outside of any budget."""
+    deadline = _deadline.get()
+    return None if deadline is None else max(deadline - time.monotonic(), 0.0)
+
+
+def within_budget(seconds):
+    """`seconds` capped to what is left of the current budget."""
+    left = remaining()
+    return seconds if left is None else min(seconds, left)
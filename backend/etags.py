@@ -0,0 +1,50 @@
+# etags.py
+import hashlib
+
+from flask import request
+
+# Browsers may keep per-user responses but must revalidate them (cheaply, with If-None-Match)
+CACHE_CONTROL = 'private, no-cache'
+
+
+def content_etag(body):
+    """Tag of a serialized response body."""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def version_etag(*parts):
+    """
+    Tag derived from what a payload was built from (a cache entry's version, a stat's
+    `computed_at`, ...), so a match can be answered before the payload is even serialized.
+    """
+    return hashlib.blake2b(':'.join(map(str, parts)).encode(), digest_size=16).hexdigest()
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of an unquoted tag against an If-None-Match header value, as RFC 9110 asks for."""
+    if not if_none_match or not etag:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate.strip('"') == etag:
+            return True
+    return False
+
+
+def tag_json_response(response):
+    """
+    `after_request` hook giving successful JSON API responses that carry no ETag yet a content hash
+    one, and turning them into a 304 when the client already has that body. Streamed responses
+    (exports) are left alone.
+    """
+    if (request.method == 'GET' and response.status_code == 200 and response.is_json
+            and not response.is_streamed and request.path.startswith('/api/')):
+        if 'ETag' not in response.headers:
+            response.set_etag(content_etag(response.get_data()))
+            response.make_conditional(request)
+        response.headers.setdefault('Cache-Control', CACHE_CONTROL)
+    return response
@@ -0,0 +1,91 @@
+# exports.py
+import json
+import os
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+
+from models import db, Play, SavedTrack, Track
+
+# Rows fetched per round trip of the server-side cursor, and written per response chunk
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json'
+}
+
+
+def iso_timestamp(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def play_rows(user_id):
+    """The user's plays, oldest first, with the catalog details of each track."""
+    return (
+        select(Play.played_at, Play.track_id, Play.context_uri, Track.name, Track.album_name, Track.duration_ms)
+        .outerjoin(Track, Track.id == Play.track_id)
+        .where(Play.user_id == user_id)
+        .order_by(Play.played_at)
+    ), lambda row: {
+        'played_at': iso_timestamp(row.played_at),
+        'track_id': row.track_id,
+        'track_name': row.name,
+        'album_name': row.album_name,
+        'duration_ms': row.duration_ms,
+        'context_uri': row.context_uri
+    }
+
+
+def library_rows(user_id):
+    """The user's mirrored saved tracks, most recently saved first, with their catalog details."""
+    return (
+        select(SavedTrack.added_at, SavedTrack.track_id, Track.name, Track.album_name, Track.duration_ms)
+        .outerjoin(Track, Track.id == SavedTrack.track_id)
+        .where(SavedTrack.user_id == user_id)
+        .order_by(SavedTrack.added_at.desc())
+    ), lambda row: {
+        'added_at': iso_timestamp(row.added_at),
+        'track_id': row.track_id,
+        'track_name': row.name,
+        'album_name': row.album_name,
+        'duration_ms': row.duration_ms
+    }
+
+
+EXPORTS = {
+    'plays': play_rows,
+    'library': library_rows
+}
+
+
+def stream_export(user_id, export, fmt='ndjson', batch_size=EXPORT_BATCH_SIZE):
+    """
+    Generates an export as text chunks, one per batch of rows read from a server-side cursor, so
+    memory stays flat however many rows there are. `ndjson` yields one JSON object per line; `json`
+    yields a single array, opened before the query runs so the first byte goes out immediately.
+    Needs an app context for as long as it is consumed (wrap it in `stream_with_context`).
+
+    :param export: A key of EXPORTS
+    :param fmt: A key of EXPORT_MIMETYPES
+    """
+    statement, serialize = EXPORTS[export](user_id)
+    as_array = fmt == 'json'
+    if as_array:
+        yield '['
+
+    result = db.session.execute(statement, execution_options={'yield_per': batch_size})
+    separator = ''
+    try:
+        for rows in result.partitions():
+            lines = [json.dumps(serialize(row), separators=(',', ':')) for row in rows]
+            if as_array:
+                yield separator + ',\n'.join(lines)
+                separator = ',\n'
+            else:
+                yield '\n'.join(lines) + '\n'
+    finally:
+        result.close()
+
+    if as_array:
+        yield ']\n'
@@ -0,0 +1,120 @@
+# fanout.py
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from deadlines import within_budget, BUDGET_EXHAUSTED_ERROR
+from metrics import FANOUT_DURATION
+
+FANOUT_WORKERS = int(os.getenv('FANOUT_WORKERS', 16))
+FANOUT_DEADLINE = float(os.getenv('FANOUT_DEADLINE', 5))
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Returns this worker process's thread pool, recreating it after a fork."""
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(
+                    max_workers=FANOUT_WORKERS,
+                    thread_name_prefix='spotify-fanout'
+                )
+                _executor_pid = pid
+    return _executor
+
+
+def _run_in_app_context(app, call):
+    # Each worker thread needs its own app context (and so its own db session)
+    with app.app_context():
+        return call()
+
+
+def _run_logged(app, call):
+    try:
+        _run_in_app_context(app, call)
+    except Exception as e:
+        print(f"Background call failed: {str(e)}")
+
+
+def run_in_background(app, call):
+    """Runs a zero-argument `call` on the fan-out pool, in its own app context, without waiting for it."""
+    return get_executor().submit(_run_logged, app, call)
+
+
+def fan_out(app, calls, deadline=FANOUT_DEADLINE):
+    """
+    Runs several `(data, error)`-returning calls concurrently and waits at most `deadline` seconds
+    (or what is left of the request's latency budget, which the calls inherit) for all of them.
+    Calls that raise or miss the deadline come back as `(None, error)` so callers can still use the
+    partial results; a late call keeps running in the background and its result is dropped. Late
+    calls get BUDGET_EXHAUSTED_ERROR, which counts as Spotify being unavailable (stale data may stand in).
+
+    :param app: The Flask app, used to push an app context in each worker thread
+    :param calls: A dict mapping a name to a zero-argument callable
+    :param deadline: Seconds to wait for the whole batch
+    :return: A dict mapping each name to a `(data, error)` tuple
+    """
+    started = time.monotonic()
+    deadline = within_budget(deadline)
+    executor = get_executor()
+    # Each call runs in a copy of the caller's context, so the latency budget follows it into the pool
+    futures = {
+        name: executor.submit(contextvars.copy_context().run, _run_in_app_context, app, call)
+        for name, call in calls.items()
+    }
+    wait(futures.values(), timeout=deadline)
+
+    results = {}
+    for name, future in futures.items():
+        if not future.done():
+            future.cancel()
+            results[name] = (None, BUDGET_EXHAUSTED_ERROR)
+            continue
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            results[name] = (None, f"Request error: {str(e)}")
+
+    FANOUT_DURATION.observe(time.monotonic() - started, str(len(calls)))
+    return results
+
+
+async def fan_out_async(coroutines, deadline=FANOUT_DEADLINE):
+    """
+    Async counterpart of `fan_out` for the ASGI serving mode: awaits several `(data, error)`
+    coroutines on the running event loop for at most `deadline` seconds (or the rest of the latency
+    budget). Coroutines still pending at the deadline are cancelled and come back as
+    `(None, BUDGET_EXHAUSTED_ERROR)`.
+
+    :param coroutines: A dict mapping a name to a coroutine
+    :param deadline: Seconds to wait for the whole batch
+    :return: A dict mapping each name to a `(data, error)` tuple
+    """
+    if not coroutines:
+        return {}
+    started = time.monotonic()
+    deadline = within_budget(deadline)
+    tasks = {name: asyncio.ensure_future(coro) for name, coro in coroutines.items()}
+    await asyncio.wait(tasks.values(), timeout=deadline)
+
+    results = {}
+    for name, task in tasks.items():
+        if not task.done():
+            task.cancel()
+            results[name] = (None, BUDGET_EXHAUSTED_ERROR)
+            continue
+        try:
+            results[name] = task.result()
+        except Exception as e:
+            results[name] = (None, f"Request error: {str(e)}")
+    FANOUT_DURATION.observe(time.monotonic() - started, str(len(coroutines)))
+    return results
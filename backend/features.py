@@ -0,0 +1,108 @@
+# features.py
+import os
+import time
+
+from sqlalchemy import select, union
+
+from database import insert_ignore
+from flows import blocking
+from models import db, Play, SavedTrack, TrackFeatures
+
+# Spotify's maximum number of IDs per audio-features call
+FEATURES_BATCH_SIZE = 100
+FEATURES_BACKFILL_LIMIT = int(os.getenv('FEATURES_BACKFILL_LIMIT', 1000))
+
+FEATURE_FIELDS = [
+    'danceability', 'energy', 'valence', 'acousticness', 'instrumentalness', 'liveness',
+    'speechiness', 'tempo', 'loudness', 'key', 'mode', 'time_signature', 'duration_ms'
+]
+
+
+def batches(ids, size=FEATURES_BATCH_SIZE):
+    return [ids[start:start + size] for start in range(0, len(ids), size)]
+
+
+def features_dict(row):
+    """A stored row in the shape of one `audio-features` item, or `None` if Spotify has none."""
+    if not row.available:
+        return None
+    return {'id': row.track_id, **{field: getattr(row, field) for field in FEATURE_FIELDS}}
+
+
+def lookup_features(track_ids):
+    """
+    Looks track IDs up in the local store. Returns `(found, missing)`: a dict of ID -> features (or
+    `None` for tracks known to have none) and the list of IDs never fetched yet.
+    """
+    unique_ids = list(dict.fromkeys(track_ids))
+    found = {}
+    for batch in batches(unique_ids, 500):
+        for row in db.session.query(TrackFeatures).filter(TrackFeatures.track_id.in_(batch)):
+            found[row.track_id] = features_dict(row)
+    return found, [track_id for track_id in unique_ids if track_id not in found]
+
+
+def store_features(requested_ids, audio_features):
+    """
+    Stores one `audio-features` response for `requested_ids`, recording IDs Spotify returned `null`
+    for as unavailable so they are not asked for again. Returns a dict of ID -> features (or `None`).
+    """
+    by_id = {f['id']: f for f in audio_features if f and f.get('id')}
+    now = int(time.time())
+    rows = []
+    for track_id in requested_ids:
+        features = by_id.get(track_id)
+        row = {'track_id': track_id, 'available': features is not None, 'fetched_at': now}
+        row.update({field: features.get(field) if features else None for field in FEATURE_FIELDS})
+        rows.append(row)
+    insert_ignore(TrackFeatures, rows)
+    db.session.commit()
+    return {track_id: by_id.get(track_id) for track_id in requested_ids}
+
+
+def resolve_audio_features(track_ids, fetch_batch):
+    """
+    Flow (see `flows`) returning audio features for `track_ids`, reading the local store first and
+    fetching only the misses from Spotify, in batches of up to 100 IDs.
+
+    :param track_ids: Spotify track IDs
+    :param fetch_batch: Callable taking a list of at most 100 IDs and returning a flow that results
+    in the `(data, error)` of an `audio-features` call for them
+    :return: A tuple of an `audio-features`-shaped dict (items in `track_ids` order, `None` for
+    tracks without features) or `None`, and an error message or `None`
+    """
+    found, missing = yield blocking(lookup_features, track_ids)
+    for batch in batches(missing):
+        data, error = yield from fetch_batch(batch)
+        if error:
+            return None, error
+        found.update((yield blocking(store_features, batch, data.get('audio_features', []))))
+    return {'audio_features': [found.get(track_id) for track_id in track_ids]}, None
+
+
+def backfill_track_features(user_id, fetch, limit=FEATURES_BACKFILL_LIMIT):
+    """
+    Ingestion job warming the store with features for tracks in the user's play history and saved
+    library that have never been fetched, up to `limit` tracks per run.
+
+    :param fetch: Callable `(user_id, endpoint, params)` returning `(data, error)`
+    :return: A tuple of the number of tracks stored and an error message or `None`
+    """
+    candidates = union(
+        select(Play.track_id).where(Play.user_id == user_id),
+        select(SavedTrack.track_id).where(SavedTrack.user_id == user_id)
+    ).subquery()
+    missing = db.session.execute(
+        select(candidates.c.track_id)
+        .where(candidates.c.track_id.not_in(select(TrackFeatures.track_id)))
+        .limit(limit)
+    ).scalars().all()
+
+    stored = 0
+    for batch in batches(missing):
+        data, error = fetch(user_id, 'audio-features', {'ids': ','.join(batch)})
+        if error:
+            return stored, error
+        store_features(batch, data.get('audio_features', []))
+        stored += len(batch)
+    return stored, None
@@ -0,0 +1,59 @@
+# flows.py
+#
+# Request logic shared by the Flask app and the ASGI serving mode. A flow is a generator that
+# yields a `Step` for each I/O operation it needs and is sent the step's result back (or has its
+# exception thrown in), returning its own result at the end. The policy lives in the flow once;
+# `run` makes each step's blocking call on the current thread, `run_async` awaits its coroutine
+# variant on the event loop, so only the I/O layer differs between the two modes.
+
+
+class Step:
+    """An I/O operation of a flow: `call(*args)` when run blocking, `await call_async(*args)` on an event loop."""
+
+    __slots__ = ('call', 'call_async', 'args')
+
+    def __init__(self, call, call_async, *args):
+        self.call = call
+        self.call_async = call_async
+        self.args = args
+
+
+def blocking(call, *args):
+    """Step for a call with no coroutine variant (database work): `run_async` hands it to its `offload`."""
+    return Step(call, None, *args)
+
+
+def run(flow):
+    """Runs `flow` to completion on the current thread and returns its result."""
+    result, error = None, None
+    while True:
+        try:
+            step = flow.send(result) if error is None else flow.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            result, error = step.call(*step.args), None
+        except Exception as e:
+            result, error = None, e
+
+
+async def run_async(flow, offload):
+    """
+    Runs `flow` to completion on the running event loop and returns its result.
+
+    :param offload: Coroutine function `(call, *args)` running a `blocking` step's call off the loop
+    """
+    result, error = None, None
+    while True:
+        try:
+            step = flow.send(result) if error is None else flow.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            if step.call_async is None:
+                result = await offload(step.call, *step.args)
+            else:
+                result = await step.call_async(*step.args)
+            error = None
+        except Exception as e:
+            result, error = None, e
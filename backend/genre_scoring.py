@@ -0,0 +1,107 @@
+# genre_scoring.py
+import heapq
+import math
+import os
+from operator import itemgetter
+
+GENRE_RANK_DECAY = os.getenv('GENRE_RANK_DECAY', 'linear')
+GENRE_DECAY_HALF_LIFE = float(os.getenv('GENRE_DECAY_HALF_LIFE', 10))
+# e.g. "short_term:1.5,medium_term:1.0,long_term:0.5" (recent listening counts more)
+GENRE_RANGE_WEIGHTS = os.getenv('GENRE_RANGE_WEIGHTS', 'short_term:1.5,medium_term:1.0,long_term:0.5')
+
+
+def parse_range_weights(spec):
+    """Parses "range:weight,..." into a dict."""
+    weights = {}
+    for part in spec.split(','):
+        if part.strip():
+            time_range, weight = part.split(':')
+            weights[time_range.strip()] = float(weight)
+    return weights
+
+
+def linear_decay(rank, count):
+    """1.0 for the top artist, falling linearly towards 0 for the last of `count`."""
+    return 1.0 - rank / count
+
+
+def exponential_decay(half_life):
+    """Decay halving an artist's weight every `half_life` ranks."""
+    rate = math.log(2) / half_life
+    return lambda rank, count: math.exp(-rate * rank)
+
+
+def no_decay(rank, count):
+    return 1.0
+
+
+def decay_from_settings(name=GENRE_RANK_DECAY, half_life=GENRE_DECAY_HALF_LIFE):
+    if name == 'exponential':
+        return exponential_decay(half_life)
+    if name == 'none':
+        return no_decay
+    return linear_decay
+
+
+class GenreScorer:
+    """
+    Genre scoring shared by the genre endpoints. Each artist's genres earn the artist's rank weight
+    (from `decay`) times its time range's weight. Weights are accumulated in one pass over the
+    artists straight into a dict, and the top K are selected with a heap rather than a full sort.
+
+    :param range_weights: A dict mapping a time range to its multiplier
+    :param decay: Callable `(rank, count)` returning the weight of the artist at 0-based `rank`
+    among `count` artists
+    """
+
+    def __init__(self, range_weights=None, decay=None):
+        self.range_weights = range_weights if range_weights is not None else parse_range_weights(GENRE_RANGE_WEIGHTS)
+        self.decay = decay or decay_from_settings()
+
+    def rank_weights(self, count, multiplier=1.0):
+        return [self.decay(rank, count) * multiplier for rank in range(count)]
+
+    def accumulate(self, artists, multiplier=1.0, scores=None):
+        """Adds the rank-decayed weights of `artists` (a ranked list) to `scores` and returns it."""
+        scores = {} if scores is None else scores
+        get = scores.get
+        for artist, weight in zip(artists, self.rank_weights(len(artists), multiplier)):
+            for genre in artist.get('genres', ()):
+                scores[genre] = get(genre, 0.0) + weight
+        return scores
+
+    def score_ranges(self, artists_by_range):
+        """Weighted genre scores over several time ranges' `me/top/artists` responses."""
+        scores = {}
+        for time_range, multiplier in self.range_weights.items():
+            data = artists_by_range.get(time_range)
+            if data and data.get('items'):
+                self.accumulate(data['items'], multiplier, scores)
+        return scores
+
+    @staticmethod
+    def count(artists):
+        """Unweighted genre occurrence counts across `artists`."""
+        counts = {}
+        get = counts.get
+        for artist in artists:
+            for genre in artist.get('genres', ()):
+                counts[genre] = get(genre, 0) + 1
+        return counts
+
+    @staticmethod
+    def top(scores, k):
+        """The `k` highest-scoring `(genre, score)` pairs, best first (ties keep insertion order)."""
+        return heapq.nlargest(k, scores.items(), key=itemgetter(1))
+
+    def user_genres(self, artists_by_range, k=15):
+        """Genre -> weight dict of the top `k` weighted genres across time ranges."""
+        return dict(self.top(self.score_ranges(artists_by_range), k))
+
+    def top_genres(self, artists, k=10):
+        """The top `k` genres by occurrence count plus the single top genre."""
+        ranked = [{"name": genre, "count": count} for genre, count in self.top(self.count(artists), k)]
+        return {
+            "genres": ranked,
+            "top_genre": ranked[0]["name"] if ranked else "Unknown"
+        }
@@ -0,0 +1,103 @@
+# genre_tree.py
+import heapq
+import os
+from operator import itemgetter
+
+from models import db, ArtistGenres
+
+GENRE_TREE_DEPTH = int(os.getenv('GENRE_TREE_DEPTH', 2))
+GENRE_TREE_ROOTS = int(os.getenv('GENRE_TREE_ROOTS', 10))
+GENRE_TREE_CHILDREN = int(os.getenv('GENRE_TREE_CHILDREN', 8))
+
+# Broad families a genre falls back to when no more specific parent is known
+BASE_GENRES = [
+    'pop', 'rock', 'hip hop', 'rap', 'electronic', 'edm', 'house', 'techno', 'dance', 'jazz',
+    'classical', 'r&b', 'soul', 'funk', 'indie', 'folk', 'country', 'metal', 'punk', 'blues',
+    'reggae', 'latin', 'alternative', 'ambient', 'disco', 'trap', 'drill', 'grime', 'emo', 'gospel'
+]
+
+
+class GenreTaxonomy:
+    """
+    Parent/child index over the genre vocabulary. Spotify genres read as qualifiers in front of a
+    broader genre, so a genre's parent is its longest known word suffix: "uk alternative rock" ->
+    "alternative rock" -> "rock". The vocabulary is BASE_GENRES plus every genre in the
+    `artist_genres` table when `load` runs (at startup); paths are memoized, so each genre is only
+    ever split once per process.
+    """
+
+    def __init__(self, vocabulary=()):
+        self.vocabulary = set(BASE_GENRES)
+        self.vocabulary.update(vocabulary)
+        self.paths = {}
+
+    def load(self):
+        """Adds every genre known to the `artist_genres` table to the vocabulary. Needs an app context."""
+        for (genres,) in db.session.query(ArtistGenres.genres):
+            self.vocabulary.update(genres or ())
+        self.paths.clear()
+        return len(self.vocabulary)
+
+    def parent(self, genre):
+        """The longest known word suffix of `genre`, or `None` for a top-level genre."""
+        words = genre.split()
+        for start in range(1, len(words)):
+            suffix = ' '.join(words[start:])
+            if suffix in self.vocabulary:
+                return suffix
+        return None
+
+    def path(self, genre):
+        """Ancestors of `genre` from its top-level family down to the genre itself, as a tuple."""
+        path = self.paths.get(genre)
+        if path is None:
+            parent = self.parent(genre)
+            path = (self.path(parent) if parent else ()) + (genre,)
+            self.paths[genre] = path
+        return path
+
+
+def _trim(path, depth):
+    # Keep the outermost ancestors and the genre itself, dropping intermediate levels
+    return path if len(path) <= depth else path[:depth - 1] + path[-1:]
+
+
+def _prune(children, max_children):
+    nodes = []
+    for name, (value, grandchildren) in heapq.nlargest(max_children, children.items(), key=lambda item: item[1][0]):
+        node = {"name": name, "value": round(value, 4)}
+        if grandchildren:
+            node["children"] = _prune(grandchildren, max_children)
+        nodes.append(node)
+    return nodes
+
+
+def build_genre_tree(scores, taxonomy, depth=GENRE_TREE_DEPTH, max_roots=GENRE_TREE_ROOTS, max_children=GENRE_TREE_CHILDREN):
+    """
+    Rolls flat genre -> weight scores up the taxonomy into a sunburst-ready tree. Every node's
+    `value` is the summed weight of its whole subtree, including children pruned beyond the top
+    `max_children` (so a node's value can exceed the sum of the children shown, the difference being
+    its own weight plus its tail). At most `max_roots` families are kept under the root.
+
+    :param scores: A dict of genre -> weight, e.g. `GenreScorer.score_ranges`
+    :param taxonomy: The GenreTaxonomy to place genres with
+    :param depth: Maximum number of levels below the root
+    :return: A `{"name": "genres", "value": ..., "children": [...]}` tree
+    """
+    # name -> [value, children] at each level
+    families = {}
+    for genre, weight in scores.items():
+        level = families
+        for name in _trim(taxonomy.path(genre), depth):
+            node = level.get(name)
+            if node is None:
+                node = level[name] = [0.0, {}]
+            node[0] += weight
+            level = node[1]
+
+    children = _prune(families, max_roots)
+    return {
+        "name": "genres",
+        "value": round(sum(map(itemgetter("value"), children)), 4),
+        "children": children
+    }
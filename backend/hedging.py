@@ -0,0 +1,198 @@
+# hedging.py
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from deadlines import BUDGET_EXHAUSTED_ERROR
+
+SPOTIFY_HEDGE_ENABLED = os.getenv('SPOTIFY_HEDGE_ENABLED', 'true').lower() == 'true'
+# Percentile of an endpoint's recent latencies after which a second request is sent
+SPOTIFY_HEDGE_PERCENTILE = float(os.getenv('SPOTIFY_HEDGE_PERCENTILE', 95))
+SPOTIFY_HEDGE_MIN_DELAY = float(os.getenv('SPOTIFY_HEDGE_MIN_DELAY', 0.05))
+SPOTIFY_HEDGE_SAMPLES = int(os.getenv('SPOTIFY_HEDGE_SAMPLES', 200))
+# No hedging until an endpoint has this many samples, so the percentile means something
+SPOTIFY_HEDGE_MIN_SAMPLES = int(os.getenv('SPOTIFY_HEDGE_MIN_SAMPLES', 20))
+SPOTIFY_HEDGE_WORKERS = int(os.getenv('SPOTIFY_HEDGE_WORKERS', 32))
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Returns this worker process's pool for hedged requests, recreating it after a fork. It is kept
+    apart from the fan-out pool because fan-out workers block on hedged requests.
+    """
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(max_workers=SPOTIFY_HEDGE_WORKERS, thread_name_prefix='spotify-hedge')
+                _executor_pid = pid
+    return _executor
+
+
+def _time_left(deadline):
+    return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+
+class LatencyTracker:
+    """
+    Recent upstream latencies per endpoint, for the hedging delay. Each request records its own
+    duration, hedges included, so the percentile is not skewed by whichever request won.
+    """
+
+    def __init__(self, percentile=SPOTIFY_HEDGE_PERCENTILE, samples=SPOTIFY_HEDGE_SAMPLES,
+                 min_samples=SPOTIFY_HEDGE_MIN_SAMPLES, min_delay=SPOTIFY_HEDGE_MIN_DELAY,
+                 enabled=SPOTIFY_HEDGE_ENABLED):
+        self.percentile = percentile
+        self.samples = samples
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.enabled = enabled
+        self._latencies = {}
+        # endpoint -> (sample count it was computed at, delay), recomputed every tenth of the window
+        self._delays = {}
+        self._lock = threading.Lock()
+        # Updated from request, fan-out and hedge threads alike, so only under the lock
+        self.metrics = {'hedged': 0, 'hedge_won': 0}
+
+    def record(self, endpoint, latency):
+        with self._lock:
+            latencies = self._latencies.get(endpoint)
+            if latencies is None:
+                latencies = self._latencies[endpoint] = deque(maxlen=self.samples)
+            latencies.append(latency)
+
+    def hedge_delay(self, endpoint):
+        """Seconds to wait before hedging a call to `endpoint`, or `None` not to hedge it."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            latencies = self._latencies.get(endpoint)
+            count = len(latencies) if latencies else 0
+            if count < self.min_samples:
+                return None
+            computed = self._delays.get(endpoint)
+            if computed is None or abs(count - computed[0]) >= max(self.samples // 10, 1) or count == self.samples:
+                ordered = sorted(latencies)
+                index = min(int(len(ordered) * self.percentile / 100), len(ordered) - 1)
+                computed = self._delays[endpoint] = (count, max(ordered[index], self.min_delay))
+            return computed[1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                **self.metrics,
+                'delays': {endpoint: round(delay, 4) for endpoint, (_, delay) in self._delays.items()}
+            }
+
+    def _count(self, counter):
+        with self._lock:
+            self.metrics[counter] += 1
+
+    def _timed(self, endpoint, call):
+        started = time.monotonic()
+        try:
+            return call()
+        finally:
+            self.record(endpoint, time.monotonic() - started)
+
+    def call(self, endpoint, call, may_hedge, timeout):
+        """
+        Runs `call()` (an idempotent request) and, if it has not returned after the endpoint's hedge
+        delay and `may_hedge()` allows it, a second identical one; the first to return wins. The
+        losing request is left to finish in the background and its result dropped.
+
+        :param may_hedge: Zero-argument callable deciding at hedge time, e.g. taking a rate-limit token
+        :param timeout: Seconds the caller is willing to wait in total, hedged or not, or `None` to
+        wait for as long as the requests take
+        :return: A tuple of the winning result (or `None`) and BUDGET_EXHAUSTED_ERROR (or `None`) if
+        no request answered within `timeout`. A request that raised re-raises here if none succeeded.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = self.hedge_delay(endpoint)
+        hedge = delay is not None and (timeout is None or delay < timeout)
+        if not hedge and timeout is None:
+            return self._timed(endpoint, call), None
+
+        primary = get_executor().submit(self._timed, endpoint, call)
+        if hedge:
+            done, _ = wait([primary], timeout=delay)
+            hedge = not done and may_hedge()
+        if not hedge:
+            try:
+                return primary.result(timeout=_time_left(deadline)), None
+            except FutureTimeoutError:
+                return None, BUDGET_EXHAUSTED_ERROR
+
+        self._count('hedged')
+        backup = get_executor().submit(self._timed, endpoint, call)
+        pending = {primary, backup}
+        while pending:
+            done, pending = wait(pending, timeout=_time_left(deadline), return_when=FIRST_COMPLETED)
+            if not done:
+                return None, BUDGET_EXHAUSTED_ERROR
+            for future in done:
+                if future.exception() is None:
+                    if future is backup:
+                        self._count('hedge_won')
+                    return future.result(), None
+        # Both requests failed: surface the primary's error
+        return primary.result(), None
+
+    async def call_async(self, endpoint, call, may_hedge, timeout):
+        """
+        Async variant of `call`: `call` and `may_hedge` are coroutine functions, and the losing
+        request (or both, once `timeout` has passed) is cancelled.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = self.hedge_delay(endpoint)
+        hedge = delay is not None and (timeout is None or delay < timeout)
+        if not hedge and timeout is None:
+            return await self._timed_async(endpoint, call), None
+
+        primary = asyncio.ensure_future(self._timed_async(endpoint, call))
+        if hedge:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            hedge = not done and await may_hedge()
+        if not hedge:
+            try:
+                return await asyncio.wait_for(primary, _time_left(deadline)), None
+            except asyncio.TimeoutError:
+                return None, BUDGET_EXHAUSTED_ERROR
+
+        self._count('hedged')
+        backup = asyncio.ensure_future(self._timed_async(endpoint, call))
+        pending = {primary, backup}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=_time_left(deadline), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    return None, BUDGET_EXHAUSTED_ERROR
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self._count('hedge_won')
+                        return task.result(), None
+            return await primary, None
+        finally:
+            for task in (primary, backup):
+                if not task.done():
+                    task.cancel()
+
+    async def _timed_async(self, endpoint, call):
+        started = time.monotonic()
+        try:
+            return await call()
+        finally:
+            self.record(endpoint, time.monotonic() - started)
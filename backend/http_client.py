@@ -0,0 +1,170 @@
+# http_client.py
+import asyncio
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Pool and timeout settings, overridable from .env.local like the rest of the config
+POOL_CONNECTIONS = int(os.getenv('SPOTIFY_POOL_CONNECTIONS', 4))
+POOL_MAXSIZE = int(os.getenv('SPOTIFY_POOL_MAXSIZE', 32))
+CONNECT_TIMEOUT = float(os.getenv('SPOTIFY_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.getenv('SPOTIFY_READ_TIMEOUT', 10))
+MAX_RETRIES = int(os.getenv('SPOTIFY_MAX_RETRIES', 2))
+RETRY_BACKOFF = float(os.getenv('SPOTIFY_RETRY_BACKOFF', 0.3))
+
+# Base URLs can be pointed at a local stub for benchmarks
+API_BASE_URL = os.getenv('SPOTIFY_API_BASE_URL', 'https://api.spotify.com/v1')
+TOKEN_URL = os.getenv('SPOTIFY_TOKEN_URL', 'https://accounts.spotify.com/api/token')
+
+# retry flag -> session; see `get_session`
+_sessions = {}
+_sessions_pid = None
+_session_lock = threading.Lock()
+
+_async_client = None
+_async_client_loop = None
+
+
+def _build_session(retry):
+    """
+    Builds a `requests.Session` whose adapter keeps a pool of keep-alive connections per host, so
+    api.spotify.com and accounts.spotify.com only pay the TCP+TLS handshake once per connection.
+    With `retry`, retries cover connection errors and 5xx responses on idempotent methods only; 429
+    is left to the caller so Spotify's rate limiting is not hidden behind silent retries.
+    """
+    retries = MAX_RETRIES if retry else 0
+    policy = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=policy,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(retry=True):
+    """
+    Returns the pooled session for this worker process, with or without retries. Sessions are
+    rebuilt after a fork so pre-forking servers (gunicorn etc.) never share sockets between workers.
+    """
+    global _sessions, _sessions_pid
+    pid = os.getpid()
+    if _sessions_pid != pid or retry not in _sessions:
+        with _session_lock:
+            if _sessions_pid != pid:
+                _sessions = {}
+                _sessions_pid = pid
+            if retry not in _sessions:
+                _sessions[retry] = _build_session(retry)
+    return _sessions[retry]
+
+
+def spotify_get(url, retry=True, **kwargs):
+    """
+    GET through the pooled session with the default connect/read timeouts. Calls under a latency
+    budget pass `retry=False`: every retry gets the full timeout again, so they would outlast it.
+    """
+    kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+    return get_session(retry).get(url, **kwargs)
+
+
+def spotify_post(url, **kwargs):
+    """POST through the pooled session with the default connect/read timeouts."""
+    kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+    return get_session().post(url, **kwargs)
+
+
+def pool_stats():
+    """
+    Reports connection reuse for every host pool opened by this worker. `num_connections` counts
+    connections opened and `num_requests` counts requests sent, so `reused` is how many requests went out
+    on an already open keep-alive connection.
+    """
+    hosts = {}
+    sessions = list(_sessions.values()) if _sessions_pid == os.getpid() else []
+    for session in sessions:
+        for adapter in set(session.adapters.values()):
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                host = hosts.setdefault(f"{key.key_scheme}://{key.key_host}", {'connections_opened': 0, 'requests': 0})
+                host['connections_opened'] += pool.num_connections
+                host['requests'] += pool.num_requests
+    for host in hosts.values():
+        host['reused'] = max(host['requests'] - host['connections_opened'], 0)
+    totals = {
+        'connections_opened': sum(h['connections_opened'] for h in hosts.values()),
+        'requests': sum(h['requests'] for h in hosts.values()),
+    }
+    totals['reused'] = max(totals['requests'] - totals['connections_opened'], 0)
+    totals['reuse_ratio'] = totals['reused'] / totals['requests'] if totals['requests'] else 0.0
+    return {
+        'pid': os.getpid(),
+        'pool_maxsize': POOL_MAXSIZE,
+        'hosts': hosts,
+        'totals': totals,
+    }
+
+
+def get_async_client():
+    """
+    Returns the pooled `aiohttp.ClientSession` used by the ASGI serving mode, one per event loop, with
+    the same pool size and timeouts as the sync session. aiohttp has no built-in retry policy, so
+    calls on this path are not retried.
+    """
+    global _async_client, _async_client_loop
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=POOL_MAXSIZE, keepalive_timeout=30),
+            timeout=aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT),
+        )
+        _async_client_loop = loop
+    return _async_client
+
+
+async def spotify_get_async(url, headers=None, params=None, timeout=None):
+    """
+    Non-blocking GET through the pooled async client. `timeout` caps the whole request in seconds,
+    on top of the client's connect/read timeouts.
+    :return: A tuple of the HTTP status code, the parsed JSON body (or `None` if it is not JSON) and
+    the response headers.
+    """
+    import aiohttp
+
+    kwargs = {}
+    if timeout is not None:
+        kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout, sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    async with get_async_client().get(url, headers=headers, params=params, **kwargs) as response:
+        try:
+            body = await response.json(content_type=None)
+        except Exception:
+            body = None
+        return response.status, body, response.headers
+
+
+async def close_async_client():
+    """Closes the async client's connections, called on ASGI lifespan shutdown."""
+    global _async_client, _async_client_loop
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+        _async_client_loop = None
@@ -0,0 +1,228 @@
+# ingestion.py
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import func
+
+from database import insert_ignore
+from models import db, Artist, Play, Track, track_artists
+
+INGESTION_ENABLED = os.getenv('INGESTION_ENABLED', 'true').lower() == 'true'
+INGESTION_INTERVAL = int(os.getenv('INGESTION_INTERVAL', 600))
+INGESTION_CONCURRENCY = int(os.getenv('INGESTION_CONCURRENCY', 4))
+INGESTION_MAX_PAGES = int(os.getenv('INGESTION_MAX_PAGES', 4))
+
+# Spotify's maximum page size for me/player/recently-played
+RECENTLY_PLAYED_LIMIT = 50
+
+
+def parse_timestamp(value):
+    """Converts a Spotify ISO-8601 timestamp (`played_at`, `added_at`, e.g. 2024-05-01T18:04:12.345Z) to Unix time in ms."""
+    return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() * 1000)
+
+
+def catalog_rows(tracks):
+    """
+    Flattens Spotify track objects into `(artist_rows, track_rows, track_artist_rows)` for the shared
+    catalog tables, each deduplicated by key.
+    """
+    artists, catalog, credits = {}, {}, {}
+    for track in tracks:
+        if not track or not track.get('id'):
+            continue
+        album = track.get('album') or {}
+        catalog[track['id']] = {
+            'id': track['id'],
+            'name': track.get('name'),
+            'album_id': album.get('id'),
+            'album_name': album.get('name'),
+            'duration_ms': track.get('duration_ms'),
+            'explicit': track.get('explicit'),
+            'popularity': track.get('popularity'),
+        }
+        for position, artist in enumerate(track.get('artists', [])):
+            if not artist.get('id'):
+                continue
+            artists[artist['id']] = {'id': artist['id'], 'name': artist.get('name')}
+            credits[(track['id'], artist['id'])] = {'track_id': track['id'], 'artist_id': artist['id'], 'position': position}
+    return list(artists.values()), list(catalog.values()), list(credits.values())
+
+
+def store_tracks(tracks):
+    """Upserts-if-missing the given Spotify track objects and their artists. Does not commit."""
+    artist_rows, track_rows, credit_rows = catalog_rows(tracks)
+    # Parents first so the foreign keys of the later inserts always resolve
+    insert_ignore(Artist, artist_rows)
+    insert_ignore(Track, track_rows)
+    insert_ignore(track_artists, credit_rows)
+
+
+def store_recently_played(user_id, items):
+    """
+    Stores one page of recently-played items: the catalog rows for their tracks and one `plays` row
+    per item. Plays already stored (same user and `played_at`) are skipped. Returns the number of new plays.
+    """
+    plays = {}
+    for item in items:
+        track = item.get('track')
+        if not track or not track.get('id') or not item.get('played_at'):
+            continue
+        played_at = parse_timestamp(item['played_at'])
+        plays[played_at] = {
+            'user_id': user_id,
+            'played_at': played_at,
+            'track_id': track['id'],
+            'context_uri': (item.get('context') or {}).get('uri'),
+        }
+    if not plays:
+        return 0
+
+    store_tracks([item['track'] for item in items if item.get('track')])
+    inserted = insert_ignore(Play, list(plays.values()))
+    db.session.commit()
+    return inserted
+
+
+def latest_played_at(user_id):
+    """The newest stored `played_at` (ms) for the user, or `None` before their first ingestion."""
+    return db.session.query(func.max(Play.played_at)).filter(Play.user_id == user_id).scalar()
+
+
+def ingest_recently_played(user_id, fetch, max_pages=INGESTION_MAX_PAGES):
+    """
+    Pulls the user's plays newer than the last stored one, following Spotify's `after` cursor, and
+    bulk-inserts them. Needs an app context.
+
+    :param fetch: Callable `(user_id, endpoint, params)` returning `(data, error)`
+    :return: A tuple of the number of new plays and an error message or `None`
+    """
+    after = latest_played_at(user_id)
+    inserted = 0
+    for _ in range(max_pages):
+        params = {'limit': RECENTLY_PLAYED_LIMIT}
+        if after is not None:
+            params['after'] = after
+        data, error = fetch(user_id, 'me/player/recently-played', params)
+        if error:
+            db.session.rollback()
+            return inserted, error
+
+        items = data.get('items', [])
+        if not items:
+            break
+        inserted += store_recently_played(user_id, items)
+
+        cursor = (data.get('cursors') or {}).get('after')
+        if not data.get('next') or not cursor:
+            break
+        after = int(cursor)
+    return inserted, None
+
+
+class Ingester:
+    """
+    Background job that keeps each active user's local data current by running a set of per-user
+    ingestion jobs, such as polling recently-played into the play history. Spotify only keeps a
+    user's last 50 plays, so the history stays gapless as long as the interval is well under the
+    time it takes to listen to 50 tracks.
+
+    :param app: The Flask app, used to push an app context for database work
+    :param active_users: Callable returning the IDs of the users to ingest for
+    :param fetch: Callable `(user_id, endpoint, params)` returning `(data, error)`; it must not mark
+    the user active itself, or background polling would keep every user active forever
+    :param jobs: A dict mapping a name to a callable `(user_id, fetch)` returning `(stored, error)`,
+    run in that order for each user
+    """
+
+    def __init__(self, app, active_users, fetch, jobs,
+                 interval=INGESTION_INTERVAL,
+                 concurrency=INGESTION_CONCURRENCY):
+        self.app = app
+        self.active_users = active_users
+        self.fetch = fetch
+        self.jobs = jobs
+        self.interval = interval
+        self.concurrency = concurrency
+
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+        self._stop = threading.Event()
+
+        self.metrics = {
+            'runs': 0,
+            'users': 0,
+            'stored': {name: 0 for name in jobs},
+            'failed': {name: 0 for name in jobs},
+            'last_run_at': None,
+            'last_run_seconds': None,
+        }
+
+    def ensure_started(self):
+        """Starts the background thread once per process (again after a fork), if ingestion is enabled."""
+        pid = os.getpid()
+        if not INGESTION_ENABLED or (self._thread_pid == pid and self._thread is not None):
+            return
+        with self._start_lock:
+            if self._thread_pid == pid and self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='ingester', daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        # Run right away so a newly active user's history starts with this session
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Ingester error: {str(e)}")
+            if self._stop.wait(self.interval):
+                return
+
+    def _ingest_in_context(self, user_id):
+        """Runs every job for one user; a failing job does not stop the ones after it."""
+        results = {}
+        with self.app.app_context():
+            for name, job in self.jobs.items():
+                try:
+                    results[name] = job(user_id, self.fetch)
+                except Exception as e:
+                    db.session.rollback()
+                    results[name] = (0, f"Ingestion error: {str(e)}")
+        return results
+
+    def run_once(self):
+        """Runs the ingestion jobs for every active user, with bounded concurrency."""
+        started = time.monotonic()
+        user_ids = self.active_users()
+
+        if user_ids:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='ingest') as pool:
+                for user_id, results in zip(user_ids, pool.map(self._ingest_in_context, user_ids)):
+                    for name, (stored, error) in results.items():
+                        self.metrics['stored'][name] += stored
+                        if error:
+                            self.metrics['failed'][name] += 1
+                            print(f"Ingestion job {name} failed for user {user_id}: {error}")
+
+        elapsed = time.monotonic() - started
+        self.metrics['runs'] += 1
+        self.metrics['users'] += len(user_ids)
+        self.metrics['last_run_at'] = int(time.time())
+        self.metrics['last_run_seconds'] = round(elapsed, 4)
+
+    def stats(self):
+        return {
+            **self.metrics,
+            'enabled': INGESTION_ENABLED,
+            'interval': self.interval,
+            'concurrency': self.concurrency,
+        }
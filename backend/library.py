@@ -0,0 +1,226 @@
+# library.py
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import case, distinct, func
+
+from database import insert_ignore
+from ingestion import parse_timestamp, store_tracks
+from models import db, Artist, LibrarySync, SavedTrack, Track, track_artists
+
+LIBRARY_SYNC_INTERVAL = int(os.getenv('LIBRARY_SYNC_INTERVAL', 3600))
+LIBRARY_FULL_SYNC_INTERVAL = int(os.getenv('LIBRARY_FULL_SYNC_INTERVAL', 7 * 24 * 3600))
+LIBRARY_SYNC_CONCURRENCY = int(os.getenv('LIBRARY_SYNC_CONCURRENCY', 4))
+
+# Spotify's maximum page size for me/tracks
+SAVED_TRACKS_PAGE_SIZE = 50
+
+
+def saved_track_rows(user_id, items):
+    return [
+        {'user_id': user_id, 'track_id': item['track']['id'], 'added_at': parse_timestamp(item['added_at'])}
+        for item in items
+        if item.get('track') and item['track'].get('id') and item.get('added_at')
+    ]
+
+
+def fetch_page(fetch, user_id, offset):
+    return fetch(user_id, 'me/tracks', {'limit': SAVED_TRACKS_PAGE_SIZE, 'offset': offset})
+
+
+def _fetch_page_in_context(app, fetch, user_id, offset):
+    with app.app_context():
+        return fetch_page(fetch, user_id, offset)
+
+
+def fetch_all_pages(fetch, user_id, first_page, concurrency=LIBRARY_SYNC_CONCURRENCY):
+    """
+    Returns every saved-track item, fetching the pages after `first_page` in parallel (at most
+    `concurrency` at a time, each in its own app context). Returns `(items, error)`.
+    """
+    offsets = range(SAVED_TRACKS_PAGE_SIZE, first_page.get('total', 0), SAVED_TRACKS_PAGE_SIZE)
+    items = list(first_page.get('items', []))
+    if not offsets:
+        return items, None
+
+    app = current_app._get_current_object()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='library-sync') as pool:
+        for data, error in pool.map(lambda offset: _fetch_page_in_context(app, fetch, user_id, offset), offsets):
+            if error:
+                return None, error
+            items.extend(data.get('items', []))
+    return items, None
+
+
+def full_sync(user_id, fetch, first_page):
+    """Pages through the whole library and makes the mirror match it, removing unsaved tracks."""
+    items, error = fetch_all_pages(fetch, user_id, first_page)
+    if error:
+        return 0, error
+
+    rows = {row['track_id']: row for row in saved_track_rows(user_id, items)}
+    stored = {track_id for (track_id,) in db.session.query(SavedTrack.track_id).filter(SavedTrack.user_id == user_id)}
+    removed = list(stored - rows.keys())
+    for start in range(0, len(removed), 500):
+        db.session.query(SavedTrack).filter(
+            SavedTrack.user_id == user_id,
+            SavedTrack.track_id.in_(removed[start:start + 500])
+        ).delete(synchronize_session=False)
+
+    store_tracks([item['track'] for item in items if item.get('track')])
+    return insert_ignore(SavedTrack, list(rows.values())), None
+
+
+def incremental_sync(user_id, fetch, first_page, newest_added_at):
+    """
+    Walks the library newest first and stops at the first track added before the newest one already
+    mirrored, so a sync with nothing new costs a single page.
+    """
+    data, items = first_page, []
+    offset = 0
+    while True:
+        page_items = data.get('items', [])
+        new_items = [item for item in page_items if parse_timestamp(item['added_at']) >= newest_added_at]
+        items.extend(new_items)
+        offset += SAVED_TRACKS_PAGE_SIZE
+        if len(new_items) < len(page_items) or not data.get('next'):
+            break
+        data, error = fetch_page(fetch, user_id, offset)
+        if error:
+            return 0, error
+
+    store_tracks([item['track'] for item in items if item.get('track')])
+    return insert_ignore(SavedTrack, saved_track_rows(user_id, items)), None
+
+
+def sync_library(user_id, fetch):
+    """
+    Brings the user's saved-track mirror up to date: a full, parallel page-through on the first sync
+    (and every LIBRARY_FULL_SYNC_INTERVAL, or when counts stop adding up because tracks were unsaved),
+    an incremental newest-first sync otherwise. Needs an app context.
+
+    :param fetch: Callable `(user_id, endpoint, params)` returning `(data, error)`
+    :return: A tuple of the number of newly mirrored tracks and an error message or `None`
+    """
+    state = db.session.get(LibrarySync, user_id) or LibrarySync(user_id=user_id, total=0)
+    now = int(time.time())
+
+    first_page, error = fetch_page(fetch, user_id, 0)
+    if error:
+        return 0, error
+    total = first_page.get('total', 0)
+
+    newest_added_at = db.session.query(func.max(SavedTrack.added_at)).filter(SavedTrack.user_id == user_id).scalar()
+    full = newest_added_at is None or not state.full_synced_at or now - state.full_synced_at >= LIBRARY_FULL_SYNC_INTERVAL
+    if full:
+        added, error = full_sync(user_id, fetch, first_page)
+    else:
+        added, error = incremental_sync(user_id, fetch, first_page, newest_added_at)
+        if not error and mirrored_count(user_id) != total:
+            # Something was unsaved (or added out of order); only a full pass can reconcile that
+            full = True
+            added, error = full_sync(user_id, fetch, first_page)
+    if error:
+        db.session.rollback()
+        return 0, error
+
+    state.total = total
+    state.synced_at = now
+    if full:
+        state.full_synced_at = now
+    db.session.add(state)
+    db.session.commit()
+    return added, None
+
+
+def sync_library_if_due(user_id, fetch):
+    """`sync_library`, skipped when the mirror was synced less than LIBRARY_SYNC_INTERVAL seconds ago."""
+    state = db.session.get(LibrarySync, user_id)
+    if state and state.synced_at and time.time() - state.synced_at < LIBRARY_SYNC_INTERVAL:
+        return 0, None
+    return sync_library(user_id, fetch)
+
+
+def mirrored_count(user_id):
+    return db.session.query(func.count(SavedTrack.track_id)).filter(SavedTrack.user_id == user_id).scalar()
+
+
+def library_stats(user_id, top_artists=10, genre_lookup=None, top_genres=10):
+    """
+    Library-wide stats computed from the local mirror with a few aggregate queries, or `None` if the
+    user's library has not been synced yet.
+
+    :param genre_lookup: Optional callable taking artist IDs and returning a dict of ID -> genres;
+    when given, the library's top genres (weighted by saved tracks per artist) are included
+    """
+    state = db.session.get(LibrarySync, user_id)
+    if not state or not state.synced_at:
+        return None
+
+    saved, albums, duration_ms, explicit, first_added, last_added = (
+        db.session.query(
+            func.count(SavedTrack.track_id),
+            func.count(distinct(Track.album_id)),
+            func.coalesce(func.sum(Track.duration_ms), 0),
+            func.coalesce(func.sum(case((Track.explicit.is_(True), 1), else_=0)), 0),
+            func.min(SavedTrack.added_at),
+            func.max(SavedTrack.added_at)
+        )
+        .join(Track, Track.id == SavedTrack.track_id)
+        .filter(SavedTrack.user_id == user_id)
+        .one()
+    )
+
+    artists = (
+        db.session.query(func.count(distinct(track_artists.c.artist_id)))
+        .join(SavedTrack, SavedTrack.track_id == track_artists.c.track_id)
+        .filter(SavedTrack.user_id == user_id)
+        .scalar()
+    )
+
+    saved_count = func.count(track_artists.c.track_id).label('saved')
+    artist_rows = (
+        db.session.query(Artist.id, Artist.name, saved_count)
+        .join(track_artists, track_artists.c.artist_id == Artist.id)
+        .join(SavedTrack, SavedTrack.track_id == track_artists.c.track_id)
+        .filter(SavedTrack.user_id == user_id)
+        .group_by(Artist.id, Artist.name)
+        .order_by(saved_count.desc(), Artist.name)
+        .limit(top_artists)
+        .all()
+    )
+
+    stats = {
+        "saved_tracks": saved,
+        "artists": artists,
+        "albums": albums,
+        "total_duration_ms": int(duration_ms),
+        "explicit_tracks": int(explicit),
+        "first_saved_at": first_added,
+        "last_saved_at": last_added,
+        "top_artists": [
+            {"id": row.id, "name": row.name, "saved_tracks": row.saved}
+            for row in artist_rows
+        ],
+        "synced_at": state.synced_at
+    }
+
+    if genre_lookup:
+        saved_per_artist = (
+            db.session.query(track_artists.c.artist_id, func.count(track_artists.c.track_id))
+            .join(SavedTrack, SavedTrack.track_id == track_artists.c.track_id)
+            .filter(SavedTrack.user_id == user_id)
+            .group_by(track_artists.c.artist_id)
+            .all()
+        )
+        genres_by_artist = genre_lookup([artist_id for artist_id, _ in saved_per_artist])
+        genre_counts = Counter()
+        for artist_id, count in saved_per_artist:
+            for genre in genres_by_artist.get(artist_id, []):
+                genre_counts[genre] += count
+        stats["top_genres"] = [{"name": name, "count": count} for name, count in genre_counts.most_common(top_genres)]
+
+    return stats
@@ -0,0 +1,243 @@
+# metrics.py
+import bisect
+import math
+import os
+import threading
+import time
+
+from flask import g, request
+from sqlalchemy import event
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+
+# Histogram bucket upper bounds in seconds: requests and upstream calls, and database queries
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DB_OPERATIONS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_sample(name, labels, value):
+    if labels:
+        pairs = ','.join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+        return f'{name}{{{pairs}}} {_format_value(value)}'
+    return f'{name} {_format_value(value)}'
+
+
+class Counter:
+    """A monotonically increasing count per combination of label values."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield self.name, dict(zip(self.labels, label_values)), value
+
+
+class Histogram:
+    """
+    Observations per combination of label values, counted into fixed buckets. Buckets are kept
+    non-cumulative so an observation is one bisect and one increment; they are summed on exposition.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (plus +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        if not METRICS_ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = [(label_values, list(counts), total) for label_values, (counts, total) in self._series.items()]
+        for label_values, counts, total in series:
+            labels = dict(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', {**labels, 'le': _format_value(float(bound))}, cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+
+class Registry:
+    """
+    The metrics of this worker process and their exposition. Besides counters and histograms updated
+    on the hot path, collectors read the components' own `stats()` at scrape time, so those cost
+    nothing between scrapes. Like the /debug endpoints, values are per worker process.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, collect):
+        """
+        Registers `collect()`, returning `(name, kind, help, samples)` families where samples are
+        `(labels, value)` pairs.
+        """
+        self._collectors.append(collect)
+        return collect
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += [f'# HELP {metric.name} {metric.help}', f'# TYPE {metric.name} {metric.kind}']
+            lines += [_format_sample(*sample) for sample in metric.samples()]
+        for collect in self._collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                print(f"Metrics collector error: {str(e)}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                lines += [_format_sample(name, labels, value) for labels, value in samples]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.counter(
+    'http_requests_total', 'HTTP requests served, by route, method and status.', ('route', 'method', 'status'))
+HTTP_REQUEST_DURATION = registry.histogram(
+    'http_request_duration_seconds', 'Time to produce a response, by route and method.', ('route', 'method'))
+SPOTIFY_REQUESTS = registry.counter(
+    'spotify_requests_total', 'Spotify API calls by endpoint and HTTP status (or error).', ('endpoint', 'status'))
+SPOTIFY_REQUEST_DURATION = registry.histogram(
+    'spotify_request_duration_seconds', 'Spotify API call latency by endpoint, hedges included.', ('endpoint',))
+TOKEN_REFRESHES = registry.counter(
+    'spotify_token_refreshes_total', 'Spotify token refreshes by outcome.', ('outcome',))
+TOKEN_REFRESH_DURATION = registry.histogram(
+    'spotify_token_refresh_duration_seconds', 'Time to post a refresh_token grant to Spotify.')
+FANOUT_DURATION = registry.histogram(
+    'fanout_duration_seconds', 'Time to collect a fan-out batch of concurrent Spotify-bound calls, by size.', ('calls',))
+DB_QUERY_DURATION = registry.histogram(
+    'db_query_duration_seconds', 'Database statement execution time by operation.', ('operation',), DB_QUERY_BUCKETS)
+
+
+def observe_request(route, method, status, elapsed):
+    HTTP_REQUESTS.inc(route, method, str(status))
+    HTTP_REQUEST_DURATION.observe(elapsed, route, method)
+
+
+def start_request_timer():
+    """before_request hook starting the request's clock."""
+    g.request_started = time.perf_counter()
+
+
+def note_response_status(response):
+    """after_request hook keeping the final status code for `record_request`."""
+    g.response_status = response.status_code
+    return response
+
+
+def record_request(exception=None):
+    """
+    teardown_request hook recording the request under its route rule, so path parameters stay out of
+    the labels. Teardown runs for unhandled exceptions too (which skip after_request hooks); those
+    count as 500s.
+    """
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    status = 500 if exception is not None else g.pop('response_status', 500)
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    observe_request(route, request.method, status, time.perf_counter() - started)
+
+
+async def record_async_request(handle, scope, receive, send):
+    """Runs an ASGI handler for an exact-path route, recording it like `record_request` does for Flask."""
+    started = time.perf_counter()
+    statuses = []
+
+    async def send_and_note(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+        await send(message)
+
+    try:
+        await handle(scope, receive, send_and_note)
+    finally:
+        observe_request(scope['path'], scope['method'], statuses[0] if statuses else 500, time.perf_counter() - started)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    operation = statement.lstrip()[:6].upper()
+    DB_QUERY_DURATION.observe(time.perf_counter() - started, operation if operation in DB_OPERATIONS else 'OTHER')
+
+
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute; drop its start time
+    connection = context.connection
+    if connection is not None and connection.info.get('query_started'):
+        connection.info['query_started'].pop()
+
+
+def instrument_engine(engine):
+    """Times every statement `engine` executes, by operation."""
+    if not METRICS_ENABLED:
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
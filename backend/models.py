@@ -11,10 +11,146 @@ class User(db.Model):
     email = db.Column(db.String(255), unique=True)
     access_token = db.Column(db.Text(), nullable=False)
     refresh_token = db.Column(db.String(255))
-    expires_at = db.Column(db.Integer)
+    expires_at = db.Column(db.Integer, index=True)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     last_login = db.Column(db.DateTime, onupdate=db.func.now())
     is_admin = db.Column(db.Boolean, default=False)
     
     def __repr__(self):
-        return f'<User {self.display_name}>'
\ No newline at end of file
+        return f'<User {self.display_name}>'
+
+# Listening history, ingested from me/player/recently-played. Tracks and artists are shared by all
+# users; plays are keyed on (user_id, played_at) so re-ingesting an overlapping page is a no-op.
+track_artists = db.Table(
+    'track_artists',
+    db.Column('track_id', db.String(255), db.ForeignKey('tracks.id'), primary_key=True),
+    db.Column('artist_id', db.String(255), db.ForeignKey('artists.id'), primary_key=True),
+    db.Column('position', db.SmallInteger, nullable=False, default=0)  # Order in the track's credits
+)
+
+class Artist(db.Model):
+    __tablename__ = 'artists'
+    
+    id = db.Column(db.String(255), primary_key=True)  # Spotify ID
+    name = db.Column(db.String(255))
+    
+    def __repr__(self):
+        return f'<Artist {self.name}>'
+
+class Track(db.Model):
+    __tablename__ = 'tracks'
+    
+    id = db.Column(db.String(255), primary_key=True)  # Spotify ID
+    name = db.Column(db.String(255))
+    album_id = db.Column(db.String(255))
+    album_name = db.Column(db.String(255))
+    duration_ms = db.Column(db.Integer)
+    explicit = db.Column(db.Boolean)
+    popularity = db.Column(db.SmallInteger)
+    artists = db.relationship('Artist', secondary=track_artists, order_by=track_artists.c.position, lazy='selectin')
+    
+    def __repr__(self):
+        return f'<Track {self.name}>'
+
+class Play(db.Model):
+    __tablename__ = 'plays'
+    
+    user_id = db.Column(db.String(255), db.ForeignKey('users.id'), primary_key=True)
+    played_at = db.Column(db.BigInteger, primary_key=True)  # Unix time in ms, the unit of Spotify's `after` cursor
+    track_id = db.Column(db.String(255), db.ForeignKey('tracks.id'), nullable=False, index=True)
+    context_uri = db.Column(db.String(255))  # Playlist/album/artist the track was played from, if any
+    
+    def __repr__(self):
+        return f'<Play {self.user_id} {self.track_id} @ {self.played_at}>'
+
+# Mirror of each user's saved tracks ("Liked Songs"), kept current by the library sync job
+class SavedTrack(db.Model):
+    __tablename__ = 'saved_tracks'
+    
+    user_id = db.Column(db.String(255), db.ForeignKey('users.id'), primary_key=True)
+    track_id = db.Column(db.String(255), db.ForeignKey('tracks.id'), primary_key=True)
+    added_at = db.Column(db.BigInteger, nullable=False)  # Unix time in ms
+    
+    __table_args__ = (db.Index('ix_saved_tracks_user_added_at', 'user_id', 'added_at'),)
+    
+    def __repr__(self):
+        return f'<SavedTrack {self.user_id} {self.track_id}>'
+
+class LibrarySync(db.Model):
+    __tablename__ = 'library_syncs'
+    
+    user_id = db.Column(db.String(255), db.ForeignKey('users.id'), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)  # Library size Spotify reported at the last sync
+    synced_at = db.Column(db.Integer)  # Unix time of the last sync of any kind
+    full_synced_at = db.Column(db.Integer)  # Unix time of the last full page-through
+    
+    def __repr__(self):
+        return f'<LibrarySync {self.user_id} @ {self.synced_at}>'
+
+# Audio features never change for a track, so this is a permanent cache shared by all users.
+# A row with available=False records that Spotify has no features for the track.
+class TrackFeatures(db.Model):
+    __tablename__ = 'track_features'
+    
+    track_id = db.Column(db.String(255), primary_key=True)  # Spotify ID (not necessarily in `tracks`)
+    available = db.Column(db.Boolean, nullable=False, default=True)
+    danceability = db.Column(db.Float)
+    energy = db.Column(db.Float)
+    valence = db.Column(db.Float)
+    acousticness = db.Column(db.Float)
+    instrumentalness = db.Column(db.Float)
+    liveness = db.Column(db.Float)
+    speechiness = db.Column(db.Float)
+    tempo = db.Column(db.Float)
+    loudness = db.Column(db.Float)
+    key = db.Column(db.SmallInteger)
+    mode = db.Column(db.SmallInteger)
+    time_signature = db.Column(db.SmallInteger)
+    duration_ms = db.Column(db.Integer)
+    fetched_at = db.Column(db.Integer)  # Unix time
+    
+    def __repr__(self):
+        return f'<TrackFeatures {self.track_id}>'
+
+# Cross-user artist -> genres cache, filled from every full artist payload we see and from
+# batched `artists?ids=` lookups. Not tied to `artists`, since top-items artists are never stored there.
+class ArtistGenres(db.Model):
+    __tablename__ = 'artist_genres'
+    
+    artist_id = db.Column(db.String(255), primary_key=True)  # Spotify ID
+    genres = db.Column(db.JSON, nullable=False)  # List of genre names, possibly empty
+    fetched_at = db.Column(db.Integer, nullable=False, index=True)  # Unix time
+    
+    def __repr__(self):
+        return f'<ArtistGenres {self.artist_id}>'
+
+# Precomputed per-user aggregates, one row per (user, stat, time range). Rows for Spotify's time
+# ranges hold finished payloads; the 'history' row also keeps the running sums and counts that new
+# plays are folded into, up to the `watermark` play.
+class UserStats(db.Model):
+    __tablename__ = 'user_stats'
+    
+    user_id = db.Column(db.String(255), db.ForeignKey('users.id'), primary_key=True)
+    stat = db.Column(db.String(32), primary_key=True)
+    time_range = db.Column(db.String(32), primary_key=True)
+    payload = db.Column(db.JSON, nullable=False)
+    state = db.Column(db.JSON)  # Running sums and counts, for incrementally maintained stats
+    watermark = db.Column(db.BigInteger)  # played_at (ms) of the newest play folded into `state`
+    computed_at = db.Column(db.Integer, nullable=False)  # Unix time
+    rebuilt_at = db.Column(db.Integer)  # Unix time of the last full recomputation of `state`
+    
+    def __repr__(self):
+        return f'<UserStats {self.user_id} {self.stat} {self.time_range}>'
+
+# Shared token bucket pacing every worker's Spotify API calls, one row per bucket. Tokens refill
+# lazily: whoever takes one first tops the bucket up for the time elapsed since `updated_at`.
+class RateLimitBucket(db.Model):
+    __tablename__ = 'rate_limit_buckets'
+    
+    name = db.Column(db.String(64), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)  # Unix time `tokens` was last refilled at
+    blocked_until = db.Column(db.Float, nullable=False, default=0)  # Unix time a 429's Retry-After ends
+    
+    def __repr__(self):
+        return f'<RateLimitBucket {self.name} {self.tokens:.1f}>'
@@ -0,0 +1,294 @@
+# rate_limiter.py
+import asyncio
+import os
+import threading
+import time
+
+from sqlalchemy import case, select, update
+
+from database import insert_ignore
+from models import db, RateLimitBucket
+
+SPOTIFY_RATE_LIMIT_ENABLED = os.getenv('SPOTIFY_RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+SPOTIFY_RATE_LIMIT_PER_SECOND = float(os.getenv('SPOTIFY_RATE_LIMIT_PER_SECOND', 10))
+SPOTIFY_RATE_LIMIT_BURST = float(os.getenv('SPOTIFY_RATE_LIMIT_BURST', 30))
+# Share of the burst background jobs may not dip into, so interactive calls always find tokens
+SPOTIFY_RATE_LIMIT_BACKGROUND_RESERVE = float(os.getenv('SPOTIFY_RATE_LIMIT_BACKGROUND_RESERVE', 0.25))
+SPOTIFY_RATE_LIMIT_INTERACTIVE_WAIT = float(os.getenv('SPOTIFY_RATE_LIMIT_INTERACTIVE_WAIT', 5))
+SPOTIFY_RATE_LIMIT_BACKGROUND_WAIT = float(os.getenv('SPOTIFY_RATE_LIMIT_BACKGROUND_WAIT', 60))
+# Retry-After to assume when a 429 comes without one
+SPOTIFY_RATE_LIMIT_DEFAULT_RETRY_AFTER = float(os.getenv('SPOTIFY_RATE_LIMIT_DEFAULT_RETRY_AFTER', 5))
+# Tokens a worker takes from the shared bucket per visit, and seconds it may hold unused ones
+SPOTIFY_RATE_LIMIT_LEASE_SIZE = int(os.getenv('SPOTIFY_RATE_LIMIT_LEASE_SIZE', 5))
+SPOTIFY_RATE_LIMIT_LEASE_TTL = float(os.getenv('SPOTIFY_RATE_LIMIT_LEASE_TTL', 1.0))
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+# Longest single sleep between attempts, so waiters notice tokens freed by a quiet spell promptly
+MAX_POLL_INTERVAL = 0.5
+
+
+def parse_retry_after(value, default=SPOTIFY_RATE_LIMIT_DEFAULT_RETRY_AFTER):
+    """Seconds to back off for a Retry-After header value (Spotify sends delta-seconds)."""
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+class RateLimiter:
+    """
+    App-wide token bucket for Spotify API calls, kept in the `rate_limit_buckets` table so every
+    worker process draws from the same budget. Taking a token is a single conditional UPDATE that also
+    refills the bucket for the time elapsed, so there is no refill job. A 429 empties the bucket and
+    blocks it until its Retry-After has passed, for every worker at once.
+
+    Calls are prioritized: interactive (user-facing) calls may use the whole bucket, background jobs
+    leave `background_reserve` of it alone, and within a process no background call takes a token
+    while an interactive one is waiting. If the table cannot be reached the limiter lets calls through
+    rather than failing them.
+
+    Visiting the bucket is a database round trip: a short transaction on its own pooled connection
+    (one or two UPDATEs on the hot bucket row, plus a SELECT when no token is left). To keep that off
+    most calls, a worker leases up to `lease_size` tokens per visit and hands them out locally for
+    `lease_ttl` seconds, so under load there is one round trip per `lease_size` calls. Leased tokens
+    left unused are dropped rather than returned, and a 429 drops them at once, so the limiter only
+    ever errs on the slow side.
+
+    :param app: The Flask app, used to push an app context for database work
+    """
+
+    def __init__(self, app, name='spotify',
+                 rate=SPOTIFY_RATE_LIMIT_PER_SECOND,
+                 burst=SPOTIFY_RATE_LIMIT_BURST,
+                 background_reserve=SPOTIFY_RATE_LIMIT_BACKGROUND_RESERVE,
+                 max_wait=None,
+                 lease_size=SPOTIFY_RATE_LIMIT_LEASE_SIZE,
+                 lease_ttl=SPOTIFY_RATE_LIMIT_LEASE_TTL,
+                 enabled=SPOTIFY_RATE_LIMIT_ENABLED):
+        self.app = app
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.enabled = enabled
+        self.lease_size = max(lease_size, 1)
+        self.lease_ttl = lease_ttl
+        # Tokens a caller needs to see in the bucket before it may take one
+        self.thresholds = {INTERACTIVE: 1.0, BACKGROUND: 1.0 + background_reserve * burst}
+        self.max_wait = max_wait or {
+            INTERACTIVE: SPOTIFY_RATE_LIMIT_INTERACTIVE_WAIT,
+            BACKGROUND: SPOTIFY_RATE_LIMIT_BACKGROUND_WAIT
+        }
+
+        self._waiting = {INTERACTIVE: 0, BACKGROUND: 0}
+        # priority -> [leased tokens left, monotonic() time they expire]; leases taken at the
+        # background threshold stay with background calls, so they never dip into the reserve
+        self._leases = {INTERACTIVE: [0, 0.0], BACKGROUND: [0, 0.0]}
+        self._lock = threading.Lock()
+        # Updated from request, fan-out and ingestion threads alike, so only under the lock
+        self.metrics = {
+            'granted': {INTERACTIVE: 0, BACKGROUND: 0},
+            'waited': {INTERACTIVE: 0, BACKGROUND: 0},
+            'denied': {INTERACTIVE: 0, BACKGROUND: 0},
+            'leased': 0,
+            'bucket_visits': 0,
+            'throttled': 0,
+            'errors': 0
+        }
+
+    def ensure_bucket(self):
+        """Creates the bucket row, full, if it does not exist yet. Needs an app context."""
+        insert_ignore(RateLimitBucket, [{
+            'name': self.name, 'tokens': self.burst, 'updated_at': time.time(), 'blocked_until': 0
+        }])
+        db.session.commit()
+
+    def _refilled(self, now):
+        # The bucket's level at `now`, capped at the burst size
+        level = RateLimitBucket.tokens + (now - RateLimitBucket.updated_at) * self.rate
+        return case((level > self.burst, self.burst), else_=level)
+
+    def _take_leased(self, priority):
+        with self._lock:
+            lease = self._leases[priority]
+            if lease[0] > 0 and time.monotonic() < lease[1]:
+                lease[0] -= 1
+                self.metrics['leased'] += 1
+                return True
+            lease[0] = 0
+            return False
+
+    def _hold_lease(self, priority, tokens):
+        with self._lock:
+            self._leases[priority] = [tokens, time.monotonic() + self.lease_ttl]
+
+    def _count(self, counter):
+        with self._lock:
+            self.metrics[counter] += 1
+
+    def _drop_leases(self):
+        with self._lock:
+            for lease in self._leases.values():
+                lease[0] = 0
+
+    def try_take(self, priority=INTERACTIVE):
+        """
+        Takes one token, from this worker's lease if it still holds one. Otherwise visits the bucket
+        and, if it is not blocked and holds at least the priority's threshold, takes `lease_size`
+        tokens (or just one when fewer are left) and keeps the rest as the new lease.
+        Returns `(granted, wait)`, `wait` being the seconds until another attempt can succeed.
+        """
+        if self._take_leased(priority):
+            return True, 0.0
+        now = time.time()
+        threshold = self.thresholds[priority]
+        self._count('bucket_visits')
+        try:
+            with self.app.app_context(), db.engine.begin() as connection:
+                refilled = self._refilled(now)
+                # Leave at least the threshold less one behind, as taking a single token would
+                for size in sorted({self.lease_size, 1}, reverse=True):
+                    taken = connection.execute(
+                        update(RateLimitBucket)
+                        .where(RateLimitBucket.name == self.name)
+                        .where(RateLimitBucket.blocked_until <= now)
+                        .where(refilled >= threshold + size - 1)
+                        .values(tokens=refilled - size, updated_at=now)
+                    ).rowcount
+                    if taken:
+                        self._hold_lease(priority, size - 1)
+                        return True, 0.0
+                row = connection.execute(
+                    select(refilled, RateLimitBucket.blocked_until).where(RateLimitBucket.name == self.name)
+                ).first()
+        except Exception as e:
+            self._count('errors')
+            print(f"Rate limiter error, letting the call through: {str(e)}")
+            return True, 0.0
+
+        if row is None:
+            return True, 0.0
+        tokens, blocked_until = row
+        if blocked_until > now:
+            return False, blocked_until - now
+        return False, max((threshold - tokens) / self.rate, 0.001)
+
+    def _yield_to_interactive(self, priority):
+        return priority == BACKGROUND and self._waiting[INTERACTIVE] > 0
+
+    def _attempt(self, priority):
+        # The in-process half of the priority queue: background calls wait while interactive ones do
+        if self._yield_to_interactive(priority):
+            return False, MAX_POLL_INTERVAL
+        return self.try_take(priority)
+
+    def _begin(self, priority, max_wait):
+        with self._lock:
+            self._waiting[priority] += 1
+        return time.monotonic() + (self.max_wait[priority] if max_wait is None else max_wait)
+
+    def _end(self, priority, granted, waited):
+        with self._lock:
+            self._waiting[priority] -= 1
+            if granted:
+                self.metrics['granted'][priority] += 1
+                if waited:
+                    self.metrics['waited'][priority] += 1
+            else:
+                self.metrics['denied'][priority] += 1
+
+    def acquire(self, priority=INTERACTIVE, max_wait=None):
+        """
+        Blocks until a token is taken or the maximum wait (by default the priority's) runs out.
+        :return: A tuple of whether the call may go ahead and, if not, the seconds until it could
+        """
+        if not self.enabled:
+            return True, 0.0
+        deadline = self._begin(priority, max_wait)
+        granted, wait, waited = False, 0.0, False
+        try:
+            while True:
+                granted, wait = self._attempt(priority)
+                remaining = deadline - time.monotonic()
+                if granted or wait > remaining:
+                    return granted, wait
+                waited = True
+                time.sleep(min(wait, MAX_POLL_INTERVAL))
+        finally:
+            self._end(priority, granted, waited)
+
+    async def acquire_async(self, priority=INTERACTIVE, max_wait=None):
+        """`acquire` for the ASGI serving mode: the UPDATE runs in a thread and waits are awaited."""
+        if not self.enabled:
+            return True, 0.0
+        deadline = self._begin(priority, max_wait)
+        granted, wait, waited = False, 0.0, False
+        try:
+            while True:
+                if self._yield_to_interactive(priority):
+                    granted, wait = False, MAX_POLL_INTERVAL
+                elif self._take_leased(priority):
+                    granted, wait = True, 0.0
+                else:
+                    granted, wait = await asyncio.to_thread(self.try_take, priority)
+                remaining = deadline - time.monotonic()
+                if granted or wait > remaining:
+                    return granted, wait
+                waited = True
+                await asyncio.sleep(min(wait, MAX_POLL_INTERVAL))
+        finally:
+            self._end(priority, granted, waited)
+
+    def throttle(self, retry_after):
+        """Empties the bucket and blocks it for `retry_after` seconds, after Spotify answered 429."""
+        self._count('throttled')
+        self._drop_leases()
+        if not self.enabled:
+            return
+        now = time.time()
+        blocked_until = now + retry_after
+        try:
+            with self.app.app_context(), db.engine.begin() as connection:
+                connection.execute(
+                    update(RateLimitBucket)
+                    .where(RateLimitBucket.name == self.name)
+                    .values(
+                        tokens=0,
+                        updated_at=blocked_until,
+                        blocked_until=case(
+                            (RateLimitBucket.blocked_until > blocked_until, RateLimitBucket.blocked_until),
+                            else_=blocked_until
+                        )
+                    )
+                )
+        except Exception as e:
+            self._count('errors')
+            print(f"Rate limiter error recording a 429: {str(e)}")
+
+    def budget(self):
+        """The shared bucket's current level and block, as every worker sees it."""
+        now = time.time()
+        with self.app.app_context():
+            row = db.session.execute(
+                select(self._refilled(now), RateLimitBucket.blocked_until).where(RateLimitBucket.name == self.name)
+            ).first()
+        if row is None:
+            return {'tokens': None, 'blocked_for': 0}
+        return {'tokens': round(max(row[0], 0), 2), 'blocked_for': round(max(row[1] - now, 0), 2)}
+
+    def stats(self):
+        budget = self.budget()
+        with self._lock:
+            waiting = dict(self._waiting)
+            metrics = {name: dict(value) if isinstance(value, dict) else value for name, value in self.metrics.items()}
+        return {
+            'enabled': self.enabled,
+            'rate': self.rate,
+            'burst': self.burst,
+            'background_threshold': self.thresholds[BACKGROUND],
+            'lease_size': self.lease_size,
+            **budget,
+            'waiting': waiting,
+            **metrics
+        }
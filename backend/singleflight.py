@@ -0,0 +1,91 @@
+# singleflight.py
+import asyncio
+import threading
+
+from deadlines import remaining, BUDGET_EXHAUSTED_ERROR
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: the first caller for a key (the leader) runs the call and
+    every caller arriving while it is in flight waits for and shares its result instead of making its
+    own. Nothing is kept once the call completes, so this never serves stale data; results are
+    shared objects and must be treated as read-only.
+
+    Calls return `(data, error)` tuples. A follower waits no longer than its own latency budget
+    (see `deadlines`), then gets `(None, BUDGET_EXHAUSTED_ERROR)` while the leader carries on.
+
+    `do` coalesces threads within the process, `do_async` coroutines on the same event loop.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+        self.metrics = {'leaders': 0, 'coalesced': 0}
+
+    def do(self, key, fn):
+        """Returns `fn()`, or the result of an identical call already in flight for `key`."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.metrics['leaders'] += 1
+            else:
+                self.metrics['coalesced'] += 1
+
+        if not leader:
+            if not call.done.wait(timeout=remaining()):
+                return None, BUDGET_EXHAUSTED_ERROR
+            if call.exception is not None:
+                raise call.exception
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.exception = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key, fn):
+        """Async variant of `do`, where `fn` is a coroutine function. Needs a running event loop."""
+        calls = self._async_calls.setdefault(asyncio.get_running_loop(), {})
+        future = calls.get(key)
+        if future is not None:
+            self.metrics['coalesced'] += 1
+            # Shielded so one cancelled (or timed out) follower does not cancel the call for everybody else
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), remaining())
+            except asyncio.TimeoutError:
+                return None, BUDGET_EXHAUSTED_ERROR
+
+        self.metrics['leaders'] += 1
+        future = calls[key] = asyncio.ensure_future(fn())
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if future.done():
+                calls.pop(key, None)
+            else:
+                future.add_done_callback(lambda _: calls.pop(key, None))
+
+    def stats(self):
+        total = self.metrics['leaders'] + self.metrics['coalesced']
+        return {
+            **self.metrics,
+            'in_flight': len(self._calls) + sum(len(calls) for calls in self._async_calls.values()),
+            'coalesced_ratio': self.metrics['coalesced'] / total if total else 0.0
+        }
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# Run against a throwaway SQLite database, without the background jobs
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.sqlite')}")
+os.environ.setdefault('TOKEN_REFRESHER_ENABLED', 'false')
+os.environ.setdefault('INGESTION_ENABLED', 'false')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
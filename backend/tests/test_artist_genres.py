@@ -0,0 +1,19 @@
+import threading
+
+from artist_genres import ArtistGenreCache
+
+
+def test_counters_add_up_under_concurrent_lookups():
+    cache = ArtistGenreCache()
+    cache.memory.set('artist', ['indie rock'], cache.ttl)
+    threads = [
+        threading.Thread(target=lambda: [cache.get_many(['artist']) for _ in range(2000)])
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cache.stats()['memory_hits'] == 8 * 2000
+    assert cache.stats()['misses'] == 0
@@ -0,0 +1,24 @@
+import threading
+
+from cache import InMemoryBackend, ResponseCache
+
+
+def test_counters_add_up_under_concurrent_lookups():
+    cache = ResponseCache(InMemoryBackend())
+    cache.get_or_fetch('user', 'me/top/tracks', {'time_range': 'short_term'}, lambda: ({'items': []}, None))
+    threads = [
+        threading.Thread(target=lambda: [
+            cache.get_or_fetch('user', 'me/top/tracks', {'time_range': 'short_term'}, lambda: (None, 'unexpected'))
+            for _ in range(2000)
+        ])
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = cache.stats()
+    assert stats['hits'] == 8 * 2000
+    assert stats['misses'] == 1
+    assert stats['hit_ratio'] == 16000 / 16001
@@ -0,0 +1,20 @@
+import app as backend
+from fanout import fan_out
+from metrics import FANOUT_DURATION
+
+
+def batch_count(calls):
+    return sum(
+        value for name, labels, value in FANOUT_DURATION.samples()
+        if name.endswith('_count') and labels['calls'] == calls
+    )
+
+
+def test_fan_out_records_its_duration_instead_of_printing(capsys):
+    before = batch_count('2')
+
+    results = fan_out(backend.app, {'a': lambda: ('a', None), 'b': lambda: ('b', None)})
+
+    assert results == {'a': ('a', None), 'b': ('b', None)}
+    assert batch_count('2') == before + 1
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,42 @@
+from feature_stats import STAT_FEATURES, feature_means, pack_features
+
+FEATURES = [
+    {'energy': 0.1, 'danceability': 0.5, 'valence': 0.7, 'acousticness': 0.3, 'instrumentalness': 0.0,
+     'liveness': 0.11, 'speechiness': 0.05, 'tempo': 120.0},
+    {'energy': 0.2, 'danceability': 0.6, 'valence': 0.1, 'acousticness': 0.3, 'instrumentalness': 0.9,
+     'liveness': 0.12, 'speechiness': 0.04, 'tempo': 98.5},
+    None,
+    {'energy': 0.3, 'danceability': 0.7, 'valence': 0.4, 'acousticness': 0.3, 'instrumentalness': 0.01,
+     'liveness': 0.13, 'speechiness': 0.03, 'tempo': 140.25},
+]
+
+
+def baseline_means(features):
+    features = [f for f in features if f]
+    means = {name: sum(f.get(name, 0) for f in features) / len(features) for name in STAT_FEATURES}
+    means['track_count'] = len(features)
+    return means
+
+
+def test_feature_means_match_python_averages_exactly():
+    means = feature_means(pack_features(FEATURES))
+
+    assert means == baseline_means(FEATURES)
+    assert means['acousticness'] == 0.3
+    assert means['energy'] == (0.1 + 0.2 + 0.3) / 3
+
+
+def test_feature_means_match_for_more_rows_than_numpy_unrolls():
+    # NumPy's pairwise summation changes the order of additions from 8 rows on
+    features = [
+        {name: (i * 0.037 + j * 0.011) % 1 for j, name in enumerate(STAT_FEATURES)}
+        for i in range(50)
+    ]
+
+    assert feature_means(pack_features(features)) == baseline_means(features)
+
+
+def test_feature_means_without_tracks():
+    means = feature_means(pack_features([]))
+
+    assert means == {**{name: 0 for name in STAT_FEATURES}, 'track_count': 0}
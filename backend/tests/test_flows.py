@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+import app as backend
+import asgi
+from flows import Step, run, run_async
+from models import db, User
+
+USER_ID = 'flow-user'
+
+SPOTIFY_PAYLOADS = {
+    'me/tracks': {'total': 42},
+    'me/player/recently-played': {'items': [{'track': {'id': 't1'}}, {'track': {'id': 't2'}}]},
+    'me/top/tracks': {'items': [{'id': 't1', 'name': 'Clair de lune — Débussy'}]},
+}
+
+
+def lookup(step_log, name):
+    step_log.append(name)
+    if name == 'missing':
+        raise KeyError(name)
+    return name.upper()
+
+
+def lookup_flow(step_log):
+    found = yield Step(lookup, None, step_log, 'found')
+    try:
+        yield Step(lookup, None, step_log, 'missing')
+    except KeyError:
+        found += ' without missing'
+    return found
+
+
+async def offload(call, *args):
+    return call(*args)
+
+
+def test_run_and_run_async_drive_a_flow_alike():
+    sync_log, async_log = [], []
+
+    assert run(lookup_flow(sync_log)) == 'FOUND without missing'
+    assert asyncio.run(run_async(lookup_flow(async_log), offload)) == 'FOUND without missing'
+    assert sync_log == async_log == ['found', 'missing']
+
+
+def fake_spotify_request_flow(endpoint, params, access_token, priority=None):
+    yield from ()
+    return SPOTIFY_PAYLOADS[endpoint], None
+
+
+@pytest.fixture
+def token(monkeypatch):
+    monkeypatch.setattr(backend, 'spotify_request_flow', fake_spotify_request_flow)
+    with backend.app.app_context():
+        db.create_all()
+        if db.session.get(User, USER_ID) is None:
+            db.session.add(User(id=USER_ID, access_token='spotify-token', expires_at=int(time.time()) + 3600))
+            db.session.commit()
+        yield create_access_token(identity=USER_ID)
+
+
+def flask_get(path, token):
+    response = backend.app.test_client().get(path, headers={'Authorization': f'Bearer {token}'})
+    return response.status_code, response.get_data(), response.headers.get('ETag')
+
+
+def asgi_get(path, token):
+    route, _, query = path.partition('?')
+    scope = {
+        'type': 'http',
+        'method': 'GET',
+        'path': route,
+        'query_string': query.encode(),
+        'headers': [(b'authorization', f'Bearer {token}'.encode())],
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(asgi.application(scope, receive, send))
+    headers = dict(messages[0]['headers'])
+    etag = headers.get(b'etag')
+    return messages[0]['status'], messages[1]['body'], etag.decode() if etag else None
+
+
+@pytest.mark.parametrize('path', [
+    '/api/stats/library',
+    '/api/user/tracks?time_range=short_term',
+    '/api/dashboard?sections=tracks,library&time_range=short_term',
+    '/api/dashboard?sections=lyrics',
+])
+def test_flask_and_asgi_serve_identical_responses(token, path):
+    assert flask_get(path, token) == asgi_get(path, token)
@@ -0,0 +1,101 @@
+import asyncio
+import itertools
+import time
+
+from deadlines import BUDGET_EXHAUSTED_ERROR
+from hedging import LatencyTracker
+
+
+def warmed_tracker(latency=0.02):
+    tracker = LatencyTracker(min_samples=5, min_delay=0.01)
+    for _ in range(10):
+        tracker.record('me/top/tracks', latency)
+    return tracker
+
+
+def test_hedge_answers_when_the_first_request_is_slow():
+    tracker = warmed_tracker()
+    calls = itertools.count()
+
+    def call():
+        if next(calls) == 0:
+            time.sleep(0.5)
+            return 'slow'
+        return 'fast'
+
+    assert tracker.call('me/top/tracks', call, lambda: True, timeout=1.0) == ('fast', None)
+    assert tracker.metrics == {'hedged': 1, 'hedge_won': 1}
+
+
+def test_both_requests_pending_at_the_timeout():
+    tracker = warmed_tracker()
+
+    started = time.monotonic()
+    result = tracker.call('me/top/tracks', lambda: time.sleep(1.0), lambda: True, timeout=0.2)
+
+    assert result == (None, BUDGET_EXHAUSTED_ERROR)
+    assert time.monotonic() - started < 0.5
+
+
+def test_unhedged_request_pending_at_the_timeout():
+    tracker = warmed_tracker()
+
+    result = tracker.call('me/top/tracks', lambda: time.sleep(1.0), lambda: False, timeout=0.2)
+
+    assert result == (None, BUDGET_EXHAUSTED_ERROR)
+
+
+def test_async_requests_pending_at_the_timeout_are_cancelled():
+    tracker = warmed_tracker()
+    cancelled = []
+
+    async def call():
+        try:
+            await asyncio.sleep(1.0)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def may_hedge():
+        return True
+
+    async def run():
+        started = time.monotonic()
+        result = await tracker.call_async('me/top/tracks', call, may_hedge, timeout=0.2)
+        await asyncio.sleep(0)
+        return result, time.monotonic() - started
+
+    result, elapsed = asyncio.run(run())
+
+    assert result == (None, BUDGET_EXHAUSTED_ERROR)
+    assert elapsed < 0.5
+    assert len(cancelled) == 2
+
+
+def test_request_without_a_hedge_delay_is_bounded_by_the_timeout():
+    tracker = LatencyTracker(min_samples=5)
+
+    started = time.monotonic()
+    result = tracker.call('me/top/tracks', lambda: time.sleep(1.0), lambda: True, timeout=0.2)
+
+    assert result == (None, BUDGET_EXHAUSTED_ERROR)
+    assert time.monotonic() - started < 0.5
+    assert tracker.metrics['hedged'] == 0
+
+
+def test_async_request_without_a_hedge_delay_is_bounded_by_the_timeout():
+    tracker = LatencyTracker(min_samples=5)
+
+    async def call():
+        await asyncio.sleep(1.0)
+
+    async def may_hedge():
+        return True
+
+    assert asyncio.run(tracker.call_async('me/top/tracks', call, may_hedge, timeout=0.2)) == (None, BUDGET_EXHAUSTED_ERROR)
+
+
+def test_request_without_a_timeout_runs_to_completion():
+    tracker = LatencyTracker(min_samples=5)
+
+    assert tracker.call('me/top/tracks', lambda: (time.sleep(0.05), 'done')[1], lambda: True, timeout=None) == ('done', None)
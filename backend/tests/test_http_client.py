@@ -0,0 +1,47 @@
+import socket
+import threading
+
+import pytest
+import requests
+
+from http_client import spotify_get
+
+
+@pytest.fixture
+def silent_server():
+    """A server that accepts connections and never answers, counting the connections."""
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+    accepted = []
+
+    def accept():
+        while True:
+            try:
+                accepted.append(server.accept()[0])
+            except OSError:
+                return
+
+    threading.Thread(target=accept, daemon=True).start()
+    yield f'http://127.0.0.1:{server.getsockname()[1]}', accepted
+    server.close()
+    for connection in accepted:
+        connection.close()
+
+
+def test_reads_are_retried_by_default(silent_server):
+    url, accepted = silent_server
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        spotify_get(url, timeout=0.1)
+
+    assert len(accepted) == 3
+
+
+def test_budgeted_reads_are_not_retried(silent_server):
+    url, accepted = silent_server
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        spotify_get(url, retry=False, timeout=0.1)
+
+    assert len(accepted) == 1
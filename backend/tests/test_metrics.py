@@ -0,0 +1,50 @@
+from flask import Flask
+
+from metrics import HTTP_REQUESTS, HTTP_REQUEST_DURATION, note_response_status, record_request, start_request_timer
+
+
+def instrumented_app():
+    app = Flask(__name__)
+    app.before_request(start_request_timer)
+    app.after_request(note_response_status)
+    app.teardown_request(record_request)
+
+    @app.route('/metrics-test/ok')
+    def ok():
+        return {'status': 'ok'}
+
+    @app.route('/metrics-test/boom')
+    def boom():
+        raise RuntimeError('boom')
+
+    return app
+
+
+def request_count(route, status):
+    counts = {(labels['route'], labels['status']): value for _, labels, value in HTTP_REQUESTS.samples()}
+    return counts.get((route, status), 0)
+
+
+def duration_count(route):
+    return sum(
+        value for name, labels, value in HTTP_REQUEST_DURATION.samples()
+        if name.endswith('_count') and labels['route'] == route
+    )
+
+
+def test_successful_requests_are_recorded_with_their_status():
+    client = instrumented_app().test_client()
+
+    assert client.get('/metrics-test/ok').status_code == 200
+
+    assert request_count('/metrics-test/ok', '200') == 1
+    assert duration_count('/metrics-test/ok') == 1
+
+
+def test_requests_that_raise_are_recorded_as_500s():
+    client = instrumented_app().test_client()
+
+    assert client.get('/metrics-test/boom').status_code == 500
+
+    assert request_count('/metrics-test/boom', '500') == 1
+    assert duration_count('/metrics-test/boom') == 1
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+import app as backend
+from flows import run
+from rate_limiter import BACKGROUND, INTERACTIVE, RateLimiter
+
+
+def make_limiter(name, **settings):
+    limiter = RateLimiter(backend.app, name=name, rate=0.001, burst=10, enabled=True, **settings)
+    with backend.app.app_context():
+        limiter.ensure_bucket()
+    return limiter
+
+
+def test_tokens_are_leased_in_batches():
+    limiter = make_limiter('lease-batches', lease_size=5)
+
+    granted = [limiter.try_take(INTERACTIVE)[0] for _ in range(10)]
+
+    assert granted == [True] * 10
+    assert limiter.metrics['bucket_visits'] == 2
+    assert limiter.metrics['leased'] == 8
+    assert limiter.try_take(INTERACTIVE)[0] is False
+
+
+def test_last_tokens_are_taken_one_at_a_time():
+    limiter = make_limiter('lease-remainder', lease_size=4)
+
+    granted = [limiter.try_take(INTERACTIVE)[0] for _ in range(10)]
+
+    # Two full leases of four, then the two tokens left one visit each
+    assert granted == [True] * 10
+    assert limiter.metrics['bucket_visits'] == 4
+
+
+def test_background_leases_respect_the_reserve():
+    limiter = make_limiter('lease-reserve', lease_size=5, background_reserve=0.5)
+
+    granted = sum(limiter.try_take(BACKGROUND)[0] for _ in range(10))
+
+    # The background threshold is 6 tokens, so 5 of the 10 can be taken
+    assert granted == 5
+    assert limiter.try_take(INTERACTIVE)[0] is True
+
+
+def test_throttle_drops_leased_tokens():
+    limiter = make_limiter('lease-throttle', lease_size=5)
+    assert limiter.try_take(INTERACTIVE)[0] is True
+
+    limiter.throttle(30)
+
+    granted, wait = limiter.try_take(INTERACTIVE)
+    assert granted is False
+    assert wait > 25
+
+
+def test_async_acquire_uses_the_lease_without_a_bucket_visit():
+    limiter = make_limiter('lease-async', lease_size=5)
+
+    async def acquire_five():
+        return [await limiter.acquire_async(INTERACTIVE, 0) for _ in range(5)]
+
+    results = asyncio.run(acquire_five())
+
+    assert [granted for granted, _ in results] == [True] * 5
+    assert limiter.metrics['bucket_visits'] == 1
+
+
+@pytest.mark.parametrize('lease_size', [0, 1])
+def test_without_leasing_every_call_visits_the_bucket(lease_size):
+    limiter = make_limiter(f'no-lease-{lease_size}', lease_size=lease_size)
+
+    for _ in range(3):
+        assert limiter.try_take(INTERACTIVE)[0] is True
+
+    assert limiter.metrics['bucket_visits'] == 3
+    assert limiter.metrics['leased'] == 0
+
+
+def test_denied_retry_after_a_429_reports_the_rate_limit(monkeypatch):
+    limiter = make_limiter('retry-denied', lease_size=1)
+    monkeypatch.setattr(backend, 'rate_limiter', limiter)
+    sent = []
+
+    class TooManyRequests:
+        status_code = 429
+        headers = {'Retry-After': '30'}
+
+        def json(self):
+            return {'error': {'status': 429, 'message': 'API rate limit exceeded'}}
+
+    def spotify_get(url, **kwargs):
+        sent.append(url)
+        return TooManyRequests()
+
+    monkeypatch.setattr(backend, 'spotify_get', spotify_get)
+
+    data, error = run(backend.spotify_request_flow('me/top/tracks', {}, 'token'))
+
+    assert data is None
+    assert error == "Rate limited: retry in 30s"
+    assert len(sent) == 1
+    assert limiter.metrics['throttled'] == 1
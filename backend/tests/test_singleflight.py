@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+
+from deadlines import BUDGET_EXHAUSTED_ERROR, budget
+from singleflight import SingleFlight
+
+
+def test_followers_share_the_leaders_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    results = []
+
+    def leader():
+        results.append(flight.do('key', lambda: (release.wait(), ({'items': []}, None))[1]))
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    while not flight.stats()['in_flight']:
+        time.sleep(0.001)
+    follower = threading.Thread(target=lambda: results.append(flight.do('key', lambda: ('own call', None))))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    thread.join()
+    follower.join()
+
+    assert results == [({'items': []}, None)] * 2
+    assert flight.metrics == {'leaders': 1, 'coalesced': 1}
+
+
+def test_follower_of_a_hung_leader_gives_up_at_its_budget():
+    flight = SingleFlight()
+    hung = threading.Event()
+    leader = threading.Thread(target=lambda: flight.do('key', lambda: (hung.wait(), (None, None))[1]), daemon=True)
+    leader.start()
+    while not flight.stats()['in_flight']:
+        time.sleep(0.001)
+
+    started = time.monotonic()
+    with budget(0.1):
+        result = flight.do('key', lambda: ('own call', None))
+
+    assert result == (None, BUDGET_EXHAUSTED_ERROR)
+    assert time.monotonic() - started < 0.5
+    hung.set()
+    leader.join()
+
+
+def test_async_follower_of_a_hung_leader_gives_up_at_its_budget():
+    flight = SingleFlight()
+
+    async def hang():
+        await asyncio.sleep(10)
+        return None, None
+
+    async def run():
+        leader = asyncio.ensure_future(flight.do_async('key', hang))
+        await asyncio.sleep(0)
+        with budget(0.1):
+            result = await flight.do_async('key', hang)
+        leader.cancel()
+        return result
+
+    assert asyncio.run(run()) == (None, BUDGET_EXHAUSTED_ERROR)
+
+
+def test_interactive_calls_do_not_join_a_background_leader(monkeypatch):
+    import app as backend
+    from rate_limiter import BACKGROUND
+
+    queued = threading.Event()
+    calls = []
+
+    def send(endpoint, params, access_token, priority):
+        yield from ()
+        calls.append(priority)
+        if priority == BACKGROUND:
+            # A background call waiting its turn in the rate limiter
+            queued.wait()
+        return {'priority': priority}, None
+
+    monkeypatch.setattr(backend, 'spotify_request_flow', send)
+    params = {'limit': 50}
+    leader = threading.Thread(target=backend.spotify_api_request, args=(
+        'user', 'me/player/recently-played', params, 'token', BACKGROUND
+    ))
+    leader.start()
+    while not calls:
+        time.sleep(0.001)
+
+    with budget(0.5):
+        result = backend.spotify_api_request('user', 'me/player/recently-played', params, access_token='token')
+
+    assert result == ({'priority': 'interactive'}, None)
+    queued.set()
+    leader.join()
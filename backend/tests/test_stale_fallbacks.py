@@ -0,0 +1,119 @@
+import time
+
+import pytest
+
+from flask_jwt_extended import create_access_token
+
+import app as backend
+from circuit_breaker import CIRCUIT_OPEN_ERROR, is_upstream_failure
+from deadlines import BUDGET_EXHAUSTED_ERROR, budget
+from fanout import fan_out
+from flows import run
+from models import db, User, UserStats
+from user_stats import COMPUTED_AT_HEADER, STALE_HEADER, USER_STATS_MAX_AGE, materialize, save
+
+USER_ID = 'stale-fallback-user'
+
+
+def slow_top_items(*args, **kwargs):
+    time.sleep(0.5)
+    return {'items': []}, None
+
+
+def slow_top_items_flow(*args, **kwargs):
+    yield from ()
+    return slow_top_items()
+
+
+@pytest.fixture
+def app_context():
+    with backend.app.app_context():
+        yield
+
+
+def test_late_fan_out_calls_count_as_upstream_failures(app_context):
+    with budget(0.05):
+        results = fan_out(backend.app, {'slow': lambda: slow_top_items()})
+
+    assert results['slow'] == (None, BUDGET_EXHAUSTED_ERROR)
+    assert is_upstream_failure(results['slow'][1])
+
+
+def test_slow_genre_fan_out_serves_stored_profile(app_context, monkeypatch):
+    stored = [{'genre': 'shoegaze', 'weight': 1.0}]
+    save(USER_ID, 'user_genres', 'all', stored)
+    monkeypatch.setattr(backend, 'top_items_flow', slow_top_items_flow)
+
+    with budget(0.05):
+        payload, computed_at, error = run(materialize(
+            USER_ID, 'user_genres', 'all', lambda: backend.compute_user_genres(USER_ID), max_age=0
+        ))
+
+    assert error is None
+    assert payload == stored
+    assert computed_at is not None
+
+
+def test_slow_dashboard_call_serves_cached_top_items(app_context):
+    cached = {'items': [{'id': 'track-1'}], 'limit': 50}
+    endpoint, params = backend.top_items_request('tracks', 'short_term')
+    backend.response_cache.get_or_fetch(USER_ID, endpoint, params, lambda: (cached, None))
+    plan = {'top_tracks': ('top', 'tracks', 'short_term')}
+
+    with budget(0.05):
+        results = backend.stale_top_items(USER_ID, plan, fan_out(backend.app, {'top_tracks': slow_top_items}))
+
+    data, error = results['top_tracks']
+    assert error is None
+    assert data['items'] == cached['items']
+    assert data['stale'] is True
+
+
+def open_circuit_flow(endpoint, params, access_token, priority=None):
+    yield from ()
+    return None, CIRCUIT_OPEN_ERROR
+
+
+@pytest.fixture
+def outage_client(app_context, monkeypatch):
+    monkeypatch.setattr(backend, 'spotify_request_flow', open_circuit_flow)
+    db.create_all()
+    if db.session.get(User, USER_ID) is None:
+        db.session.add(User(id=USER_ID, access_token='token', expires_at=int(time.time()) + 3600))
+    db.session.query(UserStats).filter(UserStats.user_id == USER_ID).delete()
+    db.session.commit()
+    client = backend.app.test_client()
+    client.set_cookie('access_token', create_access_token(identity=USER_ID))
+    return client
+
+
+def store_old(stat, time_range, payload):
+    save(USER_ID, stat, time_range, payload)
+    db.session.query(UserStats).filter_by(user_id=USER_ID, stat=stat, time_range=time_range).update(
+        {'computed_at': int(time.time()) - USER_STATS_MAX_AGE - 60}
+    )
+    db.session.commit()
+
+
+@pytest.mark.parametrize('path, stat, time_range', [
+    ('/api/stats/library', 'library', 'all'),
+    ('/api/stats/audio-features?detail=full', 'audio_features_detail', 'medium_term'),
+])
+def test_open_circuit_serves_the_last_stored_stats_marked_stale(outage_client, path, stat, time_range):
+    stored = {'saved_tracks': 42, 'recently_played': 50}
+    store_old(stat, time_range, stored)
+
+    response = outage_client.get(path)
+
+    assert response.status_code == 200
+    assert response.get_json() == stored
+    assert response.headers[STALE_HEADER] == 'true'
+    assert COMPUTED_AT_HEADER in response.headers
+
+
+@pytest.mark.parametrize('path', ['/api/stats/library', '/api/stats/audio-features?detail=full'])
+def test_open_circuit_without_stored_stats_is_a_503(outage_client, path):
+    response = outage_client.get(path)
+
+    assert response.status_code == 503
+    assert response.get_json() == {"error": CIRCUIT_OPEN_ERROR}
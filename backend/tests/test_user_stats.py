@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+import app as backend
+from models import db, Artist, Play, Track, TrackFeatures, User, UserStats, track_artists
+from user_stats import HISTORY_RANGE, HISTORY_STAT, history_stats, update_history_stats
+
+GENRES = {'a1': ['indie rock', 'rock'], 'a2': ['jazz'], 'a3': []}
+# track -> (artists, danceability or None for a track without features)
+TRACKS = {'t1': (['a1'], 0.5), 't2': (['a1', 'a2'], 0.8), 't3': (['a3'], None)}
+
+
+def genre_lookup(artist_ids):
+    return {artist_id: GENRES[artist_id] for artist_id in artist_ids if artist_id in GENRES}
+
+
+@pytest.fixture
+def context():
+    with backend.app.app_context():
+        db.create_all()
+        db.session.query(UserStats).delete()
+        db.session.query(Play).delete()
+        if db.session.get(User, 'listener') is None:
+            db.session.add(User(id='listener', access_token='token'))
+            for artist_id in GENRES:
+                db.session.add(Artist(id=artist_id, name=artist_id))
+            for track_id, (artist_ids, danceability) in TRACKS.items():
+                db.session.add(Track(id=track_id, name=track_id))
+                db.session.flush()
+                for position, artist_id in enumerate(artist_ids):
+                    db.session.execute(track_artists.insert().values(
+                        track_id=track_id, artist_id=artist_id, position=position
+                    ))
+                if danceability is not None:
+                    db.session.add(TrackFeatures(track_id=track_id, danceability=danceability, energy=danceability / 2))
+        db.session.commit()
+        yield
+
+
+def add_plays(plays):
+    for played_at, track_id in plays:
+        db.session.add(Play(user_id='listener', played_at=played_at, track_id=track_id))
+    db.session.commit()
+
+
+def stored_row():
+    return db.session.get(UserStats, ('listener', HISTORY_STAT, HISTORY_RANGE), populate_existing=True)
+
+
+def test_incremental_folding_matches_a_full_rebuild(context):
+    plays = [(1000, 't1'), (2000, 't2'), (3000, 't3'), (4000, 't2'), (5000, 't1'), (6000, 't2')]
+    for start in range(0, len(plays), 2):
+        add_plays(plays[start:start + 2])
+        update_history_stats('listener', genre_lookup)
+    incremental = stored_row()
+    incremental_state, incremental_payload = incremental.state, incremental.payload
+
+    update_history_stats('listener', genre_lookup, rebuild_interval=0)
+    rebuilt = stored_row()
+
+    assert rebuilt.watermark == incremental.watermark == 6000
+    assert incremental_payload == rebuilt.payload
+    assert incremental_state['play_count'] == rebuilt.state['play_count'] == 6
+    for key in ('tracks', 'artists', 'genres'):
+        assert incremental_state[key] == rebuilt.state[key]
+    for name, (total, squares, count) in rebuilt.state['features'].items():
+        assert incremental_state['features'][name] == [pytest.approx(total), pytest.approx(squares), count]
+
+
+def test_no_new_plays_still_marks_the_row_current(context):
+    add_plays([(1000, 't1')])
+    update_history_stats('listener', genre_lookup)
+    db.session.execute(
+        UserStats.__table__.update().values(computed_at=int(time.time()) - 7200)
+    )
+    db.session.commit()
+
+    payload, computed_at = history_stats('listener', genre_lookup)
+
+    assert payload['play_count'] == 1
+    assert time.time() - computed_at < 5
+    assert stored_row().computed_at == computed_at
@@ -0,0 +1,140 @@
+# token_refresher.py
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+TOKEN_REFRESHER_ENABLED = os.getenv('TOKEN_REFRESHER_ENABLED', 'true').lower() == 'true'
+TOKEN_REFRESH_INTERVAL = int(os.getenv('TOKEN_REFRESH_INTERVAL', 60))
+TOKEN_REFRESH_AHEAD = int(os.getenv('TOKEN_REFRESH_AHEAD', 300))
+TOKEN_REFRESH_ACTIVE_WINDOW = int(os.getenv('TOKEN_REFRESH_ACTIVE_WINDOW', 1800))
+TOKEN_REFRESH_CONCURRENCY = int(os.getenv('TOKEN_REFRESH_CONCURRENCY', 4))
+TOKEN_REFRESH_BATCH_SIZE = int(os.getenv('TOKEN_REFRESH_BATCH_SIZE', 100))
+
+
+class TokenRefresher:
+    """
+    Background job that refreshes Spotify tokens a few minutes before they expire, so user-facing
+    requests never pay for the refresh. Each worker process tracks the users it has served recently
+    and only refreshes those; when several workers pick the same user, the single-flight refresh
+    makes every one after the first a no-op.
+
+    :param app: The Flask app, used to push an app context for database work
+    :param find_expiring: Callable `(user_ids, horizon, limit)` returning IDs of those users whose
+    token expires at or before the `horizon` timestamp, soonest first
+    :param refresh: Callable `(user_id, min_validity)` returning `(access_token, error)`, refreshing
+    only if the token has less than `min_validity` seconds left
+    """
+
+    def __init__(self, app, find_expiring, refresh,
+                 interval=TOKEN_REFRESH_INTERVAL,
+                 ahead=TOKEN_REFRESH_AHEAD,
+                 active_window=TOKEN_REFRESH_ACTIVE_WINDOW,
+                 concurrency=TOKEN_REFRESH_CONCURRENCY,
+                 batch_size=TOKEN_REFRESH_BATCH_SIZE):
+        self.app = app
+        self.find_expiring = find_expiring
+        self.refresh = refresh
+        self.interval = interval
+        self.ahead = ahead
+        self.active_window = active_window
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+
+        self._active = {}
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+        self._stop = threading.Event()
+
+        self.metrics = {
+            'runs': 0,
+            'candidates': 0,
+            'refreshed': 0,
+            'failed': 0,
+            'last_run_at': None,
+            'last_run_seconds': None,
+        }
+
+    def mark_active(self, user_id):
+        """Records that a user was just served, and makes sure this worker's refresher is running."""
+        with self._lock:
+            self._active[user_id] = time.time()
+        if TOKEN_REFRESHER_ENABLED:
+            self.ensure_started()
+
+    def active_user_ids(self):
+        """Returns the users seen within the activity window, forgetting older ones."""
+        cutoff = time.time() - self.active_window
+        with self._lock:
+            for user_id in [u for u, seen in self._active.items() if seen < cutoff]:
+                self._active.pop(user_id, None)
+            return list(self._active.keys())
+
+    def ensure_started(self):
+        """Starts the background thread once per process (again after a fork)."""
+        pid = os.getpid()
+        if self._thread_pid == pid and self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread_pid == pid and self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='token-refresher', daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Token refresher error: {str(e)}")
+
+    def _refresh_in_context(self, user_id):
+        with self.app.app_context():
+            return self.refresh(user_id, self.ahead)
+
+    def run_once(self):
+        """Refreshes, with bounded concurrency, every active user whose token expires within `ahead` seconds."""
+        started = time.monotonic()
+        user_ids = self.active_user_ids()
+        refreshed = failed = candidates = 0
+
+        if user_ids:
+            horizon = int(time.time()) + self.ahead
+            with self.app.app_context():
+                due = self.find_expiring(user_ids, horizon, self.batch_size)
+            candidates = len(due)
+
+            if due:
+                with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='token-refresh') as pool:
+                    for user_id, (_, error) in zip(due, pool.map(self._refresh_in_context, due)):
+                        if error:
+                            failed += 1
+                            print(f"Background refresh failed for user {user_id}: {error}")
+                        else:
+                            refreshed += 1
+
+        elapsed = time.monotonic() - started
+        self.metrics['runs'] += 1
+        self.metrics['candidates'] += candidates
+        self.metrics['refreshed'] += refreshed
+        self.metrics['failed'] += failed
+        self.metrics['last_run_at'] = int(time.time())
+        self.metrics['last_run_seconds'] = round(elapsed, 4)
+        return refreshed, failed
+
+    def stats(self):
+        return {
+            **self.metrics,
+            'enabled': TOKEN_REFRESHER_ENABLED,
+            'active_users': len(self._active),
+            'interval': self.interval,
+            'ahead': self.ahead,
+            'concurrency': self.concurrency,
+        }
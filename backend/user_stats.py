@@ -0,0 +1,230 @@
+# user_stats.py
+import copy
+import os
+import time
+from collections import Counter
+
+from sqlalchemy import func, update
+
+from circuit_breaker import is_upstream_failure
+from database import upsert
+from feature_stats import STAT_FEATURES
+from flows import blocking
+from models import db, Play, TrackFeatures, UserStats, track_artists
+
+USER_STATS_MAX_AGE = int(os.getenv('USER_STATS_MAX_AGE', 3600))
+USER_STATS_REBUILD_INTERVAL = int(os.getenv('USER_STATS_REBUILD_INTERVAL', 24 * 3600))
+
+# The incrementally maintained row, over the user's whole stored play history
+HISTORY_STAT = 'history'
+HISTORY_RANGE = 'all_time'
+HISTORY_TOP_N = 10
+
+# Response header carrying the Unix time a materialized payload was computed at
+COMPUTED_AT_HEADER = 'X-Stats-Computed-At'
+# Response header set on payloads older than USER_STATS_MAX_AGE, served because Spotify was unavailable
+STALE_HEADER = 'X-Stats-Stale'
+
+
+def load_fresh(user_id, stat, time_range, max_age=USER_STATS_MAX_AGE):
+    """Returns `(payload, computed_at)` of a stored stat younger than `max_age` seconds, else `(None, None)`."""
+    row = db.session.get(UserStats, (user_id, stat, time_range))
+    if row and time.time() - row.computed_at < max_age:
+        return row.payload, row.computed_at
+    return None, None
+
+
+def load_stored(user_id, stat, time_range):
+    """Returns `(payload, computed_at)` of a stored stat however old it is, else `(None, None)`."""
+    row = db.session.get(UserStats, (user_id, stat, time_range))
+    return (row.payload, row.computed_at) if row else (None, None)
+
+
+def is_stale(computed_at, max_age=USER_STATS_MAX_AGE):
+    """Whether a payload computed at `computed_at` is past the age it is normally served up to."""
+    return computed_at is not None and time.time() - computed_at >= max_age
+
+
+def save(user_id, stat, time_range, payload):
+    """Stores a freshly computed payload and returns its `computed_at`."""
+    now = int(time.time())
+    upsert(UserStats, [{
+        'user_id': user_id,
+        'stat': stat,
+        'time_range': time_range,
+        'payload': payload,
+        'computed_at': now
+    }], ['user_id', 'stat', 'time_range'], ['payload', 'computed_at'])
+    db.session.commit()
+    return now
+
+
+def materialize(user_id, stat, time_range, compute, max_age=USER_STATS_MAX_AGE):
+    """
+    Flow (see `flows`) serving a stat from `user_stats` while it is fresh; otherwise computes it live
+    and stores the result for the next request. If the live computation fails because Spotify is
+    unavailable, the last stored payload is served however old it is (`is_stale` tells from its
+    `computed_at`).
+
+    :param compute: Zero-argument callable returning a flow that results in `(payload, error)`
+    :return: A tuple of the payload (or `None`), its `computed_at` and an error message or `None`
+    """
+    payload, computed_at = yield blocking(load_fresh, user_id, stat, time_range, max_age)
+    if payload is not None:
+        return payload, computed_at, None
+    payload, error = yield from compute()
+    if error:
+        if is_upstream_failure(error):
+            payload, computed_at = yield blocking(load_stored, user_id, stat, time_range)
+            if payload is not None:
+                return payload, computed_at, None
+        return None, None, error
+    return payload, (yield blocking(save, user_id, stat, time_range, payload)), None
+
+
+def empty_history_state():
+    return {
+        'play_count': 0,
+        'tracks': {},
+        'artists': {},
+        'genres': {},
+        # feature -> [sum, sum of squares, count of plays with a known value]
+        'features': {name: [0.0, 0.0, 0] for name in STAT_FEATURES}
+    }
+
+
+def fold_plays(user_id, state, after, until, genre_lookup):
+    """
+    Adds the user's plays with `after < played_at <= until` to the running sums and counts in
+    `state`, with one aggregate query each for tracks, artists and features. Returns the number of
+    plays folded in.
+    """
+    window = [Play.user_id == user_id, Play.played_at <= until]
+    if after is not None:
+        window.append(Play.played_at > after)
+
+    folded = 0
+    tracks = Counter(state['tracks'])
+    for track_id, plays in db.session.query(Play.track_id, func.count()).filter(*window).group_by(Play.track_id):
+        tracks[track_id] += plays
+        folded += plays
+
+    artist_plays = dict(
+        db.session.query(track_artists.c.artist_id, func.count())
+        .join(Play, Play.track_id == track_artists.c.track_id)
+        .filter(*window)
+        .group_by(track_artists.c.artist_id)
+        .all()
+    )
+    artists = Counter(state['artists'])
+    genres = Counter(state['genres'])
+    genres_by_artist = genre_lookup(list(artist_plays))
+    for artist_id, plays in artist_plays.items():
+        artists[artist_id] += plays
+        for genre in genres_by_artist.get(artist_id, []):
+            genres[genre] += plays
+
+    aggregates = []
+    for name in STAT_FEATURES:
+        column = getattr(TrackFeatures, name)
+        aggregates += [func.sum(column), func.sum(column * column), func.count(column)]
+    row = (
+        db.session.query(*aggregates)
+        .select_from(Play)
+        .join(TrackFeatures, TrackFeatures.track_id == Play.track_id)
+        .filter(*window, TrackFeatures.available.is_(True))
+        .one()
+    )
+    for index, name in enumerate(STAT_FEATURES):
+        total, squares, count = row[3 * index:3 * index + 3]
+        running = state['features'][name]
+        state['features'][name] = [running[0] + (total or 0), running[1] + (squares or 0), running[2] + count]
+
+    state['play_count'] += folded
+    state['tracks'], state['artists'], state['genres'] = dict(tracks), dict(artists), dict(genres)
+    return folded
+
+
+def history_payload(state, top_n=HISTORY_TOP_N):
+    """Endpoint-ready history stats derived from the running sums and counts."""
+    genres = Counter(state['genres']).most_common()
+    audio_features = {}
+    known = 0
+    for name in STAT_FEATURES:
+        total, squares, count = state['features'][name]
+        audio_features[name] = total / count if count else 0
+        known = max(known, count)
+    audio_features["track_count"] = known
+    audio_features["std"] = {
+        name: max(squares / count - (total / count) ** 2, 0) ** 0.5 if count else 0
+        for name, (total, squares, count) in state['features'].items()
+    }
+
+    return {
+        "play_count": state['play_count'],
+        "top_tracks": [{"id": k, "plays": v} for k, v in Counter(state['tracks']).most_common(top_n)],
+        "top_artists": [{"id": k, "plays": v} for k, v in Counter(state['artists']).most_common(top_n)],
+        "top_genres": {
+            "genres": [{"name": name, "count": count} for name, count in genres[:top_n]],
+            "top_genre": genres[0][0] if genres else "Unknown"
+        },
+        "audio_features": audio_features
+    }
+
+
+def update_history_stats(user_id, genre_lookup, rebuild_interval=USER_STATS_REBUILD_INTERVAL):
+    """
+    Folds the user's plays stored since the last update into their 'history' stats. The state is
+    recomputed from scratch every `rebuild_interval` seconds, which also picks up features and
+    genres that were unknown when a play was first folded in. Needs an app context.
+
+    :param genre_lookup: Callable taking artist IDs and returning a dict of ID -> genres
+    :return: A tuple of the number of plays folded in and an error message or `None`
+    """
+    until = db.session.query(func.max(Play.played_at)).filter(Play.user_id == user_id).scalar()
+    if until is None:
+        return 0, None
+
+    row = db.session.get(UserStats, (user_id, HISTORY_STAT, HISTORY_RANGE))
+    now = int(time.time())
+    rebuild = row is None or not row.state or not row.rebuilt_at or now - row.rebuilt_at >= rebuild_interval
+    if not rebuild and row.watermark is not None and until <= row.watermark:
+        # Nothing new, but the row is current again: without this, every request past `max_age`
+        # would repeat the watermark check until the next play arrives
+        db.session.execute(
+            update(UserStats)
+            .where(UserStats.user_id == user_id, UserStats.stat == HISTORY_STAT, UserStats.time_range == HISTORY_RANGE)
+            .values(computed_at=now)
+        )
+        db.session.commit()
+        return 0, None
+
+    state = empty_history_state() if rebuild else copy.deepcopy(row.state)
+    folded = fold_plays(user_id, state, None if rebuild else row.watermark, until, genre_lookup)
+
+    upsert(UserStats, [{
+        'user_id': user_id,
+        'stat': HISTORY_STAT,
+        'time_range': HISTORY_RANGE,
+        'payload': history_payload(state),
+        'state': state,
+        'watermark': until,
+        'computed_at': now,
+        'rebuilt_at': now if rebuild else row.rebuilt_at
+    }], ['user_id', 'stat', 'time_range'], ['payload', 'state', 'watermark', 'computed_at', 'rebuilt_at'])
+    db.session.commit()
+    return folded, None
+
+
+def history_stats(user_id, genre_lookup, max_age=USER_STATS_MAX_AGE):
+    """
+    Returns `(payload, computed_at)` of the user's 'history' stats, folding in new plays first if
+    the row is older than `max_age`; `(None, None)` if the user has no stored plays.
+    """
+    payload, computed_at = load_fresh(user_id, HISTORY_STAT, HISTORY_RANGE, max_age)
+    if payload is None:
+        update_history_stats(user_id, genre_lookup)
+        row = db.session.get(UserStats, (user_id, HISTORY_STAT, HISTORY_RANGE), populate_existing=True)
+        if row:
+            payload, computed_at = row.payload, row.computed_at
+    return payload, computed_at
@@ -5,14 +5,16 @@ import { Group } from '@visx/group';
 import { scaleOrdinal } from '@visx/scale';
 import * as d3 from 'd3-shape';
 import { useState, useMemo } from 'react';
-import { SunburstData, GenreData } from '@/types/genres';
+import { SunburstData, GenreTreeNode } from '@/types/genres';
 import { motion } from 'framer-motion';
 import { Card, CardContent } from '@/components/ui/card';
 import { Tooltip, TooltipContent, TooltipProvider, TooltipTrigger } from '@/components/ui/tooltip';
 
-// Type guard to check if node is GenreData
-function isGenreData(node: unknown): node is GenreData {
-  return typeof node === 'object' && node !== null && 'value' in node && typeof (node as GenreData).value === 'number';
+// Tree values are subtree totals, so each node adds only what its children don't already cover
+function ownValue(node: SunburstData | GenreTreeNode): number {
+  if (typeof node.value !== 'number') return 0;
+  const children = node.children ?? [];
+  return Math.max(node.value - children.reduce((total, child) => total + child.value, 0), 0);
 }
 
 // Modern color palette with vibrant colors
@@ -36,7 +38,7 @@ export function GenreSunburst({ data }: { data: SunburstData }) {
   // Memoize the hierarchy calculation
   const root = useMemo(() => {
     const rootNode = hierarchy<SunburstData>(data)
-      .sum(d => (isGenreData(d) ? d.value : 0))
+      .sum(ownValue)
       .sort((a, b) => (b.value || 0) - (a.value || 0));
     return partition<SunburstData>().size([2 * Math.PI, rootNode.height + 1])(rootNode);
   }, [data]);
@@ -3,29 +3,25 @@ import useSWR from 'swr';
 import { useState, useEffect } from 'react';
 import { GenreSunburst } from './GenreSunburst';
 import { Spinner } from '@/components/ui/spinner';
-import { proxyFetcher, transformGenreData } from '@/lib/utils';
-
-// Define the type for genre data
-interface GenreData {
-  [key: string]: number;
-}
+import { proxyFetcher } from '@/lib/utils';
+import { SunburstData } from '@/types/genres';
 
 export function GenreSunburstWrapper() {
   // Use state to track if proxy is needed
   const [isFirstAttempt, setIsFirstAttempt] = useState(true);
-  const [endpoint, setEndpoint] = useState<string>('/api/user/genres');
+  const [endpoint, setEndpoint] = useState<string>('/api/user/genres?view=tree');
 
   // First try with the Next.js API route (prevents CORS)
-  const { data, error, isLoading, mutate } = useSWR<GenreData>(
+  const { data, error, isLoading, mutate } = useSWR<SunburstData>(
     endpoint,
     proxyFetcher,
     {
       onError: (err) => {
         // If this is the first attempt and it failed, try direct URL
-        if (isFirstAttempt && endpoint === '/api/user/genres') {
+        if (isFirstAttempt && endpoint === '/api/user/genres?view=tree') {
           console.log('Trying direct backend URL for genres...', err);
           setIsFirstAttempt(false);
-          setEndpoint('http://localhost:5000/api/user/genres');
+          setEndpoint('http://localhost:5000/api/user/genres?view=tree');
           // This will trigger a new request with the updated URL
         }
       },
@@ -35,7 +31,7 @@ export function GenreSunburstWrapper() {
   
   // Effect to manually retry with different URL if needed
   useEffect(() => {
-    if (endpoint !== '/api/user/genres' && !isFirstAttempt) {
+    if (endpoint !== '/api/user/genres?view=tree' && !isFirstAttempt) {
       mutate(); // Trigger a refetch with new URL
     }
   }, [endpoint, isFirstAttempt, mutate]);
@@ -65,7 +61,7 @@ export function GenreSunburstWrapper() {
     );
   }
   
-  if (!data || Object.keys(data).length === 0) {
+  if (!data || !data.children?.length) {
     return (
       <div className="flex items-center justify-center h-full text-gray-500">
         No genre data available
@@ -73,8 +69,6 @@ export function GenreSunburstWrapper() {
     );
   }
   
-  // Use the utility function to transform data
-  const sunburstData = transformGenreData(data);
-
-  return <GenreSunburst data={sunburstData} />;
+  // The backend sends the genre hierarchy pre-aggregated, ready for the sunburst
+  return <GenreSunburst data={data} />;
 }
\ No newline at end of file
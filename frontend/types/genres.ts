@@ -1,11 +1,16 @@
 export type GenreResponse = Record<string, number>;
 
+// One node of the `/api/user/genres?view=tree` hierarchy; `value` is the node's subtree total
+export type GenreTreeNode = {
+  name: string;
+  value: number;
+  children?: GenreTreeNode[];
+};
+
 export type SunburstData = {
   name: string;
-  children: {
-    name: string;
-    value: number;
-  }[];
+  value?: number;
+  children: GenreTreeNode[];
 };
 export type GenreData = {
     name: string;